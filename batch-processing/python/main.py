@@ -1,16 +1,26 @@
+import os
 import time
-import requests
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from sync import Sync
 
+from metrics import metrics
+from monitor import BatchState, monitor_batches, monitor_manifest
+from outputs import download_output, join_outputs
+from progress import MAX_POLL_INTERVAL, MIN_POLL_INTERVAL, ProgressEstimator, batch_progress
+from sharding import MAX_BYTES, MAX_LINES, split_input, write_manifest
+from validate import validate_file
+
 sync = Sync()
 
 def create_batch(input_file, dry_run=False):
     try:
-        batch_response = sync.batch.create(
-            input=open(input_file, "rb"),
-            dry_run=dry_run
-        )
+        with metrics.span('create_batch') as span, open(input_file, "rb") as input_data:
+            span.add_bytes(os.path.getsize(input_file))
+            batch_response = sync.batch.create(
+                input=input_data,
+                dry_run=dry_run
+            )
     except Exception as e:
         print(f"Error creating batch: {e}")
         return None
@@ -20,36 +30,95 @@ def create_batch(input_file, dry_run=False):
     return batch_response.id
 
 
-def poll_batch_job(batch_id):
-    """Poll the batch job status until completion"""
-    batch_response = sync.batch.get(batch_id)
-    batch_status = batch_response.status
+def create_sharded_batch(input_file, manifest_path="", max_lines=MAX_LINES, max_bytes=MAX_BYTES, max_workers=4, dry_run=False):
+    """
+    Split the input file into shards within the batch limits and create a batch from each shard concurrently.
+
+    The shards are written next to the input file, to a directory named after it. The batch ID
+    of every shard is recorded in the manifest, a failed shard gets a null batch ID. Paths in
+    the manifest are absolute, so it can be used from any working directory.
+
+    Returns:
+        str: Path to the manifest, None for a dry run
+    """
+    input_file = os.path.abspath(input_file)
+    shard_dir = f'{os.path.splitext(input_file)[0]}_shards'
+    try:
+        shards = split_input(input_file, shard_dir, max_lines=max_lines, max_bytes=max_bytes)
+    except ValueError as e:
+        print(f"Error sharding input file: {e}")
+        return None
+    print(f"Split {input_file} into {len(shards)} shards in {shard_dir}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batch_ids = list(executor.map(lambda shard: create_batch(shard['path'], dry_run=dry_run), shards))
+    if dry_run:
+        return None
+
+    for shard, batch_id in zip(shards, batch_ids):
+        shard['batch_id'] = batch_id
+    manifest_path = manifest_path or os.path.join(shard_dir, 'manifest.json')
+    write_manifest(manifest_path, {'input_file': input_file, 'shards': shards})
+
+    failed = sum(1 for batch_id in batch_ids if not batch_id)
+    if failed:
+        print(f"Failed to create batches for {failed} of {len(shards)} shards")
+    return manifest_path if failed < len(shards) else None
+
+
+def poll_batch_job(batch_id, output_path=None, input_file=None, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL):
+    """
+    Poll the batch job status until completion, checking again when the ETA from its metrics is near.
+
+    The output is downloaded to output_path, output_<batch_id>.jsonl by default, and joined with
+    the requests of input_file if given.
+    """
+    output_path = output_path or f'output_{batch_id}.jsonl'
+    estimator = ProgressEstimator()
+    interval = min_interval
     while True:
+        with metrics.span('batch_status'):
+            batch_response = sync.batch.get(batch_id)
+        batch_status = batch_response.status
+        progress = batch_progress(batch_response)
         if batch_status == "COMPLETED" or batch_status == "FAILED":
             break
-        batch_response = sync.batch.get(batch_id)
-        print(f'Batch {batch_id} status: {batch_response.status}')
-        print(f'Batch {batch_id} metrics: {batch_response.metrics}')
-        batch_status = batch_response.status
-        time.sleep(60)
+        estimator.add(progress)
+        interval = estimator.next_interval(interval, min_interval, max_interval)
+        print(f'Batch {batch_id} {batch_status}: {estimator.describe(progress)}, next check in {interval:.0f}s')
+        time.sleep(interval)
+    if progress['total']:
+        print(f"Batch {batch_id} {batch_status}: {progress['finished']}/{progress['total']} requests finished, {progress['failed']} failed")
     output_url = batch_response.output_url
-    if output_url:
-        output_path = 'output.jsonl'
-        response = requests.get(output_url)
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
+    if not output_url:
+        print(f"Batch job {batch_id} {'completed' if batch_status == 'COMPLETED' else 'failed'} without an output file")
+        return
+    download_output(output_url, output_path)
     
     if batch_status == "COMPLETED":
         print(f"Batch job {batch_id} completed! Result saved to {output_path}")
     else:
         print(f"Batch job {batch_id} failed. Result saved to {output_path}")
+    if input_file:
+        join_outputs(input_file, output_path)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Create and optionally monitor batch processing jobs")
-    parser.add_argument("--input-file", help="Path to the input JSONL file for batch processing")
+    parser.add_argument("--input-file", help="Path to the input JSONL file for batch processing, with --batch-id the results are joined with it")
     parser.add_argument("--monitor", action="store_true", default=False, help="Poll for batch status until completion (default: False)")
-    parser.add_argument("--batch-id", help="Existing batch ID to monitor (requires --monitor flag)")
-    parser.add_argument("--dry-run", action="store_true", default=False, help="Validate input file without processing (default: False)")
+    parser.add_argument("--batch-id", nargs="+", help="Existing batch IDs to monitor, several are monitored concurrently (requires --monitor flag)")
+    parser.add_argument("--shard", action="store_true", default=False, help="Split the input file into shards within the batch limits and create a batch from each (default: False)")
+    parser.add_argument("--max-lines", type=int, default=MAX_LINES, help=f"Maximum requests per shard (default: {MAX_LINES})")
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES, help=f"Maximum shard size in bytes (default: {MAX_BYTES})")
+    parser.add_argument("--submit-workers", type=int, default=4, help="Number of shards submitted concurrently (default: 4)")
+    parser.add_argument("--manifest", help="Manifest of a sharded batch, written with --shard or monitored with --monitor")
+    parser.add_argument("--monitor-workers", type=int, default=8, help="Number of concurrent status checks and downloads when monitoring several batches (default: 8)")
+    parser.add_argument("--validate", action="store_true", default=False, help="Validate input file locally, without uploading it (default: False)")
+    parser.add_argument("--dry-run", action="store_true", default=False, help="Validate input file locally and with the API without processing (default: False)")
+    parser.add_argument("--min-poll-interval", type=float, default=MIN_POLL_INTERVAL, help=f"Minimum seconds between status checks (default: {MIN_POLL_INTERVAL})")
+    parser.add_argument("--max-poll-interval", type=float, default=MAX_POLL_INTERVAL, help=f"Maximum seconds between status checks (default: {MAX_POLL_INTERVAL})")
+    parser.add_argument("--metrics-report", default="", help="Write per stage timings, bytes and retries to this JSON report")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port while running (default: 0, disabled)")
     
     args = parser.parse_args()
     
@@ -57,33 +126,81 @@ if __name__ == "__main__":
     if args.batch_id:
         if not args.monitor:
             parser.error("--batch-id requires --monitor flag to be specified")
-        if args.dry_run:
-            parser.error("--dry-run cannot be used with --batch-id")
+        if args.dry_run or args.validate:
+            parser.error("--dry-run and --validate cannot be used with --batch-id")
+        if args.manifest or args.shard:
+            parser.error("--batch-id cannot be used with --manifest or --shard")
+        if args.input_file and len(args.batch_id) > 1:
+            parser.error("--input-file can only be joined with the results of a single --batch-id")
+    elif args.manifest and not args.input_file:
+        if not args.monitor:
+            parser.error("--manifest without --input-file requires --monitor flag to be specified")
+        if args.dry_run or args.validate:
+            parser.error("--dry-run and --validate require --input-file")
     else:
         if not args.input_file:
             parser.error("--input-file is required when not using --batch-id")
+        if args.manifest and not args.shard:
+            parser.error("--manifest with --input-file requires --shard flag to be specified")
     
-    if args.batch_id:
-        # Use existing batch ID for monitoring
-        batch_id = args.batch_id
-        print(f"Monitoring existing batch with ID: {batch_id}")
-        poll_batch_job(batch_id)
-    else:
-        # Create new batch or validate
-        batch_id = create_batch(args.input_file, dry_run=args.dry_run)
-        if batch_id:
-            print(f'Successfully created batch {batch_id}')
-        elif not args.dry_run:
-            print('Failed to create batch')
-            exit(1)
-        
-        if args.dry_run:
-            # Dry run mode - just validation, no monitoring
-            print("Validation complete. No batch was created.")
+    with metrics.recording(args.metrics_report, args.metrics_port):
+        if args.validate or args.dry_run:
+            # Validate locally first, so a malformed file is never uploaded
+            with metrics.span('validate') as span:
+                span.add_bytes(os.path.getsize(args.input_file))
+                validation = validate_file(args.input_file, check_limits=not args.shard)
+            if validation['errors']:
+                print("Validation failed. No batch was created.")
+                exit(1)
+            if args.validate:
+                print("Validation complete. No batch was created.")
+                exit(0)
+
+        monitor_options = {'min_interval': args.min_poll_interval, 'max_interval': args.max_poll_interval,
+                           'max_workers': args.monitor_workers}
+        if args.batch_id and len(args.batch_id) == 1:
+            # Use existing batch ID for monitoring
+            batch_id = args.batch_id[0]
+            print(f"Monitoring existing batch with ID: {batch_id}")
+            poll_batch_job(batch_id, input_file=args.input_file, min_interval=args.min_poll_interval, max_interval=args.max_poll_interval)
+        elif args.batch_id:
+            # Monitor several existing batches concurrently
+            print(f"Monitoring {len(args.batch_id)} existing batches")
+            monitor_batches(sync, [BatchState(batch_id) for batch_id in args.batch_id], **monitor_options)
+        elif args.manifest and not args.input_file:
+            # Monitor the batches of an existing sharded job
+            print(f"Monitoring sharded batch from manifest: {args.manifest}")
+            monitor_manifest(sync, args.manifest, **monitor_options)
+        elif args.shard:
+            # Create one batch per shard or validate every shard
+            manifest_path = create_sharded_batch(args.input_file, args.manifest, max_lines=args.max_lines,
+                                                 max_bytes=args.max_bytes, max_workers=args.submit_workers, dry_run=args.dry_run)
+            if args.dry_run:
+                print("Validation complete. No batch was created.")
+            elif not manifest_path:
+                print('Failed to create sharded batch')
+                exit(1)
+            elif args.monitor:
+                print(f'Monitoring sharded batch {manifest_path}')
+                monitor_manifest(sync, manifest_path, **monitor_options)
+            else:
+                print(f"Sharded batch recorded in {manifest_path}. Run `python main.py --manifest {manifest_path} --monitor` to monitor the batch progress")
         else:
-            # Normal mode - conditionally monitor the new batch
-            if args.monitor:
-                print(f'Monitoring batch {batch_id}')
-                poll_batch_job(batch_id)
+            # Create new batch or validate
+            batch_id = create_batch(args.input_file, dry_run=args.dry_run)
+            if batch_id:
+                print(f'Successfully created batch {batch_id}')
+            elif not args.dry_run:
+                print('Failed to create batch')
+                exit(1)
+        
+            if args.dry_run:
+                # Dry run mode - just validation, no monitoring
+                print("Validation complete. No batch was created.")
             else:
-                print(f"Batch {batch_id} created. Run `python main.py --batch-id {batch_id} --monitor` to monitor the batch progress")
+                # Normal mode - conditionally monitor the new batch
+                if args.monitor:
+                    print(f'Monitoring batch {batch_id}')
+                    poll_batch_job(batch_id, input_file=args.input_file, min_interval=args.min_poll_interval, max_interval=args.max_poll_interval)
+                else:
+                    print(f"Batch {batch_id} created. Run `python main.py --batch-id {batch_id} --monitor` to monitor the batch progress")
@@ -0,0 +1,241 @@
+"""
+Concurrent monitor for many batches: every batch is polled on its own schedule from one asyncio
+loop, the blocking SDK, download and join calls run in a thread pool. A compact status table is
+kept up to date, each output is downloaded as soon as its batch finishes and the monitor returns
+when all batches are done.
+"""
+import os
+import sys
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from metrics import metrics
+from outputs import download_output, join_outputs
+from progress import MAX_POLL_INTERVAL, MIN_POLL_INTERVAL, ProgressEstimator, batch_progress, format_duration
+from sharding import load_manifest, write_manifest
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+
+
+class BatchState():
+    """Latest known state of a monitored batch."""
+
+    def __init__(self, batch_id: str, output_path: str = '', input_file: str = '', shard: Optional[Dict] = None):
+        self.batch_id = batch_id
+        self.output_path = output_path or f'output_{batch_id}.jsonl'
+        # results are joined with the input file if given
+        self.input_file = input_file
+        # manifest entry of the batch, updated when the batch is done
+        self.shard = shard
+        self.status = 'UNKNOWN'
+        self.progress = {'finished': None, 'failed': 0, 'total': None}
+        self.estimator = ProgressEstimator()
+        self.next_check = 0.0
+        self.errors = 0
+        self.note = ''
+        self.done = False
+
+
+class _LineCounter():
+    """Stdout wrapper counting the lines written, so the table is only redrawn in place if nothing printed below it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count('\n')
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class BatchMonitor():
+    """
+    Poll many batches concurrently until every one of them is completed or failed.
+
+    Each batch gets its next check from its own ETA, between min_interval and max_interval.
+    A batch whose status can't be fetched max_errors times in a row is given up as ERROR.
+    On a terminal the table is redrawn in place every second, otherwise it is printed when a
+    status changes and at most every print_interval seconds for progress.
+    """
+
+    def __init__(self, client, batches: List[BatchState], min_interval: float = MIN_POLL_INTERVAL,
+                 max_interval: float = MAX_POLL_INTERVAL, max_workers: int = 8, max_errors: int = 5,
+                 live: Optional[bool] = None, print_interval: float = 60):
+        self.client = client
+        self.batches = batches
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_workers = max_workers
+        self.max_errors = max_errors
+        self.live = sys.stdout.isatty() if live is None else live
+        self.print_interval = print_interval
+        self._changed = None
+        self._printed = (None, None)
+
+    def _get(self, batch_id: str):
+        with metrics.span('batch_status'):
+            return self.client.batch.get(batch_id)
+
+    def _collect(self, batch: BatchState, output_url: str):
+        """Download the output of a finished batch and join it with its input, runs in the thread pool."""
+        download_output(output_url, batch.output_path)
+        if batch.input_file:
+            failures = join_outputs(batch.input_file, batch.output_path)['failures']
+            batch.note = f"failed requests: {sum(failures.values())}"
+            if batch.shard is not None:
+                batch.shard['failures'] = failures
+
+    async def _watch(self, batch: BatchState, executor: ThreadPoolExecutor):
+        loop = asyncio.get_running_loop()
+        interval = self.min_interval
+        while True:
+            try:
+                response = await loop.run_in_executor(executor, self._get, batch.batch_id)
+            except Exception as e:
+                batch.errors += 1
+                batch.note = f"status check failed: {e}"
+                if batch.errors >= self.max_errors:
+                    batch.status = 'ERROR'
+                    break
+                interval = min(interval * 1.5, self.max_interval)
+            else:
+                batch.errors = 0
+                batch.note = ''
+                batch.status = response.status
+                batch.progress = batch_progress(response)
+                if batch.status in TERMINAL_STATUSES:
+                    if response.output_url:
+                        batch.note = 'downloading output'
+                        self._changed.set()
+                        try:
+                            await loop.run_in_executor(executor, partial(self._collect, batch, response.output_url))
+                            batch.note = f"{batch.output_path}, {batch.note}" if batch.input_file else batch.output_path
+                        except Exception as e:
+                            batch.note = f"output download failed: {e}"
+                    else:
+                        batch.note = 'no output file'
+                    break
+                batch.estimator.add(batch.progress)
+                interval = batch.estimator.next_interval(interval, self.min_interval, self.max_interval)
+            batch.next_check = time.monotonic() + interval
+            self._changed.set()
+            await asyncio.sleep(interval)
+
+        batch.done = True
+        if batch.shard is not None:
+            batch.shard['status'] = batch.status
+            if os.path.exists(batch.output_path):
+                batch.shard['output_path'] = batch.output_path
+        self._changed.set()
+
+    def table(self) -> str:
+        """Status table with one row per batch and a total row."""
+        rows = [('batch', 'status', 'finished', 'failed', 'rate/s', 'ETA', 'next', 'output')]
+        now = time.monotonic()
+        for batch in self.batches:
+            progress = batch.progress
+            finished = f"{progress['finished'] or 0}/{progress['total']}" if progress['total'] else '-'
+            active = not batch.done and batch.status not in TERMINAL_STATUSES
+            rate = batch.estimator.rate() if active else None
+            eta = batch.estimator.eta() if active else None
+            rows.append((
+                batch.batch_id,
+                batch.status,
+                finished,
+                str(progress['failed']),
+                f"{rate:.2f}" if rate is not None else '-',
+                format_duration(eta) if eta is not None else '-',
+                format_duration(max(batch.next_check - now, 0)) if active and batch.next_check else '-',
+                batch.note,
+            ))
+        done = sum(1 for batch in self.batches if batch.done)
+        finished = sum(batch.progress['finished'] or 0 for batch in self.batches)
+        failed = sum(batch.progress['failed'] for batch in self.batches)
+        rows.append(('total', f"{done}/{len(self.batches)} done", str(finished), str(failed), '', '', '', ''))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+        return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) + '  ' + row[-1] for row in rows)
+
+    async def _render(self, stdout: _LineCounter):
+        drawn_at = None
+        height = 0
+        printed_at = 0.0
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            table = self.table()
+            if self.live:
+                # redraw in place unless something else printed since the last draw
+                if drawn_at is not None and stdout.lines == drawn_at:
+                    stdout.write(f'\x1b[{height}F\x1b[J')
+                stdout.write(table + '\n')
+                stdout.flush()
+                drawn_at = stdout.lines
+                height = table.count('\n') + 1
+            else:
+                # print the table when a status changed, and for progress at most every print_interval seconds
+                statuses = [(batch.status, batch.note) for batch in self.batches]
+                progress = [batch.progress['finished'] for batch in self.batches]
+                if statuses != self._printed[0] or (progress != self._printed[1] and time.monotonic() - printed_at >= self.print_interval):
+                    self._printed = (statuses, progress)
+                    printed_at = time.monotonic()
+                    print(table, flush=True)
+            if all(batch.done for batch in self.batches):
+                return
+            if self.live:
+                # keep the countdowns ticking
+                await asyncio.sleep(1)
+                self._changed.set()
+
+    async def run(self) -> List[BatchState]:
+        """Monitor all batches until every one of them is done, returns their final states."""
+        self._changed = asyncio.Event()
+        self._changed.set()
+        stdout = sys.stdout
+        counter = _LineCounter(stdout)
+        if self.live:
+            sys.stdout = counter
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                await asyncio.gather(self._render(counter), *(self._watch(batch, executor) for batch in self.batches))
+        finally:
+            sys.stdout = stdout
+        return self.batches
+
+
+def monitor_batches(client, batches: List[BatchState], **kwargs) -> List[BatchState]:
+    """Run a BatchMonitor over the batches and print a summary once all of them are done."""
+    batches = asyncio.run(BatchMonitor(client, batches, **kwargs).run())
+    counts = {}
+    for batch in batches:
+        counts[batch.status] = counts.get(batch.status, 0) + 1
+    print(f"All {len(batches)} batches done: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    return batches
+
+
+def manifest_batches(manifest_path: str) -> Tuple[List[BatchState], Dict]:
+    """The batches of a sharded job and the loaded manifest, each shard's output is saved and joined next to the shard."""
+    manifest = load_manifest(manifest_path)
+    shards = [shard for shard in manifest['shards'] if shard.get('batch_id')]
+    if len(shards) < len(manifest['shards']):
+        print(f"Skipping {len(manifest['shards']) - len(shards)} shards of {manifest_path} without a batch")
+    return [
+        BatchState(shard['batch_id'], output_path=f"{os.path.splitext(shard['path'])[0]}_output.jsonl",
+                   input_file=shard['path'], shard=shard)
+        for shard in shards
+    ], manifest
+
+
+def monitor_manifest(client, manifest_path: str, **kwargs) -> List[BatchState]:
+    """Monitor all batches of a sharded job and record their status, output and failures in the manifest."""
+    batches, manifest = manifest_batches(manifest_path)
+    try:
+        return monitor_batches(client, batches, **kwargs)
+    finally:
+        write_manifest(manifest_path, manifest)
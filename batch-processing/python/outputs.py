@@ -0,0 +1,207 @@
+"""
+Batch output files: streamed, resumable download and the join of the results with the requests
+of the input file.
+"""
+import os
+import json
+import time
+import argparse
+from array import array
+from collections import Counter
+from typing import Dict
+
+import requests
+import urllib3
+
+from metrics import metrics
+from validate import FingerprintSet
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _download_stream(url: str, part_path: str, meta_path: str, span, timeout: float):
+    """Stream the file into the part file, continuing at its end if the remote file is unchanged."""
+    meta = _read_json(meta_path)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    # offsets and sizes are counted in the bytes on the wire, which only match the file unencoded
+    headers = {'Accept-Encoding': 'identity'}
+    if offset and meta.get('validator'):
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = meta['validator']
+        print(f"Resuming download of {url} at byte {offset}")
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416:
+            if offset == meta.get('size'):
+                return
+            # the part file doesn't belong to the remote file, start over
+            os.remove(part_path)
+            raise requests.exceptions.ConnectionError(f"Partial download of {url} doesn't match the remote file")
+        response.raise_for_status()
+        # 200 instead of 206 means the server sent the whole file again
+        resumed = response.status_code == 206
+        # a server that compresses anyway is decoded, without a resume or size check
+        encoded = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+        if not resumed:
+            size = response.headers.get('Content-Length')
+            meta = {
+                'validator': None if encoded else response.headers.get('ETag') or response.headers.get('Last-Modified'),
+                'size': int(size) if size and size.isdigit() and not encoded else None,
+            }
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        if encoded:
+            chunks = response.iter_content(chunk_size=1024 * 1024)
+        else:
+            chunks = response.raw.stream(1024 * 1024, decode_content=False)
+        with open(part_path, 'ab' if resumed else 'wb') as f:
+            try:
+                for chunk in chunks:
+                    f.write(chunk)
+                    span.add_bytes(len(chunk))
+            except urllib3.exceptions.HTTPError as e:
+                # the raw stream raises urllib3 errors, which requests would have wrapped
+                raise requests.exceptions.ConnectionError(e)
+
+    written = os.path.getsize(part_path)
+    if meta.get('size') is not None and written != meta['size']:
+        raise requests.exceptions.ConnectionError(f"Download of {url} ended at byte {written} of {meta['size']}")
+
+
+def download_output(output_url: str, output_path: str, max_retries: int = 5, timeout: float = 60):
+    """
+    Stream a batch output file to disk, resuming it with HTTP Range requests after an interruption.
+
+    The file is written to output_path.part and moved into place once complete. The part file
+    and the validator of the remote file are kept if the run is interrupted, so the next run
+    continues where this one stopped as long as the remote file is unchanged.
+
+    Raises:
+        requests.exceptions.RequestException: If the download still fails after max_retries retries
+    """
+    part_path = f'{output_path}.part'
+    meta_path = f'{part_path}.json'
+    with metrics.span('download') as span:
+        for attempt in range(max_retries + 1):
+            try:
+                _download_stream(output_url, part_path, meta_path, span, timeout)
+                break
+            except requests.exceptions.RequestException as e:
+                response = getattr(e, 'response', None)
+                # client errors such as an expired URL won't go away by retrying
+                if attempt == max_retries or (response is not None and response.status_code < 500):
+                    raise
+                print(f"Download of {output_path} interrupted: {e}, retrying")
+                span.retry()
+                time.sleep(min(2 ** attempt, 30))
+    os.replace(part_path, output_path)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+
+def join_outputs(input_file: str, output_file: str, joined_path: str = '', failures_path: str = '') -> Dict:
+    """
+    Join the results of a batch output file with the requests of its input file by request_id.
+
+    Both files are streamed. The input is indexed by request_id fingerprint to the byte offset
+    of its line, so only the index is held in memory and every request is read back with a seek.
+    The joined file has one {"request": ..., "result": ...} line per result, the failures file
+    one line per failed request, result without request or request without result.
+
+    Args:
+        input_file (str): Input JSONL file the batch was created from
+        output_file (str): Downloaded output JSONL file of the batch
+        joined_path (str): Joined results file, defaults to <output>_joined.jsonl
+        failures_path (str): Failures file, defaults to <output>_failures.jsonl
+
+    Returns:
+        dict: Number of 'joined' results, failure counts per reason in 'failures' and the paths
+    """
+    stem = os.path.splitext(output_file)[0]
+    joined_path = joined_path or f'{stem}_joined.jsonl'
+    failures_path = failures_path or f'{stem}_failures.jsonl'
+
+    # request_id fingerprint -> line number, line number -> byte offset
+    index = FingerprintSet()
+    offsets = array('Q', [0])
+    offset = 0
+    with open(input_file, 'rb') as input_data:
+        for line in input_data:
+            try:
+                request_id = json.loads(line).get('request_id')
+            except (ValueError, AttributeError):
+                request_id = None
+            # a duplicate request_id is joined with its first request
+            if isinstance(request_id, str) and not index.add(request_id, len(offsets)):
+                offsets.append(offset)
+            offset += len(line)
+    seen = bytearray(len(offsets))
+
+    joined = 0
+    failures = Counter()
+    with open(input_file, 'rb') as input_data, open(output_file, 'rb') as output_data, \
+            open(joined_path, 'w') as joined_file, open(failures_path, 'w') as failures_file:
+
+        def fail(reason: str, request_id, result=None, request=None):
+            failures[reason] += 1
+            error = result.get('error') if isinstance(result, dict) else None
+            failures_file.write(json.dumps({'request_id': request_id, 'reason': reason, 'error': error, 'request': request}) + '\n')
+
+        for line in output_data:
+            if not line.strip():
+                continue
+            try:
+                result = json.loads(line)
+            except ValueError:
+                failures['INVALID_RESULT'] += 1
+                continue
+            request_id = result.get('request_id') if isinstance(result, dict) else None
+
+            # a fingerprint match is confirmed against the request read back from the input
+            request = None
+            number = index.get(request_id) if isinstance(request_id, str) else 0
+            if number:
+                input_data.seek(offsets[number])
+                request = json.loads(input_data.readline())
+                if request.get('request_id') == request_id:
+                    seen[number] = 1
+                else:
+                    request = None
+            if request is None:
+                fail('UNKNOWN_REQUEST', request_id, result)
+                continue
+
+            joined_file.write(json.dumps({'request': request, 'result': result}) + '\n')
+            joined += 1
+            status = result.get('status')
+            if status != 'COMPLETED':
+                fail(status or 'NO_STATUS', request_id, result, request)
+
+        for number in range(1, len(offsets)):
+            if not seen[number]:
+                input_data.seek(offsets[number])
+                request = json.loads(input_data.readline())
+                fail('MISSING_RESULT', request['request_id'], request=request)
+
+    summary = ", ".join(f"{reason} {count}" for reason, count in sorted(failures.items())) or "none"
+    print(f"Joined {joined} results with {input_file} into {joined_path}. Failures: {summary}")
+    if failures:
+        print(f"Failed requests written to {failures_path}")
+    return {'joined': joined, 'failures': dict(failures), 'joined_path': joined_path, 'failures_path': failures_path}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Join a batch output file with its input file by request_id")
+    parser.add_argument("input_file", help="Input JSONL file the batch was created from")
+    parser.add_argument("output_file", help="Output JSONL file of the batch")
+    parser.add_argument("--joined", default="", help="Joined results file (default: <output>_joined.jsonl)")
+    parser.add_argument("--failures", default="", help="Failures file (default: <output>_failures.jsonl)")
+    args = parser.parse_args()
+
+    join_outputs(args.input_file, args.output_file, args.joined, args.failures)
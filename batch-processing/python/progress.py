@@ -0,0 +1,113 @@
+"""
+Progress of batch jobs from the metrics reported by the Batch API: completion rate, ETA and
+the time to wait until the next status check.
+"""
+import time
+from collections import deque
+from typing import Dict, Optional
+
+# bounds in seconds of the time between two status checks of a batch
+MIN_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 300
+
+
+def batch_progress(batch_response) -> Dict:
+    """
+    Request counts of a batch from its metrics.
+
+    The metrics may be missing, an object or a dict, and fields may be missing or null while
+    the batch is queued, such counts are None.
+
+    Returns:
+        dict: 'finished', 'failed' and 'total' requests
+    """
+    batch_metrics = getattr(batch_response, 'metrics', None)
+
+    def field(name):
+        value = batch_metrics.get(name) if isinstance(batch_metrics, dict) else getattr(batch_metrics, name, None)
+        return value if isinstance(value, (int, float)) else None
+
+    total = field('total_generations')
+    success = field('success_count')
+    failed = field('failed_count')
+    pending = field('pending_count')
+    if success is not None or failed is not None:
+        finished = (success or 0) + (failed or 0)
+    elif total is not None and pending is not None:
+        finished = total - pending
+    else:
+        finished = None
+    return {'finished': finished, 'failed': failed or 0, 'total': total}
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressEstimator():
+    """
+    Completion rate and ETA of a batch job, from the finished request counts of successive polls.
+
+    The rate is measured over the last `window` samples, so the estimate follows changes in
+    throughput, e.g. when queued requests start processing.
+    """
+
+    def __init__(self, window: int = 10):
+        self.samples = deque(maxlen=window)
+        self.total = None
+
+    def add(self, progress: Dict):
+        self.total = progress['total']
+        if progress['finished'] is not None:
+            self.samples.append((time.monotonic(), progress['finished']))
+
+    def rate(self) -> Optional[float]:
+        """Finished requests per second, None until two samples are taken."""
+        if len(self.samples) < 2:
+            return None
+        (first_time, first_finished), (last_time, last_finished) = self.samples[0], self.samples[-1]
+        if last_time <= first_time:
+            return None
+        return max(last_finished - first_finished, 0) / (last_time - first_time)
+
+    def eta(self) -> Optional[float]:
+        """Seconds until all requests are finished, None while no progress is measured."""
+        rate = self.rate()
+        if not rate or self.total is None:
+            return None
+        return max(self.total - self.samples[-1][1], 0) / rate
+
+    def next_interval(self, previous: float, min_interval: float = MIN_POLL_INTERVAL,
+                      max_interval: float = MAX_POLL_INTERVAL) -> float:
+        """
+        Seconds to wait until the next poll.
+
+        While the batch makes progress a third of the ETA, so polls close in on the completion
+        without polling a long batch all the time. Without an ETA the previous interval grows
+        by half. The result is kept within min_interval and max_interval.
+        """
+        eta = self.eta()
+        interval = eta / 3 if eta is not None else previous * 1.5
+        return min(max(interval, min_interval), max_interval)
+
+    def describe(self, progress: Dict) -> str:
+        """Completion rate line, e.g. '420/1000 requests finished (42%, 3 failed), 3.50 requests/s, ETA 2m45s'."""
+        parts = []
+        if progress['total']:
+            finished = progress['finished'] or 0
+            parts.append(f"{finished}/{progress['total']} requests finished "
+                         f"({finished / progress['total']:.0%}, {progress['failed']} failed)")
+        rate = self.rate()
+        if rate is not None:
+            parts.append(f"{rate:.2f} requests/s")
+        eta = self.eta()
+        if eta is not None:
+            parts.append(f"ETA {format_duration(eta)}")
+        return ", ".join(parts) or "no progress reported yet"
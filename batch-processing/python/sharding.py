@@ -0,0 +1,88 @@
+"""
+Splitting of batch input files that exceed the Batch API limits into shards, and the manifest
+that records the batch created from each shard so they can be monitored as one job.
+"""
+import os
+import json
+from typing import Dict, List
+
+# limits of a single batch
+MAX_LINES = 1000
+MAX_BYTES = 5 * 1024 * 1024
+
+
+def split_input(input_file: str, shard_dir: str, max_lines: int = MAX_LINES, max_bytes: int = MAX_BYTES) -> List[Dict]:
+    """
+    Stream a JSONL input file into shards of at most max_lines lines and max_bytes bytes.
+
+    Only the current line is held in memory, so input files of any size can be split. Blank
+    lines are dropped.
+
+    Args:
+        input_file (str): Path to the input JSONL file
+        shard_dir (str): Directory to write the shards to, created if missing
+        max_lines (int): Maximum number of requests in a shard
+        max_bytes (int): Maximum size of a shard in bytes
+
+    Returns:
+        list: One dict per shard with its 'path', number of 'lines' and 'bytes'
+
+    Raises:
+        ValueError: If a single line is larger than max_bytes.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    shards = []
+    shard = None
+    shard_file = None
+    try:
+        with open(input_file, 'rb') as input_data:
+            for number, line in enumerate(input_data, 1):
+                if not line.strip():
+                    continue
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                if len(line) > max_bytes:
+                    raise ValueError(f"Line {number} of {input_file} is larger than the {max_bytes} bytes limit of a batch")
+                if shard is None or shard['lines'] >= max_lines or shard['bytes'] + len(line) > max_bytes:
+                    if shard_file:
+                        shard_file.close()
+                    shard = {'path': os.path.join(shard_dir, f'{stem}_{len(shards) + 1:04d}.jsonl'), 'lines': 0, 'bytes': 0}
+                    shards.append(shard)
+                    shard_file = open(shard['path'], 'wb')
+                shard_file.write(line)
+                shard['lines'] += 1
+                shard['bytes'] += len(line)
+    finally:
+        if shard_file:
+            shard_file.close()
+    return shards
+
+
+def write_manifest(manifest_path: str, manifest: Dict):
+    """Write the manifest atomically, so an interrupted write never leaves a broken file behind."""
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+
+def load_manifest(manifest_path: str) -> Dict:
+    """
+    Load a manifest of the form {'input_file': ..., 'shards': [{'path', 'lines', 'batch_id'}, ...]}.
+
+    Relative paths in the manifest are resolved against its directory, so the job can be
+    monitored from any working directory.
+    """
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('shards'), list):
+        raise ValueError(f"{manifest_path} is not a batch manifest")
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    if manifest.get('input_file'):
+        manifest['input_file'] = os.path.join(base_dir, manifest['input_file'])
+    for shard in manifest['shards']:
+        for key in ('path', 'output_path'):
+            if shard.get(key):
+                shard[key] = os.path.join(base_dir, shard[key])
+    return manifest
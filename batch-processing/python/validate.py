@@ -0,0 +1,194 @@
+"""
+Local validation of batch input files, streamed line by line so files of any size are checked
+in bounded memory before anything is uploaded.
+"""
+import os
+import re
+import json
+import argparse
+from array import array
+from typing import Dict, List
+
+from sharding import MAX_BYTES, MAX_LINES
+
+ENDPOINT = "/v2/generate"
+INPUT_TYPES = ("video", "audio", "text")
+# an http(s) URL with a host and no whitespace, much faster than urlparse on millions of lines
+URL_PATTERN = re.compile(r'https?://[^\s/?#@]+(?:[/?#]\S*)?\Z', re.IGNORECASE)
+
+
+class FingerprintSet():
+    """
+    Set of request IDs kept as 64 bit fingerprints in an open addressing hash table.
+
+    A slot takes 12 bytes, the fingerprint and the line it was first seen on, instead of a
+    Python string per ID, so millions of IDs fit in a few tens of megabytes. Two different IDs
+    share a fingerprint with a probability of about n^2 / 2^65, which is negligible.
+    """
+
+    def __init__(self, capacity: int = 1 << 16):
+        self._allocate(capacity)
+        self.size = 0
+
+    def _allocate(self, capacity: int):
+        self._mask = capacity - 1
+        self._keys = array('Q', bytes(8 * capacity))
+        self._lines = array('I', bytes(array('I').itemsize * capacity))
+
+    @staticmethod
+    def fingerprint(value: str) -> int:
+        # Python's string hash is 64 bits wide on 64 bit builds and stable within a process,
+        # 0 marks an empty slot
+        return hash(value) & 0xFFFFFFFFFFFFFFFF or 1
+
+    def _insert(self, key: int, line: int) -> int:
+        keys = self._keys
+        index = key & self._mask
+        while keys[index]:
+            if keys[index] == key:
+                return self._lines[index]
+            index = (index + 1) & self._mask
+        keys[index] = key
+        self._lines[index] = line
+        return 0
+
+    def add(self, value: str, line: int) -> int:
+        """
+        Add a request ID seen on the given line.
+
+        Returns:
+            int: The line the ID was first seen on if it is a duplicate, else 0
+        """
+        if self.size * 2 >= self._mask:
+            self._grow()
+        first_line = self._insert(self.fingerprint(value), line)
+        if not first_line:
+            self.size += 1
+        return first_line
+
+    def get(self, value: str) -> int:
+        """The line the ID was added with, 0 if it was never added."""
+        key = self.fingerprint(value)
+        index = key & self._mask
+        while self._keys[index]:
+            if self._keys[index] == key:
+                return self._lines[index]
+            index = (index + 1) & self._mask
+        return 0
+
+    def _grow(self):
+        keys, lines = self._keys, self._lines
+        self._allocate(2 * (self._mask + 1))
+        for key, line in zip(keys, lines):
+            if key:
+                self._insert(key, line)
+
+
+def is_url(value) -> bool:
+    return isinstance(value, str) and URL_PATTERN.match(value) is not None
+
+
+def check_request(request) -> List[str]:
+    """Schema errors of a parsed input line, the request_id is checked by the caller."""
+    if not isinstance(request, dict):
+        return ["line is not a JSON object"]
+    errors = []
+    if request.get("endpoint") != ENDPOINT:
+        errors.append(f"endpoint must be \"{ENDPOINT}\", got {json.dumps(request.get('endpoint'))}")
+
+    payload = request.get("payload")
+    if not isinstance(payload, dict):
+        return errors + ["payload must be an object"]
+    if not isinstance(payload.get("model"), str) or not payload["model"]:
+        errors.append("payload.model must be a non-empty string")
+
+    inputs = payload.get("input")
+    if not isinstance(inputs, list) or not inputs:
+        return errors + ["payload.input must be a non-empty list"]
+    types = []
+    for i, item in enumerate(inputs):
+        if not isinstance(item, dict) or item.get("type") not in INPUT_TYPES:
+            errors.append(f"payload.input[{i}].type must be one of {', '.join(INPUT_TYPES)}")
+            continue
+        types.append(item["type"])
+        if item["type"] == "text":
+            if not isinstance(item.get("provider"), dict):
+                errors.append(f"payload.input[{i}] of type text needs a provider object")
+        elif "url" in item:
+            if not is_url(item["url"]):
+                errors.append(f"payload.input[{i}].url is not an http(s) URL: {json.dumps(item['url'])[:200]}")
+        elif not item.get("assetId"):
+            errors.append(f"payload.input[{i}] of type {item['type']} needs a url or assetId")
+    if types.count("video") != 1:
+        errors.append(f"payload.input must have exactly one video, got {types.count('video')}")
+    if "audio" not in types and "text" not in types:
+        errors.append("payload.input must have an audio or text input")
+    return errors
+
+
+def validate_file(input_file: str, max_errors: int = 20, check_limits: bool = True) -> Dict:
+    """
+    Validate a batch input file line by line: JSON syntax, unique request IDs and the request schema.
+
+    Errors are printed with their line numbers, up to max_errors of them, all of them are counted.
+
+    Args:
+        input_file (str): Path to the input JSONL file
+        max_errors (int): Maximum number of errors to print
+        check_limits (bool): Warn if the file exceeds the limits of a single batch
+
+    Returns:
+        dict: Number of 'requests', 'errors' and the list of 'warnings'
+    """
+    request_ids = FingerprintSet()
+    requests = 0
+    errors = 0
+
+    def report(number: int, message: str):
+        nonlocal errors
+        errors += 1
+        if errors <= max_errors:
+            print(f"{input_file}:{number}: {message}")
+
+    with open(input_file, 'rb') as input_data:
+        for number, line in enumerate(input_data, 1):
+            if not line.strip():
+                continue
+            requests += 1
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                report(number, f"invalid JSON: {e}")
+                continue
+
+            request_id = request.get("request_id") if isinstance(request, dict) else None
+            if not isinstance(request_id, str) or not request_id:
+                report(number, "request_id must be a non-empty string")
+            else:
+                first_line = request_ids.add(request_id, number)
+                if first_line:
+                    report(number, f"duplicate request_id {json.dumps(request_id)}, first used on line {first_line}")
+            for message in check_request(request):
+                report(number, message)
+
+    warnings = []
+    if check_limits and requests > MAX_LINES:
+        warnings.append(f"{requests} requests exceed the limit of {MAX_LINES} per batch, use --shard")
+    if check_limits and os.path.getsize(input_file) > MAX_BYTES:
+        warnings.append(f"file size exceeds the limit of {MAX_BYTES} bytes per batch, use --shard")
+    for warning in warnings:
+        print(f"Warning: {warning}")
+    if errors > max_errors:
+        print(f"... {errors - max_errors} more errors not shown")
+    print(f"Validated {requests} requests in {input_file}: {errors} errors")
+    return {'requests': requests, 'errors': errors, 'warnings': warnings}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate batch input files locally without uploading them")
+    parser.add_argument("input_files", nargs="+", help="Paths to input JSONL files")
+    parser.add_argument("--max-errors", type=int, default=20, help="Maximum errors printed per file (default: 20)")
+    args = parser.parse_args()
+
+    results = [validate_file(path, max_errors=args.max_errors) for path in args.input_files]
+    exit(1 if any(result['errors'] for result in results) else 0)
@@ -0,0 +1,37 @@
+"""
+Throughput of the batch-processing script: creating a batch from a JSONL file, monitoring it
+until it finishes, downloading its output and joining it with the input, against a stand-in Sync client.
+"""
+import os
+import json
+
+from standins import CallCounter, FakeSync, profiles_from_args
+from runner import measure, runner_parser
+
+
+def write_input(path: str, size: int):
+    with open(path, 'w') as f:
+        for i in range(size):
+            payload = {'model': 'lipsync-2', 'input': [
+                {'type': 'video', 'url': f'https://example.com/video-{i}.mp4'},
+                {'type': 'audio', 'url': f'https://example.com/audio-{i}.wav'},
+            ]}
+            f.write(json.dumps({'request_id': f'request-{i}', 'endpoint': '/v2/generate', 'payload': payload}) + '\n')
+
+
+if __name__ == "__main__":
+    parser = runner_parser("Benchmark the batch-processing script against a stand-in Sync client")
+    args = parser.parse_args()
+
+    profiles = profiles_from_args(args)
+    counter = CallCounter()
+    # main.py creates its Sync client on import, which needs an API key
+    os.environ.setdefault('SYNC_API_KEY', 'standin')
+    with measure(args, 'batch', 'batch-processing/python', counter):
+        import main
+
+        main.sync = FakeSync(profiles, args.serve_dir, args.server, counter)
+
+        write_input('input.jsonl', args.size)
+        batch_id = main.create_batch('input.jsonl')
+        main.poll_batch_job(batch_id, input_file='input.jsonl', min_interval=args.poll_interval, max_interval=10 * args.poll_interval)
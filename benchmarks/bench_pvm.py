@@ -0,0 +1,43 @@
+"""
+Throughput of PVMessenger: a csv of personalized messages through voice cloning, TTS, upload,
+lipsync submission and polling, against the stand-in services.
+"""
+import os
+import csv
+
+from standins import CallCounter, FakeSync, fake_ffmpeg, profiles_from_args
+from runner import measure, runner_parser, with_poll_interval
+
+
+def write_csv(path: str, size: int, video_url: str):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['video', 'text', 'segment_start', 'segment_end', 'sync_mode', 'voice_id', 'lipsync_model', 'tts_model'])
+        for i in range(size):
+            # every row has its own text, so the TTS cache doesn't hide the TTS cost
+            writer.writerow([video_url, f'Hi customer {i}, thanks for being with us this year!', 0, 1, 'bounce', '',
+                             'lipsync-2', 'eleven_multilingual_v2'])
+
+
+if __name__ == "__main__":
+    parser = runner_parser("Benchmark PVMessenger against the stand-in services")
+    parser.add_argument("--max-workers", type=int, default=8, help="Rows in flight (default: 8)")
+    args = parser.parse_args()
+
+    profiles = profiles_from_args(args)
+    counter = CallCounter()
+    with measure(args, 'pvm', 'personalized-video-messsging/python', counter):
+        from src.PVMessenger import PVMessenger
+        from src.Processor.Uploader import UguuBackend
+
+        write_csv('input.csv', args.size, f'{args.server}/files/video.mp4')
+        pvm = PVMessenger(os.getcwd(), 'standin', 'standin', args.max_workers,
+                          {'tts': 4, 'upload': 4, 'submit': 2}, 'Data/Cache/tts', 1024,
+                          upload_backend=UguuBackend(f'{args.server}/upload'),
+                          metrics_report_path='run_report.json')
+        pvm.voice_service.base_url = f'{args.server}/v1'
+        pvm.lipsync_service.client = FakeSync(profiles, args.serve_dir, args.server, counter)
+        pvm.lipsync_service.poll_for_status = with_poll_interval(pvm.lipsync_service.poll_for_status, args.poll_interval)
+        pvm.file_processor.run_ffmpeg_command = fake_ffmpeg(profiles['ffmpeg'], counter)
+
+        pvm.run('input.csv', 'output.csv')
@@ -0,0 +1,57 @@
+"""
+Throughput of the translation pipeline: a manifest of videos through BatchTranslator, so
+download, audio extraction, transcription, translation, TTS, upload, lipsync submission and
+polling of every video, against the stand-in services.
+"""
+import os
+import json
+
+from standins import CallCounter, FakeOpenAI, FakeSync, fake_bytes, fake_ffmpeg, profiles_from_args
+from runner import measure, runner_parser, with_poll_interval
+
+
+def write_manifest(path: str, size: int, serve_dir: str, server: str):
+    """One distinct stand-in video per manifest row, so no cache hides the work of a video."""
+    os.makedirs(os.path.join(serve_dir, 'videos'), exist_ok=True)
+    with open(path, 'w') as manifest:
+        for i in range(size):
+            name = f'videos/video-{i}.mp4'
+            with open(os.path.join(serve_dir, name), 'wb') as f:
+                f.write(fake_bytes(name, 64 * 1024))
+            manifest.write(json.dumps({'input_vid_url': f'{server}/files/{name}', 'target_language': 'Spanish'}) + '\n')
+
+
+if __name__ == "__main__":
+    parser = runner_parser("Benchmark the translation pipeline against the stand-in services")
+    parser.add_argument("--max-workers", type=int, default=8, help="Languages in flight and default stage limit (default: 8)")
+    parser.add_argument("--manifest-workers", type=int, default=8, help="Videos in flight (default: 8)")
+    args = parser.parse_args()
+
+    profiles = profiles_from_args(args)
+    counter = CallCounter()
+    with measure(args, 'translation', 'translation/python', counter):
+        from args import Args
+        from src.BatchTranslator import BatchTranslator
+        from src.utils.Uploader import UguuBackend
+
+        write_manifest('manifest.jsonl', args.size, args.serve_dir, args.server)
+        config = Args()
+        config.SYNCLABS_API_KEY = config.ELEVENLABS_API_KEY = config.OPENAI_API_KEY = 'standin'
+        config.manifest_path = 'manifest.jsonl'
+        config.results_path = 'results.json'
+        config.metrics_report_path = 'run_report.json'
+        config.max_workers = args.max_workers
+        config.manifest_workers = args.manifest_workers
+        config.upload_backend = UguuBackend(f'{args.server}/upload')
+        # a voice clone per distinct video would benchmark the voice registry, the pvm suite covers cloning
+        config.voice_id = 'standin-voice'
+
+        translator = BatchTranslator(os.getcwd(), config)
+        services = translator.translator
+        services.voice_service.base_url = f'{args.server}/v1'
+        services.lipsync_service.client = FakeSync(profiles, args.serve_dir, args.server, counter)
+        services.lipsync_service.poll_for_status = with_poll_interval(services.lipsync_service.poll_for_status, args.poll_interval)
+        services.translation_service.client = FakeOpenAI(profiles, counter)
+        services.file_processor.run_ffmpeg_command = fake_ffmpeg(profiles['ffmpeg'], counter)
+
+        translator.run()
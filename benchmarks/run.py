@@ -0,0 +1,116 @@
+"""
+End to end throughput benchmarks of the example pipelines against offline stand-in services.
+
+Starts the stand-in server, runs every suite at every size in a fresh process and working
+directory, and prints items per second, peak RSS and API call counts per run. The results can
+be saved as JSON to compare a change against a baseline.
+
+    python run.py --sizes 10 1000 --output baseline.json
+    python run.py --sizes 10 1000 --baseline baseline.json
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+from standins import add_profile_arguments
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SUITES = {
+    'pvm': 'bench_pvm.py',
+    'translation': 'bench_translation.py',
+    'batch': 'bench_batch.py',
+}
+
+
+def profile_arguments(args) -> list:
+    arguments = ['--latency-scale', str(args.latency_scale), '--error-rate', str(args.error_rate),
+                 '--rate-limit-rate', str(args.rate_limit_rate)]
+    if args.profiles:
+        arguments += ['--profiles', os.path.abspath(args.profiles)]
+    return arguments
+
+
+def run_suite(suite: str, size: int, server: str, serve_dir: str, tmp_dir: str, args) -> dict:
+    """Run one suite at one size in its own process, returns its result line."""
+    workdir = os.path.join(tmp_dir, f'{suite}-{size}')
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, SUITES[suite]), '--size', str(size),
+               '--server', server, '--serve-dir', serve_dir, '--workdir', workdir,
+               '--poll-interval', str(args.poll_interval)] + profile_arguments(args)
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=args.timeout)
+    lines = process.stdout.decode(errors='replace').strip().splitlines()
+    if process.returncode != 0 or not lines:
+        return {'suite': suite, 'items': size, 'error': process.stderr.decode(errors='replace').strip()[-2000:]}
+    return json.loads(lines[-1])
+
+
+def print_table(results: list, baseline: dict):
+    print(f"{'suite':<12} {'items':>7} {'seconds':>9} {'items/s':>9} {'vs base':>8} {'rss MB':>8} {'api calls':>10} {'failed':>7}")
+    for result in results:
+        if result.get('error') and 'seconds' not in result:
+            print(f"{result['suite']:<12} {result['items']:>7} failed: {result['error'].splitlines()[-1] if result['error'] else ''}")
+            continue
+        calls = result['api_calls'].values()
+        total = sum(c['calls'] for c in calls)
+        failed = sum(c['errors'] + c['rate_limited'] for c in calls)
+        base = baseline.get((result['suite'], result['items']))
+        change = f"{result['items_per_second'] / base['items_per_second'] - 1:+.0%}" if base and base.get('items_per_second') else ''
+        print(f"{result['suite']:<12} {result['items']:>7} {result['seconds']:>9.2f} {result['items_per_second']:>9.2f} "
+              f"{change:>8} {result['peak_rss_mb']:>8.1f} {total:>10} {failed:>7}")
+        if result.get('error'):
+            print(f"  run raised {result['error']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the example pipelines against offline stand-in services")
+    parser.add_argument("--suites", nargs="+", choices=sorted(SUITES), default=sorted(SUITES), help="Suites to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 1000, 10000], help="Item counts (default: 10 1000 10000)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Initial lipsync poll interval in seconds (default: 1)")
+    parser.add_argument("--timeout", type=float, default=3600, help="Timeout of a single run in seconds (default: 3600)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare items per second against")
+    parser.add_argument("--keep", action="store_true", default=False, help="Keep the working directories with the pipeline logs")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = {(r['suite'], r['items']): r for r in json.load(f)['results']}
+
+    tmp_dir = tempfile.mkdtemp(prefix='sync-bench-')
+    serve_dir = os.path.join(tmp_dir, 'served')
+    os.makedirs(serve_dir)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARKS_DIR, 'standins.py'), 'serve', '--serve-dir', serve_dir] + profile_arguments(args),
+        stdout=subprocess.PIPE,
+    )
+    results = []
+    try:
+        server_url = server.stdout.readline().decode().strip()
+        # the pvm suite's reference video, the other suites bring their own inputs
+        with open(os.path.join(serve_dir, 'video.mp4'), 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+
+        for suite in args.suites:
+            for size in args.sizes:
+                print(f'Running {suite} with {size} items...', flush=True)
+                results.append(run_suite(suite, size, server_url, serve_dir, tmp_dir, args))
+    finally:
+        server.terminate()
+        server.wait()
+        if not args.keep:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            print(f'Working directories kept in {tmp_dir}')
+
+    print()
+    print_table(results, baseline)
+    if args.output:
+        settings = {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'keep')}
+        with open(args.output, 'w') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=4)
+        print(f'Results written to {args.output}')
@@ -0,0 +1,89 @@
+"""
+Helpers shared by the benchmark scripts, every bench_*.py measures one pipeline at one size
+in its own process and prints its result as a JSON line.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import contextlib
+import urllib.request
+from typing import Dict, Iterator
+
+from standins import CallCounter, add_profile_arguments
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+
+def runner_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--size", type=int, required=True, help="Number of items to run through the pipeline")
+    parser.add_argument("--server", required=True, help="URL of the stand-in server")
+    parser.add_argument("--serve-dir", required=True, help="Directory the stand-in server hosts under /files/")
+    parser.add_argument("--workdir", required=True, help="Empty working directory for the pipeline")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Initial lipsync poll interval in seconds (default: 1)")
+    add_profile_arguments(parser)
+    return parser
+
+
+def server_call(server: str, path: str, method: str = 'GET') -> dict:
+    request = urllib.request.Request(f'{server}{path}', method=method, data=b'' if method == 'POST' else None)
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+@contextlib.contextmanager
+def measure(args, suite: str, project: str, counter: CallCounter) -> Iterator[Dict]:
+    """
+    Run the block as the measured pipeline run of a benchmark.
+
+    The pipeline runs in args.workdir with the project on sys.path and its output in
+    pipeline.log. The result line holds the wall time, items per second, peak RSS and the
+    API calls counted by the stand-in server and the in process fake clients.
+    """
+    project_dir = os.path.join(REPO_DIR, project)
+    sys.path.insert(0, project_dir)
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    server_call(args.server, '/reset', 'POST')
+
+    result = {'suite': suite, 'items': args.size}
+    log_path = os.path.join(args.workdir, 'pipeline.log')
+    stdout = sys.stdout
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log):
+        start = time.perf_counter()
+        try:
+            yield result
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        seconds = time.perf_counter() - start
+
+    api_calls = server_call(args.server, '/stats')
+    api_calls.update(counter.snapshot())
+    result.update({
+        'seconds': round(seconds, 3),
+        'items_per_second': round(args.size / seconds, 2) if seconds else 0,
+        'peak_rss_mb': peak_rss_mb(),
+        'api_calls': dict(sorted(api_calls.items())),
+        'log': log_path,
+    })
+    stdout.write(json.dumps(result) + '\n')
+    stdout.flush()
+
+
+def with_poll_interval(poll_for_status, interval: float):
+    """Start lipsync polling at the benchmark interval instead of the 10 second default."""
+    def poll(jobs, **kwargs):
+        kwargs.setdefault('interval', interval)
+        kwargs.setdefault('min_interval', min(interval, 2))
+        return poll_for_status(jobs, **kwargs)
+    return poll
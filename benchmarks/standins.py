@@ -0,0 +1,498 @@
+"""
+Offline stand-ins for the APIs used by the example pipelines.
+
+- StandInServer: an HTTP server for the ElevenLabs TTS and voice cloning endpoints, the uguu
+  upload endpoint and static file hosting (input videos and batch outputs). Run it with
+  `python standins.py serve` so it doesn't share a process with the pipeline under test.
+- FakeSync and FakeOpenAI: drop-in replacements for the `client` of LipSyncProcessor and
+  TranslationProcessor and for the module level `sync` client of batch-processing/main.py.
+- fake_ffmpeg: replacement for FileProcessor.run_ffmpeg_command, the stand-in videos aren't
+  real media files.
+
+Every stand-in draws the latency of a call from a Profile, and fails a configurable share of
+the calls with a server error or a 429 rate limit response.
+"""
+import os
+import json
+import math
+import time
+import uuid
+import shlex
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+
+class Profile():
+    """
+    Latency and failure behaviour of a stand-in endpoint.
+
+    Args:
+        latency (float): Mean latency of a call in seconds
+        jitter (float): Spread of the lognormal latency distribution, 0 for a fixed latency
+        error_rate (float): Share of calls that fail with a server error
+        rate_limit_rate (float): Share of calls that are answered with a 429
+    """
+    def __init__(self, latency: float, jitter: float = 0.3, error_rate: float = 0.0, rate_limit_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+
+    def delay(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        if not self.jitter:
+            return self.latency
+        # lognormal with the configured mean, a long tail like real API latencies
+        return random.lognormvariate(math.log(self.latency) - self.jitter ** 2 / 2, self.jitter)
+
+    def outcome(self) -> int:
+        """HTTP status of a call: 200, 429 or 500."""
+        draw = random.random()
+        if draw < self.rate_limit_rate:
+            return 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return 500
+        return 200
+
+    def call(self) -> int:
+        """Wait for the latency of a call and return its status."""
+        time.sleep(self.delay())
+        return self.outcome()
+
+
+# mean latencies in seconds, job and batch profiles are the processing time at Sync
+DEFAULT_PROFILES = {
+    'elevenlabs.tts': Profile(0.02),
+    'elevenlabs.clone': Profile(0.2),
+    'elevenlabs.voice': Profile(0.01),
+    'uguu.upload': Profile(0.01),
+    'files.get': Profile(0.002),
+    'sync.generations.create': Profile(0.005),
+    'sync.generations.get': Profile(0.002),
+    'sync.job': Profile(1.0),
+    'sync.batch.create': Profile(0.05),
+    'sync.batch.get': Profile(0.005),
+    'sync.batch_job': Profile(2.0),
+    'openai.transcriptions': Profile(0.05),
+    'openai.chat': Profile(0.03),
+    'ffmpeg': Profile(0.01),
+}
+
+# only calls to the remote APIs fail, local files and ffmpeg always work
+API_PREFIXES = ('elevenlabs.', 'uguu.', 'sync.generations.', 'sync.batch.', 'openai.')
+
+
+def load_profiles(latency_scale: float = 1.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                  overrides_path: str = '') -> Dict[str, Profile]:
+    """
+    The DEFAULT_PROFILES with all latencies scaled and the error rates applied to the API calls.
+
+    overrides_path is an optional JSON file of per endpoint settings that replace the defaults,
+    e.g. {"elevenlabs.tts": {"latency": 0.5, "rate_limit_rate": 0.1}}.
+    """
+    profiles = {}
+    for name, profile in DEFAULT_PROFILES.items():
+        is_api = name.startswith(API_PREFIXES)
+        profiles[name] = Profile(
+            profile.latency * latency_scale, profile.jitter,
+            error_rate if is_api else 0.0, rate_limit_rate if is_api else 0.0,
+        )
+    if overrides_path:
+        with open(overrides_path, 'r') as f:
+            for name, settings in json.load(f).items():
+                base = profiles.get(name, Profile(0.0))
+                profiles[name] = Profile(**{**vars(base), **settings})
+    return profiles
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply all stand-in latencies (default: 1.0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of API calls failing with a server error (default: 0)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of API calls answered with a 429 (default: 0)")
+    parser.add_argument("--profiles", default="", help="JSON file with per endpoint latency and error settings")
+
+
+def profiles_from_args(args) -> Dict[str, Profile]:
+    return load_profiles(args.latency_scale, args.error_rate, args.rate_limit_rate, args.profiles)
+
+
+class CallCounter():
+    """Thread safe counts of calls, failures, 429s and bytes per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = {}
+
+    def record(self, name: str, status: int = 200, nbytes: int = 0):
+        with self._lock:
+            counts = self._counts.setdefault(name, {'calls': 0, 'errors': 0, 'rate_limited': 0, 'bytes': 0})
+            counts['calls'] += 1
+            counts['errors'] += int(status >= 500)
+            counts['rate_limited'] += int(status == 429)
+            counts['bytes'] += nbytes
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+
+def fake_bytes(seed: str, size: int) -> bytes:
+    """Deterministic pseudo random bytes, different seeds give different content."""
+    block = hashlib.sha256(seed.encode('utf-8')).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+class StandInServer():
+    """
+    HTTP stand-in for ElevenLabs, uguu and file hosting.
+
+    Routes:
+        POST /v1/text-to-speech/<voice_id>  audio of about 1KB per character of text
+        POST /v1/voices/add                 {"voice_id": ...}
+        GET  /v1/voices/<voice_id>          the voice
+        POST /upload                        uguu style {"success": true, "files": [{"url": ...}]}
+        GET  /files/<path>                  files of serve_dir, with ETag and Last-Modified
+        GET  /stats                         call counts per endpoint
+        POST /reset                         clear the call counts
+    """
+    def __init__(self, serve_dir: str, profiles: Dict[str, Profile], host: str = '127.0.0.1', port: int = 0):
+        self.serve_dir = os.path.abspath(serve_dir)
+        self.profiles = profiles
+        self.counter = CallCounter()
+        self.voices = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self) -> bytes:
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _send(self, status: int, body: bytes, content_type: str = 'application/json', headers: Optional[dict] = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _json(self, status: int, data, headers: Optional[dict] = None):
+                self._send(status, json.dumps(data).encode('utf-8'), headers=headers)
+
+            def _fail(self, name: str, status: int) -> bool:
+                """Answer a failed call, returns False if the call succeeds."""
+                if status == 200:
+                    return False
+                standin.counter.record(name, status)
+                if name == 'uguu.upload':
+                    self._json(status, {'success': False, 'errorcode': status, 'description': 'Stand-in failure'})
+                elif status == 429:
+                    self._json(429, {'detail': {'status': 'too_many_concurrent_requests'}}, {'Retry-After': '1'})
+                else:
+                    self._json(status, {'detail': {'status': 'internal_error'}})
+                return True
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self._body()
+                if path == '/reset':
+                    standin.counter.reset()
+                    self._json(200, {})
+                elif path.startswith('/v1/text-to-speech/'):
+                    if self._fail('elevenlabs.tts', standin.profiles['elevenlabs.tts'].call()):
+                        return
+                    text = json.loads(body or b'{}').get('text', '')
+                    audio = fake_bytes(text, 1024 * max(1, len(text)))
+                    standin.counter.record('elevenlabs.tts', 200, len(audio))
+                    self._send(200, audio, 'audio/mpeg')
+                elif path == '/v1/voices/add':
+                    if self._fail('elevenlabs.clone', standin.profiles['elevenlabs.clone'].call()):
+                        return
+                    standin.counter.record('elevenlabs.clone', 200, len(body))
+                    standin.voices += 1
+                    self._json(200, {'voice_id': f'standin-voice-{standin.voices}'})
+                elif path == '/upload':
+                    if self._fail('uguu.upload', standin.profiles['uguu.upload'].call()):
+                        return
+                    standin.counter.record('uguu.upload', 200, len(body))
+                    self._json(200, {'success': True, 'files': [{'url': f'{standin.url}/files/uploads/{uuid.uuid4().hex}.mp3'}]})
+                else:
+                    self._json(404, {'detail': 'not found'})
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == '/stats':
+                    self._json(200, standin.counter.snapshot())
+                elif path.startswith('/v1/voices/'):
+                    if self._fail('elevenlabs.voice', standin.profiles['elevenlabs.voice'].call()):
+                        return
+                    standin.counter.record('elevenlabs.voice')
+                    self._json(200, {'voice_id': path.rsplit('/', 1)[-1]})
+                elif path.startswith('/files/'):
+                    self._file(path[len('/files/'):])
+                else:
+                    self._json(404, {'detail': 'not found'})
+
+            def do_HEAD(self):
+                path = urlparse(self.path).path
+                if path.startswith('/files/'):
+                    self._file(path[len('/files/'):])
+                else:
+                    self._send(404, b'')
+
+            def _file(self, name: str):
+                file_path = os.path.abspath(os.path.join(standin.serve_dir, name))
+                if not file_path.startswith(standin.serve_dir + os.sep) or not os.path.isfile(file_path):
+                    self._send(404, b'', 'text/plain')
+                    return
+                time.sleep(standin.profiles['files.get'].delay())
+                stat = os.stat(file_path)
+                etag = f'"{stat.st_size:x}-{int(stat.st_mtime_ns):x}"'
+                if self.headers.get('If-None-Match') == etag:
+                    standin.counter.record('files.get', 304)
+                    self._send(304, b'', 'application/octet-stream', {'ETag': etag})
+                    return
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                standin.counter.record('files.get', 200, len(data) if self.command == 'GET' else 0)
+                last_modified = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(stat.st_mtime))
+                self._send(200, data, 'application/octet-stream', {'ETag': etag, 'Last-Modified': last_modified})
+
+        return Handler
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self) -> 'StandInServer':
+        """Serve from a background thread, for tests that run the server in process."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Response():
+    """Mimics the pydantic models of the Sync SDK, whose json() returns a JSON string."""
+
+    def __init__(self, data: dict):
+        self.data = data
+        for key, value in data.items():
+            setattr(self, key, value)
+
+    def json(self) -> str:
+        return json.dumps(self.data)
+
+
+class FakeSync():
+    """
+    In process stand-in for the Sync SDK client, covering generations and batch.
+
+    Jobs and batches finish after a processing time drawn from the sync.job and sync.batch_job
+    profiles, their error_rate is the share of jobs that end FAILED. Batch outputs are written
+    into serve_dir so the stand-in server hosts them at base_url/files/batches/<id>.jsonl.
+    """
+    def __init__(self, profiles: Dict[str, Profile], serve_dir: str = '', base_url: str = '',
+                 counter: Optional[CallCounter] = None):
+        self.profiles = profiles
+        self.serve_dir = serve_dir
+        self.base_url = base_url
+        self.counter = counter or CallCounter()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._batches = {}
+        self.generations = SimpleNamespace(create=self._create_generation, get=self._get_generation)
+        self.batch = SimpleNamespace(create=self._create_batch, get=self._get_batch)
+
+    def _call(self, name: str, nbytes: int = 0):
+        from sync.core.api_error import ApiError
+
+        status = self.profiles[name].call()
+        self.counter.record(name, status, nbytes)
+        if status == 429:
+            raise ApiError(status_code=429, body={'message': 'Too many requests'})
+        if status != 200:
+            raise ApiError(status_code=status, body={'message': 'Internal server error'})
+
+    def _finish(self, name: str) -> tuple:
+        profile = self.profiles[name]
+        return time.time() + profile.delay(), random.random() >= profile.error_rate
+
+    def _create_generation(self, input=None, model=None, options=None, **kwargs):
+        self._call('sync.generations.create')
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._jobs[job_id] = (time.time(),) + self._finish('sync.job')
+        return _Response({'id': job_id, 'status': 'PENDING', 'model': model})
+
+    def _get_generation(self, id=None, **kwargs):
+        self._call('sync.generations.get')
+        with self._lock:
+            created, done_at, ok = self._jobs[id]
+        data = {'id': id, 'status': self._status(created, done_at, ok), 'output_url': None, 'error': None}
+        if data['status'] == 'COMPLETED':
+            data['output_url'] = f'{self.base_url}/files/outputs/{id}.mp4'
+        elif data['status'] == 'FAILED':
+            data['error'] = 'Stand-in job failure'
+        return _Response(data)
+
+    @staticmethod
+    def _status(created: float, done_at: float, ok: bool) -> str:
+        now = time.time()
+        if now >= done_at:
+            return 'COMPLETED' if ok else 'FAILED'
+        return 'PENDING' if now < created + (done_at - created) / 4 else 'PROCESSING'
+
+    def _create_batch(self, input=None, dry_run=False, **kwargs):
+        data = input.read() if hasattr(input, 'read') else input
+        self._call('sync.batch.create', len(data))
+        request_ids = [json.loads(line).get('request_id') for line in data.splitlines() if line.strip()]
+        batch_id = str(uuid.uuid4())
+        if not dry_run:
+            with self._lock:
+                self._batches[batch_id] = (time.time(), self._finish('sync.batch_job')[0], request_ids)
+        return _Response({'id': batch_id, 'status': 'PENDING'})
+
+    def _get_batch(self, id=None, **kwargs):
+        self._call('sync.batch.get')
+        with self._lock:
+            created, done_at, request_ids = self._batches[id]
+        total = len(request_ids)
+        progress = min(1.0, (time.time() - created) / max(done_at - created, 1e-6))
+        failure_rate = self.profiles['sync.job'].error_rate
+        finished = int(total * progress)
+        failed = int(finished * failure_rate)
+        status = 'COMPLETED' if progress >= 1 else ('PROCESSING' if finished else 'PENDING')
+
+        output_url = None
+        if status == 'COMPLETED':
+            output_url = self._write_output(id, request_ids, failure_rate)
+        metrics = SimpleNamespace(total_generations=total, success_count=finished - failed,
+                                  failed_count=failed, pending_count=total - finished)
+        return SimpleNamespace(id=id, status=status, metrics=metrics, output_url=output_url)
+
+    def _write_output(self, batch_id: str, request_ids: list, failure_rate: float) -> str:
+        name = f'batches/{batch_id}.jsonl'
+        path = os.path.join(self.serve_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w') as f:
+                for i, request_id in enumerate(request_ids):
+                    failed = i < int(len(request_ids) * failure_rate)
+                    line = {
+                        'request_id': request_id,
+                        'generation_id': str(uuid.uuid4()),
+                        'status': 'FAILED' if failed else 'COMPLETED',
+                        'output_url': None if failed else f'{self.base_url}/files/outputs/{request_id}.mp4',
+                        'error': 'Stand-in job failure' if failed else None,
+                    }
+                    f.write(json.dumps(line) + '\n')
+            os.replace(tmp_path, path)
+        return f'{self.base_url}/files/{name}'
+
+
+class StandInError(Exception):
+    """Error raised by FakeOpenAI, carries the HTTP status like the errors of the OpenAI SDK."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f'Error code: {status_code}')
+        self.status_code = status_code
+
+
+class FakeOpenAI():
+    """
+    In process stand-in for the OpenAI client, covering audio transcriptions and chat completions.
+
+    Transcripts are derived from the audio content, translations tag the source text, and JSON
+    mode requests of translate_batch are answered with a translation for every item.
+    """
+    def __init__(self, profiles: Dict[str, Profile], counter: Optional[CallCounter] = None):
+        self.profiles = profiles
+        self.counter = counter or CallCounter()
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._transcribe))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._complete))
+
+    def _call(self, name: str, nbytes: int = 0):
+        status = self.profiles[name].call()
+        self.counter.record(name, status, nbytes)
+        if status != 200:
+            raise StandInError(status)
+
+    def _transcribe(self, model=None, file=None, response_format=None, **kwargs):
+        data = file.read()
+        self._call('openai.transcriptions', len(data))
+        digest = hashlib.sha256(data).hexdigest()
+        words = [digest[i:i + 6] for i in range(0, 60, 6)]
+        text = f"Transcript {' '.join(words)}."
+        segments = [{'start': 0.0, 'end': 5.0, 'text': text}] if response_format == 'verbose_json' else None
+        return SimpleNamespace(text=text, segments=segments)
+
+    def _complete(self, model=None, messages=None, temperature=None, response_format=None, **kwargs):
+        content = messages[-1]['content']
+        self._call('openai.chat', len(content.encode('utf-8')))
+        if response_format and response_format.get('type') == 'json_object':
+            items = json.loads(content)['items']
+            answer = json.dumps({'translations': [{'id': item['id'], 'text': f"[translated] {item['text']}"} for item in items]})
+        else:
+            answer = f'[translated] {content}'
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer), finish_reason='stop')])
+
+
+def fake_ffmpeg(profile: Profile, counter: Optional[CallCounter] = None):
+    """
+    Replacement for FileProcessor.run_ffmpeg_command that writes stand-in audio instead of
+    running FFmpeg. The output depends on the command, so different inputs give different audio.
+    """
+    def run_ffmpeg_command(command: str) -> bytes:
+        time.sleep(profile.delay())
+        tokens = shlex.split(command)
+        if counter:
+            counter.record('ffmpeg')
+        if tokens[-1] == 'pipe:1':
+            # raw PCM for loudest_window, one second of silence
+            return bytes(2 * 8000)
+        output_path = tokens[-1]
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'wb') as f:
+            f.write(fake_bytes(command, 32 * 1024))
+        return b''
+
+    return run_ffmpeg_command
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the stand-in HTTP server for ElevenLabs, uguu and file hosting")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--serve-dir", required=True, help="Directory served under /files/")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (default: 0, any free port)")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    server = StandInServer(args.serve_dir, profiles_from_args(args), port=args.port)
+    # the first line tells the benchmark runner where to find the server
+    print(server.url, flush=True)
+    server.serve_forever()
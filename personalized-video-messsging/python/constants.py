@@ -2,3 +2,27 @@ SYNCLABS_API_KEY = ""
 ELEVENLABS_API_KEY = ""
 INPUT_CSV_PATH = "example.csv"
 OUTPUT_CSV_PATH = "outputs.csv"
+
+# number of csv rows processed concurrently, set to 1 to process the rows one after another
+MAX_WORKERS = 8
+# max concurrent requests per stage, keep these within your API rate limits
+TTS_WORKERS = 4
+UPLOAD_WORKERS = 4
+SUBMIT_WORKERS = 2
+# max submitted lipsync jobs waiting for their result, new rows are submitted as earlier jobs finish
+MAX_PENDING_JOBS = 500
+
+# generated speech is cached here and reused on reruns, set to "" to disable the cache
+TTS_CACHE_DIR = "Data/Cache/tts"
+TTS_CACHE_MAX_MB = 1024
+
+# seconds of the first video used as voice cloning reference, and whether to use its loudest part
+CLONE_SAMPLE_SECONDS = 60
+CLONE_SAMPLE_BEST_ENERGY = False
+# encoding of the voice cloning sample, one of AUDIO_PROFILES in src/Processor/FileProcessor.py
+CLONE_PROFILE = "clone"
+
+# per stage timings, bytes and retries of a run are written to this JSON report, set to "" to disable
+METRICS_REPORT_PATH = "run_report.json"
+# serve the metrics in the Prometheus text format on http://127.0.0.1:<port>/metrics during a run, 0 disables it
+METRICS_PORT = 0
@@ -1,13 +1,22 @@
 import os
+import argparse
 from src.PVMessenger import PVMessenger
 from constants import *
 
 if __name__ == "__main__":
     
+    parser = argparse.ArgumentParser(description="Generate personalized video messages from a csv")
+    parser.add_argument("--resume", action="store_true", default=False, help="Resume an interrupted run, skipping the work recorded in its journal (default: False)")
+    args = parser.parse_args()
     
     root_dir = os.getcwd()
     
-    pvm =  PVMessenger(root_dir, SYNCLABS_API_KEY, ELEVENLABS_API_KEY)
-    output_path = pvm.run(INPUT_CSV_PATH, OUTPUT_CSV_PATH) 
+    stage_limits = {'tts': TTS_WORKERS, 'upload': UPLOAD_WORKERS, 'submit': SUBMIT_WORKERS}
+    pvm =  PVMessenger(root_dir, SYNCLABS_API_KEY, ELEVENLABS_API_KEY, MAX_WORKERS, stage_limits,
+                        TTS_CACHE_DIR, TTS_CACHE_MAX_MB,
+                        clone_sample_seconds=CLONE_SAMPLE_SECONDS, clone_sample_best_energy=CLONE_SAMPLE_BEST_ENERGY,
+                        clone_profile=CLONE_PROFILE, metrics_report_path=METRICS_REPORT_PATH,
+                        metrics_port=METRICS_PORT, max_pending_jobs=MAX_PENDING_JOBS)
+    output_path = pvm.run(INPUT_CSV_PATH, OUTPUT_CSV_PATH, resume=args.resume) 
     print(f'The final csv output is stored at {output_path}')
-    
\ No newline at end of file
+    
@@ -1,31 +1,90 @@
 import os
+import time
+import itertools
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 
 from src.service.LipSyncService import LipSyncProcessor
 from src.service.VoiceService import VoiceProcessor
 from src.Processor.FileProcessor import FileProcessor
+from src.Processor.DiskCache import DiskCache
+from src.Processor.Uploader import UploadBackend
+from src.Processor.RunJournal import RunJournal
+from src.Processor.VoiceRegistry import VoiceRegistry
+from src.Processor.Metrics import metrics
 
 
 class PVMessenger:
     def __init__(self,
                 root_dir: str,
                 lipsync_api_key: str,
-                elevenlabs_api_key: str
+                elevenlabs_api_key: str,
+                max_workers: int = 1,
+                stage_limits: Optional[Dict[str, int]] = None,
+                tts_cache_dir: str = '',
+                tts_cache_max_mb: int = 1024,
+                upload_backend: Optional[UploadBackend] = None,
+                clone_sample_seconds: int = 60,
+                clone_sample_best_energy: bool = False,
+                clone_profile: str = 'clone',
+                metrics_report_path: str = '',
+                metrics_port: int = 0,
+                max_pending_jobs: int = 500
             ):
         
         self.root_dir = root_dir
-        self.file_processor = FileProcessor(self.root_dir)
+        self.file_processor = FileProcessor(self.root_dir, upload_backend)
         self.lipsync_service = LipSyncProcessor(lipsync_api_key) 
-        self.voice_service = VoiceProcessor(elevenlabs_api_key)
+        
+        # reruns of the same csv reuse previously generated speech instead of calling TTS again
+        self.tts_cache = None
+        if tts_cache_dir:
+            self.tts_cache = DiskCache(os.path.join(self.root_dir, tts_cache_dir), tts_cache_max_mb * 1024 * 1024, suffix='.mp3')
+        self.voice_service = VoiceProcessor(elevenlabs_api_key, self.tts_cache)
+        self.voice_registry = VoiceRegistry(os.path.join(self.root_dir, "Data/Cache/voices.json"))
+        # length of the reference sample used for voice cloning and whether to pick its loudest part
+        self.clone_sample_seconds = clone_sample_seconds
+        self.clone_sample_best_energy = clone_sample_best_energy
+        # encoding of the reference sample, one of AUDIO_PROFILES in FileProcessor.py
+        self.clone_profile = clone_profile
+        # per stage timings, bytes and retries are written to this JSON report after a run,
+        # and served in the Prometheus text format on this port during the run if it's set
+        self.metrics_report_path = metrics_report_path
+        self.metrics_port = metrics_port
+
+        # number of csv rows in flight at once, 1 processes the rows one after another
+        self.max_workers = max(1, max_workers)
+        # number of submitted lipsync jobs waiting for their result at once, reading the csv
+        # pauses at this limit so memory stays bounded on large inputs
+        self.max_pending_jobs = max(1, max_pending_jobs)
+        
+        # per stage concurrency limits so a slow stage can't starve the API limits of another
+        stage_limits = stage_limits or {}
+        self.stage_locks = {
+            stage: threading.BoundedSemaphore(max(1, stage_limits.get(stage, self.max_workers)))
+            for stage in ('tts', 'upload', 'submit')
+        }
 
         print(f'Initialized the Lipsync & ElevenLabs services.') 
     
-    def run(self, input_csv_path: str, output_csv_path: str):
+    def run(self, input_csv_path: str, output_csv_path: str, resume: bool = False, journal_path: str = None):
         """
         Performs all the steps needed for generating personalized video messages like voice 
         cloning, TTS, lip-syncing.
         
+        Every completed stage is journaled, an interrupted run restarted with resume=True
+        skips the voice clone, TTS, uploads and lipsync submissions it already did.
+        
         Args:
-            csv_path (str): Path to the input csv
+            input_csv_path (str): Path to the input csv
+            output_csv_path (str): Path to write the output csv to
+            resume (bool, optional): Reuse the work recorded in the journal of a previous run.
+                                    Defaults to False, which starts a fresh journal.
+            journal_path (str, optional): Path of the journal. Defaults to the output csv path
+                                         with a .journal suffix.
                 
         Returns:
             str: Path to where the output csv is written
@@ -33,68 +92,240 @@ class PVMessenger:
         Raises:
             requests.exceptions.RequestException: If the API requests, file downloads, uploads fail
         """
-        # load the input csv file into a dict
-        entries = self.file_processor.load_csv_data(input_csv_path)
-        jobs = []
+        self.journal = RunJournal(journal_path or f'{output_csv_path}.journal', resume)
+        try:
+            with metrics.recording(self.metrics_report_path, self.metrics_port):
+                return self._run(input_csv_path, output_csv_path)
+        finally:
+            self.journal.close()
+
+    def _run(self, input_csv_path: str, output_csv_path: str):
+        # stream the input csv, a row is only kept in memory until its lipsync job finishes
+        entries = self.file_processor.iter_csv_data(input_csv_path)
+        first = next(entries, None)
+        if first is None:
+            print(f'No entries found in {input_csv_path}')
+            return output_csv_path
+        entries = itertools.chain([first], entries)
         # print(f'Loaded csv file at {input_csv_path} successfully')
         # clone voice using the first entry as the reference if no voice IDs specified in input csv
-        if not entries[0]['voice_id']:
-            print(f'No voice ID found, cloning voice using first entry as reference')
-            temp_video = self.file_processor.download(entries[0]['video'])
-            temp_audio = self.file_processor.extract_audio(temp_video)
-            
-            name = 'my_voice_clone'
-            voice_id = self.voice_service.clone_voice(name, temp_audio)
+        voice_id = None
+        if not first['voice_id']:
+            clone_key = RunJournal.row_key({'video': first['video']})
+            voice_id = self.journal.get('voice_clone', clone_key).get('voice_id')
+            if voice_id:
+                print(f'Reusing journaled voice clone {voice_id}')
+            else:
+                print(f'No voice ID found, cloning voice using first entry as reference')
+                # only a bounded sample of the reference video is streamed and encoded
+                temp_audio = self.file_processor.extract_audio_sample(
+                    first['video'], self.clone_sample_seconds, self.clone_sample_best_energy,
+                    profile=self.clone_profile
+                )
+                
+                # the same reference sample reuses the voice cloned by an earlier run
+                name = 'my_voice_clone'
+                fingerprint = VoiceRegistry.fingerprint(temp_audio, self.clone_profile)
+                voice_id = self.voice_registry.get_or_create(
+                    fingerprint,
+                    lambda: self.voice_service.clone_voice(name, temp_audio),
+                    self.voice_service.voice_exists,
+                    first['video'],
+                )
+                self.journal.record('voice_clone', clone_key, voice_id=voice_id)
+
+                # cleanup temp audio file
+                os.remove(temp_audio)
+        
+        def with_voice_id(entries):
+            for entry in entries:
+                # update voice_id in all entries
+                if not entry['voice_id']:
+                    entry['voice_id'] = voice_id
+                yield entry
+        
+        row_keys = {}
+        def with_row_key(rows):
+            # the journal key of a row is taken before its stages fill in the entry
+            for i, entry in rows:
+                row_keys[i] = RunJournal.row_key(entry)
+                yield i, entry
+        rows = with_row_key(enumerate(with_voice_id(entries)))
+        
+        # output rows are written as soon as they are submitted and updated once their job finishes,
+        # jobs are polled on a thread while the later rows are still being submitted
+        writer = self.file_processor.incremental_csv_writer(output_csv_path)
+        pending_rows = {}
+        job_queue = queue.Queue()
+        stop_polling = threading.Event()
+        poll_errors = []
+        # every submitted job holds a slot until its result is written
+        job_slots = threading.Semaphore(self.max_pending_jobs)
+        
+        def collect(i, entry, job):
+            key = row_keys.pop(i)
+            if job:
+                pending_rows[i] = (entry, key)
+            writer.update(i, entry)
+            if job:
+                job_queue.put(job)
+            else:
+                job_slots.release()
+        
+        def on_result(res):
+            # the row is dropped once its final state is handed to the writer
+            entry, key = pending_rows.pop(res['idx'])
+            entry['output_url'] = res['output_url']
+            writer.update(res['idx'], entry)
+            if res.get('status') in ('COMPLETED', 'FAILED'):
+                self.journal.record(res['idx'], key, output_url=res['output_url'])
+            job_slots.release()
+        
+        def poll():
+            try:
+                self.lipsync_service.poll_for_status(job_queue, on_result=on_result, stop=stop_polling)
+            except Exception as e:
+                poll_errors.append(e)
+        
+        poller = threading.Thread(target=poll, daemon=True)
+        
+        def reserve_slot():
+            # wait for a pending job to finish before starting another row
+            while not job_slots.acquire(timeout=1):
+                if not poller.is_alive():
+                    raise poll_errors[0] if poll_errors else RuntimeError('Lipsync status polling stopped')
+        
+        poller.start()
+        try:
+            if self.max_workers == 1:
+                for i, entry in rows:
+                    reserve_slot()
+                    collect(i, entry, self.process_entry(i, entry))
+            else:
+                # rows flow through the stages independently, results are collected in row order
+                # and only a couple of rows per worker are read ahead of the slowest one
+                print(f'Processing entries with {self.max_workers} workers')
+                executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                in_flight = deque()
+                
+                def collect_oldest():
+                    i, entry, future = in_flight.popleft()
+                    collect(i, entry, future.result())
+                
+                try:
+                    for i, entry in rows:
+                        if not job_slots.acquire(blocking=False):
+                            # hand the submitted rows to the poller before waiting for their slots
+                            while in_flight:
+                                collect_oldest()
+                            reserve_slot()
+                        in_flight.append((i, entry, executor.submit(self.process_entry, i, entry)))
+                        if len(in_flight) >= 2 * self.max_workers:
+                            collect_oldest()
+                    while in_flight:
+                        collect_oldest()
+                except Exception:
+                    # stop submitting new rows like the sequential mode does on an error
+                    for _, _, future in in_flight:
+                        future.cancel()
+                    raise
+                finally:
+                    executor.shutdown(wait=True)
 
-            # cleanup temp video and audio files
-            os.remove(temp_video)
-            os.remove(temp_audio)
-        
-        for i, entry in enumerate(entries):
-            # update voice_id in all entries
-            if not entry['voice_id']:
-                entry['voice_id'] = voice_id
+            if self.tts_cache:
+                stats = self.tts_cache.stats()
+                print(f"TTS cache: {stats['hits']} hits, {stats['misses']} misses")
+            upload_stats = self.file_processor.uploader.stats()
+            print(f"Uploads: {upload_stats['uploaded']} uploaded, {upload_stats['reused']} reused")
 
-            # generate speech using the voice ID and the text field from the csv, output is audio bytes
-            # print(f"Generating speech for voice ID: {entry['voice_id']}, entry {i+1}")
-            input_audio = self.voice_service.generate_speech(entry)
-            
-            # write the output in a temp mp3 file
-            dir = f"Data/Inputs"
-            full_path = os.path.join(self.root_dir, dir)
-            os.makedirs(full_path, exist_ok=True)
-            tmp_aud = os.path.join(full_path, f'gen_aud_{i}.mp3')
-            
-            with open(tmp_aud, "wb") as audio_file:
-                audio_file.write(input_audio)
+            # wait for the remaining lipsync jobs
+            print(f'Polling for lipsync job completions...')
+            job_queue.put(None)
+            poller.join()
+            if poll_errors:
+                raise poll_errors[0]
+        except Exception:
+            stop_polling.set()
+            job_queue.put(None)
+            poller.join()
+            # keep whatever finished visible in the output csv
+            writer.flush()
+            writer.merge()
+            raise
+        
+        writer.close()
+
+        return output_csv_path
+
+    def process_entry(self, i: int, entry: Dict):
+        """
+        Runs the TTS, upload and lipsync submission steps for a single csv row,
+        skipping the steps already recorded in the journal.
+        
+        Args:
+            i (int): Index of the entry in the input csv
+            entry (Dict): Entry loaded from the input csv, updated in place
+                
+        Returns:
+            tuple: (index, job_id) of the lipsync job to poll, None if the upload failed
+                   or the job already finished in a previous run
+        """
+        key = RunJournal.row_key(entry)
+        done = self.journal.get(i, key)
+        
+        if done.get('job_id'):
+            entry['audio'] = done.get('audio_url', '')
+            entry['lipsync_jobID'] = done['job_id']
+            if done.get('output_url'):
+                entry['output_url'] = done['output_url']
+                return None
+            print(f"Entry {i+1} already submitted, job ID: {done['job_id']}")
+            return (i, done['job_id'])
+        
+        dir = f"Data/Inputs"
+        full_path = os.path.join(self.root_dir, dir)
+        os.makedirs(full_path, exist_ok=True)
+        tmp_aud = os.path.join(full_path, f'gen_aud_{i}.mp3')
+        
+        # a journaled upload is reused while its URL is still valid
+        aud_url = None
+        expires = done.get('audio_url_expires')
+        if done.get('audio_url') and (expires is None or expires > time.time()):
+            aud_url = done['audio_url']
+        
+        if not aud_url:
+            if not (done.get('audio') and os.path.exists(tmp_aud)):
+                # generate speech using the voice ID and the text field from the csv, streamed into a temp mp3 file
+                # print(f"Generating speech for voice ID: {entry['voice_id']}, entry {i+1}")
+                with self.stage_locks['tts']:
+                    self.voice_service.generate_speech_to_file(entry, tmp_aud)
+                self.journal.record(i, key, audio=tmp_aud)
             
-            # upload the temp file to a temp file hosting service and get the url
-            aud_url = self.file_processor.upload_file_uguu(tmp_aud)
+            try:
+                # upload the temp file to a temp file hosting service and get the url
+                with self.stage_locks['upload']:
+                    aud_url = self.file_processor.upload_file(tmp_aud)
+            finally:
+                # delete the generated speech temp audio file
+                os.remove(tmp_aud)
             
             if aud_url:
                 print(f'Uploaded generated speech for entry {i+1} to {aud_url}')
-                entry['audio'] = aud_url
-
-                # post the lipsyncing request to the API endpoint
-                response_json = self.lipsync_service.process_lip_sync(entry)
-                print(f'Submitted lipsync job successfully for entry {i+1}, job ID: {response_json["id"]}') 
-                jobs.append((i,response_json['id']))
-                entry['lipsync_jobID'] = response_json['id']
-            
-            else:
-                entry['audio'] = 'Generated speech upload error'
-
-            # delete the generated speech temp audio file
-            os.remove(tmp_aud)
-
-        # poll for lipsync job status updates
-        print(f'Polling for lipsync job completions...')
-        lipsync_results = self.lipsync_service.poll_for_status(jobs)
+                expires = self.file_processor.uploader.url_expiry()
+                self.journal.record(i, key, audio_url=aud_url,
+                                    audio_url_expires=None if expires == float('inf') else expires)
         
-        for res in lipsync_results:
-            entries[res['idx']]['output_url'] = res['output_url']
+        if not aud_url:
+            entry['audio'] = 'Generated speech upload error'
+            return None
         
-        self.file_processor.write_dicts_to_csv(entries, output_csv_path)
-
-        return output_csv_path
-        
\ No newline at end of file
+        entry['audio'] = aud_url
+        
+        # post the lipsyncing request to the API endpoint
+        with self.stage_locks['submit']:
+            response_json = self.lipsync_service.process_lip_sync(entry)
+        print(f'Submitted lipsync job successfully for entry {i+1}, job ID: {response_json["id"]}') 
+        entry['lipsync_jobID'] = response_json['id']
+        self.journal.record(i, key, job_id=response_json['id'])
+        
+        return (i, response_json['id'])
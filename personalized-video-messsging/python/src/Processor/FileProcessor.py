@@ -1,71 +1,189 @@
 import os
+import hashlib
 import subprocess
 import csv
-import urllib.request
-import requests
+import time
+import tempfile
+import threading
+import shutil
+import shlex
+from array import array
+from urllib.parse import urlparse
+from typing import Dict, Iterator, List, Optional
+
+from src.Processor.Uploader import Uploader, UploadBackend
+from src.Processor.Downloader import DownloadManager
+from src.Processor.Metrics import metrics
+
+
+# FFmpeg encodings of extracted audio, every consumer gets a file sized for its use
+AUDIO_PROFILES = {
+    # uncompressed audio at the source sample rate
+    'source': {'ext': 'wav', 'options': ''},
+    # speech recognition runs at 16kHz mono, lossless flac is about a tenth of a source wav
+    'transcription': {'ext': 'flac', 'options': '-ac 1 -ar 16000 -c:a flac'},
+    # smallest upload for speech recognition, opus at 24kbps
+    'transcription_opus': {'ext': 'ogg', 'options': '-ac 1 -ar 16000 -c:a libopus -b:a 24k -application voip'},
+    # voice cloning keeps the full bandwidth of the voice in a mono mp3
+    'clone': {'ext': 'mp3', 'options': '-ac 1 -ar 44100 -b:a 128k'},
+}
 
 
 class FileProcessor():
     """
     Handles video downloading, audio extraction, handling of csv files.
     """
-    def __init__(self, root_dir: str):
+    def __init__(self, root_dir: str, upload_backend: Optional[UploadBackend] = None):
         self.root_dir = root_dir
+        # uploads go to uguu unless another backend is passed in
+        self.uploader = Uploader(upload_backend)
+        self.downloader = DownloadManager(os.path.join(self.root_dir, "Data/Cache/downloads"))
     
     def download(self, url: str) -> str:
-        """Download files from URL and return the local file path."""
+        """
+        Download files from URL and return the local file path.
+        
+        The file comes from the download cache, which only transfers it again if it changed
+        on the server, so callers can delete the returned copy as before.
+        """
         
         dir = f"Data/Inputs"
         full_path = os.path.join(self.root_dir, dir)
         os.makedirs(full_path, exist_ok=True)
-        local_filename = os.path.join(dir, os.path.basename(url))
-        urllib.request.urlretrieve(url, local_filename)
+        local_filename = os.path.join(dir, self.local_name(url))
+        cached_path = self.downloader.fetch(url)
+        
+        # hard link the cached file into place, copy it where links aren't supported
+        if os.path.exists(local_filename):
+            os.remove(local_filename)
+        try:
+            os.link(cached_path, local_filename)
+        except OSError:
+            shutil.copyfile(cached_path, local_filename)
         
         return local_filename
     
-    def run_ffmpeg_command(self, command: str):
-        process = subprocess.run(
-            command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+    @staticmethod
+    def local_name(url: str) -> str:
+        """
+        File name of the local copy of a URL, prefixed with a hash of the URL.
+        
+        Videos with the same file name at different URLs get their own local copies, and so
+        do the audio and speech files named after them.
+        """
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]
+        return f"{digest}_{os.path.basename(urlparse(url).path)}"
+    
+    def run_ffmpeg_command(self, command: str) -> bytes:
+        with metrics.span('ffmpeg') as span:
+            process = subprocess.run(
+                command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            if process.returncode != 0:
+                span.fail()
         if process.returncode != 0:
             print(f"FFmpeg error: {process.stderr.decode()}")
             raise Exception("FFmpeg command failed for extracting audio")
+        return process.stdout
         
-    def extract_audio(self, video_path: str) -> str:
-        """ Extract audio from video file using FFmpeg. """
+    def audio_options(self, profile: str) -> str:
+        """FFmpeg output options of an extraction profile, encoded bitexact so the same input gives identical files."""
+        if profile not in AUDIO_PROFILES:
+            raise ValueError(f"Unknown audio profile {profile}, choose one of {', '.join(AUDIO_PROFILES)}")
+        options = AUDIO_PROFILES[profile]['options']
+        return f"{options} -map_metadata -1 -fflags +bitexact -flags:a +bitexact".strip()
+    
+    def extract_audio(self, video_path: str, profile: str = 'source') -> str:
+        """ Extract audio from video file using FFmpeg, encoded by one of the AUDIO_PROFILES. """
                 
-        # Generate audio filename
+        options = self.audio_options(profile)
+        # Generate audio filename, downloaded videos are named after a hash of their URL so it is unique per video
         dir = f"Data/Inputs"
         file_name = os.path.basename(video_path)
         stem = os.path.splitext(file_name)[0]
-        audio_filename = f"{stem}_audio.wav"
+        audio_filename = f"{stem}_{profile}.{AUDIO_PROFILES[profile]['ext']}"
         audio_path = os.path.join(dir,audio_filename)
         
         # Construct FFmpeg command
-        command = f"ffmpeg -i {video_path} -vn {audio_path}"
+        command = f"ffmpeg -y -i {shlex.quote(video_path)} -vn {options} {shlex.quote(audio_path)}"
         self.run_ffmpeg_command(command)
         
         return audio_path
 
-    def upload_file_uguu(self, file_path: str):
-        """Upload a local file to uguu and get the url"""
-    
-        try:
-            url = 'https://uguu.se/upload'
-            with open(file_path, "rb") as audio_file: 
-                data = [('files[]', audio_file)]
-                response = requests.post(url, files=data)
-            res = response.json()
-            if res['success']:
-                output = res['files'][0]['url']
-                return output
-            else:
-                print(f"Error {res['errorcode']} during upload: {res['description']}")
-               
-        except Exception as e:
-            print(f"Error during upload: {str(e)}")
-            return None
-        return None
+    def extract_audio_sample(self, source: str, duration: int = 60, best_energy: bool = False,
+                             scan_seconds: Optional[int] = None, profile: str = 'clone') -> str:
+        """
+        Extract a bounded, compact audio sample for voice cloning using FFmpeg.
+        
+        FFmpeg reads the source directly, so a URL is streamed instead of downloaded first,
+        and only the sampled part of the source is read. Time and disk usage therefore stay
+        the same whatever the length of the source video.
+        
+        Args:
+            source (str): URL or local path of the video
+            duration (int, optional): Length of the sample in seconds. Defaults to 60.
+            best_energy (bool, optional): Pick the loudest window of the first scan_seconds
+                                          instead of the first seconds. Defaults to False.
+            scan_seconds (int, optional): How much of the source to scan for the loudest
+                                          window. Defaults to 5 times the duration.
+            profile (str, optional): Encoding from AUDIO_PROFILES. Defaults to the mono mp3 'clone' profile.
+            
+        Returns:
+            str: Path of the extracted sample
+        """
+        dir = f"Data/Inputs"
+        os.makedirs(os.path.join(self.root_dir, dir), exist_ok=True)
+        stem = os.path.splitext(os.path.basename(urlparse(source).path))[0]
+        options = self.audio_options(profile)
+        audio_path = os.path.join(dir, f"{stem}_sample.{AUDIO_PROFILES[profile]['ext']}")
+        
+        start = 0
+        if best_energy:
+            start = self.loudest_window(source, duration, scan_seconds or 5 * duration)
+        
+        # bitexact output keeps the sample byte identical between runs so it can be fingerprinted
+        command = (
+            f"ffmpeg -y -ss {start} -t {duration} -i {shlex.quote(source)} -vn {options} {shlex.quote(audio_path)}"
+        )
+        self.run_ffmpeg_command(command)
+        
+        return audio_path
+
+    def loudest_window(self, source: str, duration: int, scan_seconds: int) -> int:
+        """
+        Find the start second of the loudest window of the given duration in the first
+        scan_seconds of the source, decoded by FFmpeg to low rate PCM through a pipe.
+        """
+        sample_rate = 8000
+        command = (
+            f"ffmpeg -t {scan_seconds} -i {shlex.quote(source)} -vn -ac 1 -ar {sample_rate} "
+            f"-f s16le -acodec pcm_s16le pipe:1"
+        )
+        samples = array('h')
+        samples.frombytes(self.run_ffmpeg_command(command))
+        
+        # energy of every second, then the best run of `duration` consecutive seconds
+        energy = [
+            sum(x * x for x in samples[i:i + sample_rate])
+            for i in range(0, len(samples), sample_rate)
+        ]
+        if len(energy) <= duration:
+            return 0
+        window = best = sum(energy[:duration])
+        best_start = 0
+        for i in range(1, len(energy) - duration + 1):
+            window += energy[i + duration - 1] - energy[i - 1]
+            if window > best:
+                best, best_start = window, i
+        return best_start
+
+    def upload_file(self, file_path: str) -> Optional[str]:
+        """Upload a local file through the upload backend and get the url, identical files are only uploaded once"""
+        return self.uploader.upload(file_path)
+
+    def upload_file_uguu(self, file_path: str) -> Optional[str]:
+        """Upload a local file and get the url, kept for backwards compatibility, see upload_file"""
+        return self.upload_file(file_path)
     
     def load_csv_data(self, csv_path):
         """
@@ -74,6 +192,19 @@ class FileProcessor():
         Returns:
             List of dict objects loaded from the CSV file
         
+        Raises:
+            FileNotFoundError: If the CSV file does not exist
+            ValueError: If the CSV file has invalid structure
+        """
+        return list(self.iter_csv_data(csv_path))
+
+    def iter_csv_data(self, csv_path) -> Iterator[Dict]:
+        """
+        Stream data from the CSV file one dictionary at a time, without loading the whole file.
+        
+        Yields:
+            dict objects loaded from the CSV file, in file order
+        
         Raises:
             FileNotFoundError: If the CSV file does not exist
             ValueError: If the CSV file has invalid structure
@@ -84,7 +215,6 @@ class FileProcessor():
         if not os.path.exists(csv_path):
             raise FileNotFoundError(f"CSV file not found: {csv_path}")
         
-        entries = []
         with open(csv_path, 'r', newline='', encoding='utf-8') as file:
             reader = csv.DictReader(file)
             
@@ -105,9 +235,7 @@ class FileProcessor():
                     'tts_model': row.get('tts_model','eleven_multilingual_v2')
                 }
             
-                entries.append(entry)
-                
-        return entries
+                yield entry
     
     def write_dicts_to_csv(self, data, filename):
         """
@@ -135,10 +263,115 @@ class FileProcessor():
                 
                 # Write each row with only the specified keys
                 for row in data:
-                    filtered_row = {key: row[key] for key in fieldnames}  # Filter the row to include only specified keys
+                    filtered_row = {key: row.get(key, '') for key in fieldnames}  # Filter the row to include only specified keys
                     writer.writerow(filtered_row)
                 
             print(f"Successfully wrote {len(data)} rows to {filename}")
         
         except Exception as e:
-            print(f"Error writing to CSV: {str(e)}")
\ No newline at end of file
+            print(f"Error writing to CSV: {str(e)}")
+
+    def incremental_csv_writer(self, filename, flush_every: int = 1000, flush_interval: float = 10.0):
+        """
+        Open an IncrementalCSVWriter for the output csv, see IncrementalCSVWriter.
+        
+        Args:
+            filename (str): Output CSV filename
+            flush_every (int, optional): Flush after this many buffered row updates. Defaults to 1000.
+            flush_interval (float, optional): Flush when the last flush is older than this many seconds.
+                                              Defaults to 10 seconds.
+        """
+        fieldnames = ['video', 'text', 'audio', 'voice_id', 'lipsync_jobID', 'output_url']
+        return IncrementalCSVWriter(filename, fieldnames, flush_every, flush_interval)
+
+
+class IncrementalCSVWriter():
+    """
+    Writes output rows as they become available and updates them as jobs finish.
+    
+    Row updates are buffered until the next flush. New rows that directly follow the rows
+    already in the file are appended to it, updates to rows already in the file are appended
+    to a sidecar updates csv instead, so a flush never rewrites anything. close() merges the
+    updates into the output csv once, streaming it into a temp file that atomically replaces it.
+    Rows that arrive ahead of an earlier missing row are held back so row i is always line i.
+    """
+    def __init__(self, filename: str, fieldnames: List[str], flush_every: int = 1000, flush_interval: float = 10.0):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        # rows 0..written-1 are in the file, later versions of them in the updates file
+        self.updates_filename = f'{filename}.updates'
+        self.written = 0
+        self._pending: Dict[int, Dict] = {}
+        self._updates = 0
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        
+        with open(self.filename, 'w', newline='', encoding='utf-8') as csvfile:
+            csv.DictWriter(csvfile, fieldnames=self.fieldnames).writeheader()
+        if os.path.exists(self.updates_filename):
+            os.remove(self.updates_filename)
+
+    def update(self, idx: int, row: Dict):
+        """Add or replace the output row at index idx, flushing when enough updates are buffered."""
+        with self._lock:
+            self._pending[idx] = {key: row.get(key, '') for key in self.fieldnames}
+            self._updates += 1
+            due = self._updates >= self.flush_every or time.time() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered rows to the output csv and the buffered updates to the updates csv."""
+        with self._lock:
+            updated = {idx: self._pending.pop(idx) for idx in sorted(self._pending) if idx < self.written}
+            if updated:
+                with open(self.updates_filename, 'a', newline='', encoding='utf-8') as csvfile:
+                    writer = csv.writer(csvfile)
+                    for idx, row in updated.items():
+                        writer.writerow([idx] + [row[key] for key in self.fieldnames])
+            with open(self.filename, 'a', newline='', encoding='utf-8') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=self.fieldnames)
+                while self.written in self._pending:
+                    writer.writerow(self._pending.pop(self.written))
+                    self.written += 1
+            self._updates = 0
+            self._last_flush = time.time()
+
+    def merge(self):
+        """Apply the updates csv to the output csv, keeping the latest update of every row."""
+        with self._lock:
+            if not os.path.exists(self.updates_filename):
+                return
+            latest = {}
+            with open(self.updates_filename, 'r', newline='', encoding='utf-8') as updates_file:
+                for record in csv.reader(updates_file):
+                    latest[int(record[0])] = record[1:]
+            
+            dir_name = os.path.dirname(os.path.abspath(self.filename))
+            fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', newline='', encoding='utf-8') as csvfile, \
+                        open(self.filename, 'r', newline='', encoding='utf-8') as old_file:
+                    reader = csv.reader(old_file)
+                    writer = csv.writer(csvfile)
+                    writer.writerow(next(reader))
+                    for idx, record in enumerate(reader):
+                        writer.writerow(latest.pop(idx, record))
+                os.replace(tmp_path, self.filename)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            os.remove(self.updates_filename)
+
+    def close(self):
+        """Flush everything and merge the updates, rows that never arrived are written empty to keep the row positions."""
+        with self._lock:
+            if self._pending:
+                for idx in range(self.written, max(self._pending) + 1):
+                    self._pending.setdefault(idx, {key: '' for key in self.fieldnames})
+        self.flush()
+        self.merge()
+        print(f"Successfully wrote {self.written} rows to {self.filename}")
@@ -0,0 +1,82 @@
+import os
+import json
+import threading
+from typing import Dict, Optional
+
+from src.Processor.DiskCache import DiskCache
+
+
+class RunJournal():
+    """
+    Append-only journal of the stages completed for every csv row of a run.
+    
+    Each record is a json line that is flushed and fsynced before the stage counts as
+    done, so an interrupted run can be resumed without repeating paid API calls.
+    """
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.state: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        
+        if resume and os.path.exists(self.path):
+            self._load()
+            print(f'Resuming from journal {self.path} with {len(self.state)} journaled entries')
+        
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        # a crash can leave a partially written last line, start the next record on a fresh line
+        if resume and self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')
+
+    @staticmethod
+    def row_key(entry: Dict) -> str:
+        """Fingerprint of an input row, journaled work is only reused for an unchanged row."""
+        return DiskCache.make_key(entry)
+
+    def get(self, row, key: Optional[str] = None) -> dict:
+        """
+        Get the journaled state of a row.
+        
+        Args:
+            row: Index of the csv row, or a name for run level records like the voice clone
+            key (str, optional): row_key of the input row, the state is ignored if it differs
+            
+        Returns:
+            dict: Fields recorded for the row so far, empty if nothing was journaled
+        """
+        with self._lock:
+            state = self.state.get(str(row), {})
+        if key and state.get('key') != key:
+            return {}
+        return dict(state)
+
+    def record(self, row, key: Optional[str] = None, **fields):
+        """Durably append the completion of a stage for a row."""
+        if key:
+            fields['key'] = key
+        line = json.dumps({'row': row, **fields})
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.state.setdefault(str(row), {}).update(fields)
+
+    def close(self):
+        self._file.close()
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # torn write from the crash that interrupted the run
+                    continue
+                row = str(record.pop('row'))
+                if record.get('key') and self.state.get(row, {}).get('key') != record['key']:
+                    self.state[row] = {}
+                self.state.setdefault(row, {}).update(record)
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
@@ -0,0 +1,209 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.Processor.Metrics import metrics
+
+
+class UploadBackend(ABC):
+    """
+    Interface for file hosting services that turn a local file into a public URL.
+    
+    Subclass it and implement upload() to host the generated audio somewhere else.
+    """
+    # seconds an uploaded URL stays reachable, None if it never expires
+    ttl: Optional[float] = None
+
+    @abstractmethod
+    def upload(self, file_path: str, digest: str, session: requests.Session) -> Optional[str]:
+        """
+        Upload a local file.
+        
+        Args:
+            file_path (str): Path of the file to upload
+            digest (str): sha256 of the file content, usable as a stable object name
+            session (requests.Session): Pooled HTTP session to send requests with
+            
+        Returns:
+            str: Public URL of the uploaded file, None if the upload failed
+        """
+
+
+class UguuBackend(UploadBackend):
+    """
+    Temporary file hosting on https://uguu.se, uploaded files are deleted after 3 hours.
+    """
+    ttl = 3 * 60 * 60
+
+    def __init__(self, url: str = 'https://uguu.se/upload'):
+        self.url = url
+
+    def upload(self, file_path: str, digest: str, session: requests.Session) -> Optional[str]:
+        try:
+            with open(file_path, "rb") as audio_file: 
+                data = [('files[]', audio_file)]
+                response = session.post(self.url, files=data)
+            res = response.json()
+            if res['success']:
+                return res['files'][0]['url']
+            else:
+                print(f"Error {res['errorcode']} during upload: {res['description']}")
+        except Exception as e:
+            print(f"Error during upload: {str(e)}")
+        return None
+
+
+class LocalHTTPBackend(UploadBackend):
+    """
+    Copies files into a directory that your own HTTP file server exposes at base_url,
+    e.g. `python -m http.server` behind a public hostname.
+    """
+    def __init__(self, serve_dir: str, base_url: str, ttl: Optional[float] = None):
+        self.serve_dir = serve_dir
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        os.makedirs(self.serve_dir, exist_ok=True)
+
+    def upload(self, file_path: str, digest: str, session: requests.Session) -> Optional[str]:
+        file_name = f"{digest}{os.path.splitext(file_path)[1]}"
+        try:
+            shutil.copyfile(file_path, os.path.join(self.serve_dir, file_name))
+        except OSError as e:
+            print(f"Error during upload: {str(e)}")
+            return None
+        return f"{self.base_url}/{file_name}"
+
+
+class S3Backend(UploadBackend):
+    """
+    Uploads to an S3 compatible object store and returns presigned download URLs.
+    Requires boto3 (`pip install boto3`), credentials are picked up the usual boto3 way.
+    """
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: Optional[str] = None,
+                 expires_in: int = 3 * 60 * 60, **client_kwargs):
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError("S3Backend requires boto3, install it with `pip install boto3`")
+        
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, **client_kwargs)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.expires_in = expires_in
+        self.ttl = expires_in
+
+    def upload(self, file_path: str, digest: str, session: requests.Session) -> Optional[str]:
+        key = f"{self.prefix}{digest}{os.path.splitext(file_path)[1]}"
+        try:
+            self.client.upload_file(file_path, self.bucket, key)
+            return self.client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': self.bucket, 'Key': key},
+                ExpiresIn=self.expires_in,
+            )
+        except Exception as e:
+            print(f"Error during upload: {str(e)}")
+        return None
+
+
+class Uploader():
+    """
+    Uploads files through an UploadBackend, deduplicated by content hash.
+    
+    Identical files return the URL of the earlier upload for as long as that URL stays valid.
+    The URLs of the last max_urls distinct files are remembered, so memory stays bounded on
+    long runs. All uploads share one pooled HTTP session.
+    """
+    def __init__(self, backend: Optional[UploadBackend] = None, expiry_margin: float = 30 * 60,
+                 max_urls: int = 100000):
+        self.backend = backend or UguuBackend()
+        # stop handing out a URL this many seconds before it expires, the lipsync job still has to fetch it
+        self.expiry_margin = expiry_margin
+        self.uploaded = 0
+        self.reused = 0
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # digest -> (url, expiry) of recent uploads, least recently used first
+        self.max_urls = max_urls
+        self._urls: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        # digest -> [lock, number of uploads using it], removed when the last one is done
+        self._key_locks: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def upload(self, file_path: str) -> Optional[str]:
+        """Upload a local file, or reuse the URL of an identical earlier upload."""
+        digest = self.file_digest(file_path)
+        
+        # identical files uploading at the same time wait for the first one instead of uploading twice
+        with self._lock:
+            key_lock = self._key_locks.setdefault(digest, [threading.Lock(), 0])
+            key_lock[1] += 1
+        
+        try:
+            with key_lock[0]:
+                cached = self._cached_url(digest)
+                if cached:
+                    return cached
+                
+                with metrics.span('upload') as span:
+                    url = self.backend.upload(file_path, digest, self.session)
+                    if url:
+                        span.add_bytes(os.path.getsize(file_path))
+                    else:
+                        span.fail()
+                if url:
+                    with self._lock:
+                        self._urls[digest] = (url, self.url_expiry())
+                        if len(self._urls) > self.max_urls:
+                            self._urls.popitem(last=False)
+                        self.uploaded += 1
+                return url
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[digest]
+
+    def _cached_url(self, digest: str) -> Optional[str]:
+        """URL of an earlier upload of the digest if it is still valid, expired ones are dropped."""
+        with self._lock:
+            cached = self._urls.get(digest)
+            if not cached:
+                return None
+            if cached[1] <= time.time():
+                del self._urls[digest]
+                return None
+            self._urls.move_to_end(digest)
+            self.reused += 1
+            return cached[0]
+
+    def url_expiry(self) -> float:
+        """Time until which a URL uploaded now can be handed out, inf if the backend URLs never expire."""
+        if not self.backend.ttl:
+            return float('inf')
+        return time.time() + self.backend.ttl - self.expiry_margin
+
+    def stats(self) -> dict:
+        """Number of files actually uploaded and of uploads served from an earlier URL."""
+        with self._lock:
+            return {'uploaded': self.uploaded, 'reused': self.reused}
+
+    @staticmethod
+    def file_digest(file_path: str) -> str:
+        """sha256 of a file, read in chunks."""
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
@@ -1,10 +1,14 @@
 from typing import Dict
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import json
 from sync import Sync
 from sync.common import Audio, GenerationOptions, Video
 from sync.core.api_error import ApiError
 
+from src.Processor.Metrics import metrics
+
 
 class LipSyncProcessor():
     """
@@ -13,70 +17,171 @@ class LipSyncProcessor():
     def __init__(self, lipsync_api_key: str):
         self.client = Sync(api_key=lipsync_api_key,)       
 
-    def poll_for_status(self, jobs, timeout=3600, interval=10):
+    def poll_for_status(self, jobs, timeout=3600, interval=10, max_workers=8, min_interval=2, max_interval=60, on_result=None, stop=None):
         """
         Poll the API to check the status of submitted lip sync jobs.
         
-        This method continuously checks the status of all pending jobs until they
-        complete, fail, or the timeout is reached.
+        This method keeps checking the status of all pending jobs until they complete,
+        fail, or the timeout is reached. Statuses of the jobs due for a check are fetched
+        concurrently, and every job is scheduled on its own interval: jobs still queued
+        are checked less and less often, jobs that are processing are checked more often.
+        
+        Jobs can also be fed through a queue while they are being submitted, they are
+        picked up as they arrive and polling ends once None is taken from the queue and
+        every job is done.
         
         Args:
-            jobs (list): List of job IDs or tuples (index, job_id) to monitor
-            timeout (int, optional): Maximum time in seconds to wait for all jobs.
+            jobs (list | queue.Queue): List of tuples (index, job_id) to monitor, or a queue
+                                       of them ended by None
+            timeout (int, optional): Maximum time in seconds to wait for a job.
                                     Defaults to 3600 seconds (60 minutes).
-            interval (int, optional): Time in seconds between status checks.
+            interval (int, optional): Initial time in seconds between status checks of a job.
                                      Defaults to 10 seconds.
+            max_workers (int, optional): Maximum number of status requests in flight.
+                                        Defaults to 8.
+            min_interval (int, optional): Shortest time in seconds between checks of a
+                                         processing job. Defaults to 2 seconds.
+            max_interval (int, optional): Longest time in seconds between checks of a
+                                         queued job. Defaults to 60 seconds.
+            on_result (callable, optional): Called with each result as soon as its job
+                                           completes, fails or times out.
+            stop (threading.Event, optional): Stops polling the pending jobs once set.
                                      
         Returns:
             list: Results data for all completed jobs, including their status and
                  output information. Each result includes an 'idx' field matching 
-                 the job's original index.
-                 
-        Raises:
-            Exception: If the polling process times out before all jobs complete.
+                 the job's original index. Empty if on_result is given, results are
+                 only handed to it so they aren't kept in memory.
         """
-        start_time = time.time()
         results = []
-        pending_jobs = set(jobs)
+        feed = jobs if isinstance(jobs, queue.Queue) else None
+        # every listed job is checked right away, a fed job one interval after it arrives,
+        # then each is rescheduled on its own interval
+        next_check = {}
+        job_interval = {}
+        started = {}
+        
+        def add(job, check_at):
+            next_check[job] = check_at
+            job_interval[job] = interval
+            started[job] = time.time()
+        
+        def done(job, data):
+            del next_check[job], job_interval[job], started[job]
+            if on_result:
+                on_result(data)
+            else:
+                results.append(data)
+        
+        if feed is None:
+            for job in jobs:
+                add(job, time.time())
         
-        while pending_jobs and (time.time() - start_time < timeout):
-            # Check each pending job
-            for (i,job_id) in list(pending_jobs):
-                try:
-                    response = self.client.generations.get(
-                        id=job_id,
-                    )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while (next_check or feed is not None) and not (stop and stop.is_set()):
+                # take the jobs submitted since the last round
+                while feed is not None:
+                    try:
+                        job = feed.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        feed = None
+                    else:
+                        add(job, time.time() + interval)
+                
+                now = time.time()
+                timed_out = [job for job, start in started.items() if now - start >= timeout]
+                if timed_out:
+                    print(f"Polling process timed out waiting for jobs: {set(timed_out)}")
+                for (i, job_id) in timed_out:
+                    done((i, job_id), {'idx': i, 'output_url': 'POLLING_TIME_OUT'})
+                due = [job for job, check_at in next_check.items() if check_at <= now]
+                
+                # Check the due jobs concurrently
+                statuses = executor.map(self.get_status, [job_id for (_, job_id) in due])
+                for (i, job_id), data in zip(due, statuses):
+                    job = (i, job_id)
+                    if data is None:
+                        # request error, back off this job before retrying
+                        metrics.add_retry('lipsync_status')
+                        job_interval[job] = min(job_interval[job] * 2, max_interval)
+                        next_check[job] = time.time() + job_interval[job]
+                        continue
                     
-                    data = json.loads(response.json())
                     data['idx'] = i
                     status = data.get('status')
                     
                     # If job is complete, remove from pending list
                     if status == 'COMPLETED':
-                        pending_jobs.remove((i,job_id))
-                        results.append(data)
+                        # time from the start of polling the job until it finished at Sync
+                        metrics.observe('lipsync_job', time.time() - started[job])
                         print(f"Job {job_id} completed successfully.")
+                        done(job, data)
                     elif status == "FAILED":
+                        metrics.observe('lipsync_job', time.time() - started[job], error=True)
                         print(f"Lipsync process failed for {job_id} with status: {status} and error: {data.get('error','')}")
-                        pending_jobs.remove((i,job_id))
                         data['output_url'] = f'Job Status {status}'
-                        results.append(data) 
-                except ApiError as e:
-                    print(f"Error checking status for job {job_id}: {e.status_code} {e.body}")
-            
-            # If jobs still pending, wait before next check
-            if pending_jobs:
-                print(f"Waiting for {len(pending_jobs)} jobs to complete. Next check in {interval} seconds.")
-                time.sleep(interval)
-        
-        # Check for timed out jobs
-        if pending_jobs:
-            print(f"Polling process timed out waiting for jobs: {pending_jobs}")
-            for (i,job_id) in list(pending_jobs):
-                data = {'idx':i, 'output_url':'POLLING_TIME_OUT'}
-                results.append(data)              
+                        done(job, data)
+                    else:
+                        job_interval[job] = self.next_interval(status, job_interval[job], min_interval, max_interval)
+                        next_check[job] = time.time() + job_interval[job]
+                
+                # wait until the next job is due or times out, a fed job ends the wait early
+                wait = None
+                if next_check:
+                    wait = min(min(next_check.values()), min(started.values()) + timeout) - time.time()
+                    if wait > 0 and feed is None:
+                        print(f"Waiting for {len(next_check)} jobs to complete. Next check in {wait:.0f} seconds.")
+                if feed is not None:
+                    try:
+                        job = feed.get(timeout=max(wait, 0) if wait is not None else None)
+                        if job is None:
+                            feed = None
+                        else:
+                            add(job, time.time() + interval)
+                    except queue.Empty:
+                        pass
+                elif wait is not None and wait > 0:
+                    if stop:
+                        stop.wait(wait)
+                    else:
+                        time.sleep(wait)
         return results
 
+    def get_status(self, job_id):
+        """
+        Fetch the current state of a submitted lip sync job.
+        
+        Args:
+            job_id (str): Job ID to fetch the status for
+                            
+        Returns:
+            dict: json response of the job, None if the request failed
+        """
+        with metrics.span('lipsync_status') as span:
+            try:
+                response = self.client.generations.get(
+                    id=job_id,
+                )
+                return json.loads(response.json())
+            except ApiError as e:
+                print(f"Error checking status for job {job_id}: {e.status_code} {e.body}")
+                span.fail()
+        return None
+
+    @staticmethod
+    def next_interval(status, current, min_interval, max_interval):
+        """
+        Pick the time until the next status check of a job that is not done yet.
+        
+        Queued jobs back off towards max_interval, jobs that are being processed
+        are close to finishing so their interval shrinks towards min_interval.
+        """
+        if status == 'PROCESSING':
+            return max(min_interval, current / 2)
+        return min(max_interval, current * 1.5)
+
     def process_lip_sync(self, entry:Dict):
         """
         Perform lip-syncing on a video using a specified audio source.
@@ -99,21 +204,22 @@ class LipSyncProcessor():
         """
         
         try:
-            response = self.client.generations.create(
-                input=[
-                    Video(
-                        url=entry['video'],
-                        segments_secs=[[entry['segment_start'], entry['segment_end']]],
-                    ),
-                    Audio(
-                        url=entry['audio'],
+            with metrics.span('submit'):
+                response = self.client.generations.create(
+                    input=[
+                        Video(
+                            url=entry['video'],
+                            segments_secs=[[entry['segment_start'], entry['segment_end']]],
+                        ),
+                        Audio(
+                            url=entry['audio'],
+                        ),
+                    ],
+                    model=entry['lipsync_model'],
+                    options=GenerationOptions(
+                        sync_mode=entry['sync_mode'],
                     ),
-                ],
-                model=entry['lipsync_model'],
-                options=GenerationOptions(
-                    sync_mode=entry['sync_mode'],
-                ),
-            )
+                )
             
             return json.loads(response.json())
         except ApiError as e:
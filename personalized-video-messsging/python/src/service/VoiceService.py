@@ -1,15 +1,20 @@
 import os
+import shutil
 import requests
 from typing import Dict, Optional, Any
 
+from src.Processor.DiskCache import DiskCache
+from src.Processor.Metrics import metrics
 
 
 class VoiceProcessor():
     """
     Handles voice services using wrapper around ElevenLabs.
     """
-    def __init__(self, elevenlabs_api_key: str):  
+    def __init__(self, elevenlabs_api_key: str, tts_cache: Optional[DiskCache] = None):  
         self.base_url = "https://api.elevenlabs.io/v1"
+        # generated speech is reused from this cache for identical TTS requests
+        self.tts_cache = tts_cache
         self.api_key = elevenlabs_api_key
         self.headers = {
             "xi-api-key": elevenlabs_api_key,
@@ -32,34 +37,104 @@ class VoiceProcessor():
         """
         
         
-        json_data = {
-            "text": entry['text'],
-            "model_id": entry['tts_model'],
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.75
-            }
-        }
+        json_data = self._speech_payload(entry)
+        
+        cache_key = None
+        if self.tts_cache:
+            cache_key = DiskCache.make_key(entry['voice_id'], json_data)
+            audio = self.tts_cache.get(cache_key)
+            if audio is not None:
+                return audio
         
         try:
-            response = self._make_request(
+            with metrics.span('tts') as span:
+                response = self._make_request(
+                    "POST", 
+                    f"/text-to-speech/{entry['voice_id']}",
+                    json_data=json_data,
+                    headers=self.headers
+                )
+                span.add_bytes(len(response.content))
+            if cache_key:
+                self.tts_cache.put(cache_key, response.content)
+            return response.content
+            
+        except Exception as e:
+            print(f"Speech generation failed: {e}")
+            raise ValueError(f"Speech generation failed: {e}")
+    
+    def generate_speech_to_file(self, entry: Dict, output_path: str) -> str:
+        """
+        Generate speech from text using the specified voice and stream it into a file.
+        
+        Args:
+            entry: Dictionary with the 'text', 'voice_id' and 'tts_model' to use
+            output_path: Path of the audio file to write
+            
+        Returns:
+            Path of the written audio file
+            
+        Raises:
+            ValueError: If text-to-speech generation fails
+        """
+        json_data = self._speech_payload(entry)
+        
+        cache_key = None
+        if self.tts_cache:
+            cache_key = DiskCache.make_key(entry['voice_id'], json_data)
+            cached_path = self.tts_cache.get_path(cache_key)
+            if cached_path:
+                try:
+                    shutil.copyfile(cached_path, output_path)
+                    return output_path
+                except FileNotFoundError:
+                    # evicted by another process in the meantime, generate the speech again
+                    pass
+        
+        # a stream that fails partway never leaves a truncated clip at output_path
+        tmp_path = f'{output_path}.tmp'
+        try:
+            with metrics.span('tts') as span, self._make_request(
                 "POST", 
                 f"/text-to-speech/{entry['voice_id']}",
                 json_data=json_data,
-                headers=self.headers
-            )
-            return response.content
+                headers=self.headers,
+                stream=True
+            ) as response:
+                with open(tmp_path, "wb") as audio_file:
+                    # write the audio as it arrives instead of buffering the whole clip
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        audio_file.write(chunk)
+                        span.add_bytes(len(chunk))
+            os.replace(tmp_path, output_path)
+            if cache_key:
+                self.tts_cache.put_file(cache_key, output_path)
+            return output_path
             
         except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             print(f"Speech generation failed: {e}")
             raise ValueError(f"Speech generation failed: {e}")
     
+    def _speech_payload(self, entry: Dict) -> Dict:
+        """Build the text-to-speech request body."""
+        return {
+            "text": entry['text'],
+            "model_id": entry['tts_model'],
+            "voice_settings": {
+                "stability": 0.5,
+                "similarity_boost": 0.75
+            }
+        }
+    
     def _make_request(self, method: str, endpoint: str, 
                       headers: Optional[Dict] = None, 
                       params: Optional[Dict[str, Any]] = None, 
                       data: Optional[Dict[str, Any]] = None,
                       files: Optional[Dict[str, Any]] = None,
-                      json_data: Optional[Dict[str, Any]] = None) -> requests.Response:
+                      json_data: Optional[Dict[str, Any]] = None,
+                      stream: bool = False) -> requests.Response:
         """
         Make an HTTP request to the ElevenLabs API.
         
@@ -71,6 +146,7 @@ class VoiceProcessor():
             data: Optional form data
             files: Optional files to upload
             json_data: Optional JSON payload
+            stream: Whether to stream the response body instead of downloading it at once
             
         Returns:
             Response object from the requests library
@@ -92,7 +168,8 @@ class VoiceProcessor():
                 params=params,
                 data=data,
                 files=files,
-                json=json_data
+                json=json_data,
+                stream=stream
             )
             response.raise_for_status()
             return response
@@ -102,6 +179,24 @@ class VoiceProcessor():
                 print(f"Response: {e.response.text}")
             raise
     
+    def voice_exists(self, voice_id: str) -> bool:
+        """
+        Check whether a voice is still available on ElevenLabs.
+        
+        Args:
+            voice_id: ID of the voice to check
+            
+        Returns:
+            False if ElevenLabs reports the voice as missing, True otherwise. A failed check
+            counts as available so a network error never discards a voice.
+        """
+        try:
+            response = requests.get(f'{self.base_url}/voices/{voice_id}', headers={"xi-api-key": self.api_key})
+        except requests.exceptions.RequestException as e:
+            print(f"Could not check voice {voice_id}: {e}")
+            return True
+        return response.status_code not in (400, 404)
+    
     def clone_voice(self, name: str, reference_audio: str) -> str:
         """
         Clone a voice using a reference audio file.
@@ -129,8 +224,12 @@ class VoiceProcessor():
         }
         
         try:
-            response = requests.post(f'{self.base_url}/voices/add',files=files,data=payload, headers={"xi-api-key": self.api_key})
-            voice_id = response.json().get('voice_id')
+            with metrics.span('voice_clone') as span:
+                span.add_bytes(os.path.getsize(reference_audio))
+                response = requests.post(f'{self.base_url}/voices/add',files=files,data=payload, headers={"xi-api-key": self.api_key})
+                voice_id = response.json().get('voice_id')
+                if not voice_id:
+                    span.fail()
             
             if not voice_id:
                 print(response.json())
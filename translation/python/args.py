@@ -5,9 +5,26 @@ class Args:
     OPENAI_API_KEY = ""
     
     input_vid_url = "https://public-sync-test-files.s3.us-east-1.amazonaws.com/video-short.mp4"
+    # a single language or a list of languages, e.g. ["Spanish", "French", "German"]
     target_language = "Spanish"
     source_language = ""
     output_json_path = "output.json"
+    # number of target languages processed concurrently
+    max_workers = 4
+    # long videos are split at silences into chunks of at most chunk_seconds,
+    # which are transcribed and translated in parallel
+    long_form = False
+    chunk_seconds = 300
+
+    # batch mode (batch.py): a CSV or JSONL manifest with input_vid_url and target_language per row,
+    # results of all videos are written to results_path, which fetch_updates.py can refresh
+    manifest_path = ""
+    results_path = "results.json"
+    # number of manifest videos processed concurrently
+    manifest_workers = 4
+    # concurrency limit per stage, shared by all videos and languages, stages without a limit use max_workers
+    # stages: download, transcribe, translate, tts, upload, submit, e.g. {"tts": 2, "submit": 2}
+    stage_limits = {}
 
     lipsync_model = "lipsync-2"
     tts_model = "eleven_multilingual_v2"
@@ -15,6 +32,32 @@ class Args:
     transcription_model = "whisper-1"
     
     voice_id = ""
+    # encodings from AUDIO_PROFILES in src/utils/FileProcessor.py of the audio sent to Whisper and to voice cloning,
+    # e.g. "transcription_opus" for the smallest transcription uploads
+    transcription_profile = "transcription"
+    clone_profile = "clone"
+    # seconds of the input video used as voice cloning reference, and whether to use its loudest part
+    clone_sample_seconds = 60
+    clone_sample_best_energy = False
     sync_mode = "bounce"
     segment_start = -1
     segment_end = -1
+
+    # generated speech is cached here and reused on reruns, set to "" to disable the cache
+    tts_cache_dir = "Data/Cache/tts"
+    tts_cache_max_mb = 1024
+    # translations are remembered here and reused for the same text, set to "" to disable
+    translation_memory_dir = "Data/Cache/translations"
+    translation_memory_max_mb = 256
+    # transcripts are cached here by audio content and model, set to "" to disable
+    transcription_cache_dir = "Data/Cache/transcriptions"
+    transcription_cache_max_mb = 256
+
+    # per stage timings, bytes and retries of a run are written to this JSON report, set to "" to disable
+    metrics_report_path = "run_report.json"
+    # serve the metrics in the Prometheus text format on http://127.0.0.1:<port>/metrics during a run, 0 disables it
+    metrics_port = 0
+
+    # where generated speech is hosted for the Sync API, None uploads to uguu.se
+    # see src/utils/Uploader.py for LocalHTTPBackend and S3Backend
+    upload_backend = None
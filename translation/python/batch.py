@@ -0,0 +1,23 @@
+import os
+import argparse
+from src.BatchTranslator import BatchTranslator
+from args import Args
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Translate all videos of a CSV or JSONL manifest")
+    parser.add_argument("--manifest", help="Manifest path, defaults to manifest_path in args.py")
+    parser.add_argument("--results", help="Results path, defaults to results_path in args.py")
+    cli_args = parser.parse_args()
+
+    root_dir = os.getcwd()
+    args = Args()
+    if cli_args.manifest:
+        args.manifest_path = cli_args.manifest
+    if cli_args.results:
+        args.results_path = cli_args.results
+    if not args.manifest_path:
+        parser.error("a manifest is required, pass --manifest or set manifest_path in args.py")
+
+    translator = BatchTranslator(root_dir, args)
+    translator.run()
@@ -1,4 +1,9 @@
+import os
+import glob
 import json
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from sync import Sync
 from sync.core.api_error import ApiError
 from urllib.parse import urlparse
@@ -33,34 +38,122 @@ class FetchOutputs:
             print(f"Error checking status for job {job_id}: {e.status_code} {e.body}")
         return None
 
-    def run(self):
+    @staticmethod
+    def find_files(patterns):
+        """
+        Expand the given paths into output json files.
 
-        # load the output json
-        with open(self.args.output_json_path, 'r') as file:
-            # Load JSON content into a Python dictionary
-            entry = json.load(file)
+        Args:
+            patterns (list): Files, directories (every .json file below them) or glob patterns
 
-        # check if outputUrl field is a URL and if not then append to jobs for polling
-        jobs = []
-        if bool(urlparse(entry['output_url']).scheme and urlparse(entry['output_url']).netloc):
-            print('outputUrl field already has a URL')
-        else:
-            jobs.append(entry['lipsync_jobID'])
-        
-        for job in jobs:
-            data = self.get_update(job)
-            if data:
-                if data['status'] == 'COMPLETED':
-                    entry['output_url'] = data['output_url']
-                else:
-                    entry['output_url'] = data['status']
-        
-        # write the fetched update in output json
-        with open(self.args.output_json_path, 'w') as f:
+        Returns:
+            list: Sorted paths of the matching files, without duplicates
+        """
+        files = set()
+        for pattern in patterns:
+            if os.path.isdir(pattern):
+                files.update(glob.glob(os.path.join(pattern, '**', '*.json'), recursive=True))
+            elif os.path.isfile(pattern):
+                files.add(pattern)
+            else:
+                matches = glob.glob(pattern, recursive=True)
+                if not matches:
+                    print(f"No output files match {pattern}")
+                files.update(path for path in matches if os.path.isfile(path))
+        return sorted(files)
+
+    @staticmethod
+    def split_targets(entry):
+        """
+        Split the lipsync targets of a loaded output file by whether they have an output URL.
+
+        Returns:
+            tuple: (targets still pending, number of targets that already have an output URL)
+        """
+        # batch results hold a list of videos, one entry per target language in each of them,
+        # older output files hold a single flat entry
+        videos = entry if isinstance(entry, list) else [entry]
+        targets = [target for video in videos if isinstance(video, dict) for target in video.get('outputs', [video])]
+
+        pending = []
+        fetched = 0
+        for target in targets:
+            if not target.get('lipsync_jobID'):
+                continue
+            output_url = urlparse(str(target.get('output_url', '')))
+            if output_url.scheme and output_url.netloc:
+                fetched += 1
+            else:
+                pending.append(target)
+        return pending, fetched
+
+    @staticmethod
+    def write_file(path, entry):
+        """Rewrite an output file atomically, so an interrupted write never leaves a broken file behind."""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
             json.dump(entry, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def run(self, paths=None, max_workers=None):
+
+        paths = paths or [self.args.output_json_path]
+        max_workers = max_workers or self.args.max_workers
+        # counts per status, ALREADY_FETCHED for targets that had an output URL before this run
+        statuses = Counter()
+
+        # load the output files and collect the targets whose output_url is not a URL yet
+        entries = {}
+        pending = {}
+        for path in self.find_files(paths):
+            try:
+                with open(path, 'r') as file:
+                    entry = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Skipping {path}: {e}")
+                statuses['UNREADABLE_FILE'] += 1
+                continue
+            targets, fetched = self.split_targets(entry)
+            statuses['ALREADY_FETCHED'] += fetched
+            if targets:
+                entries[path] = entry
+                pending[path] = targets
+        
+        # the same job can be listed in several files, every job is fetched once
+        job_ids = sorted({target['lipsync_jobID'] for targets in pending.values() for target in targets})
+        print(f"Fetching {len(job_ids)} jobs from {len(pending)} files")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            updates = dict(zip(job_ids, executor.map(self.get_update, job_ids)))
+
+        changed = 0
+        for path, targets in pending.items():
+            modified = False
+            for target in targets:
+                data = updates.get(target['lipsync_jobID'])
+                if not data:
+                    statuses['FETCH_ERROR'] += 1
+                    continue
+                statuses[data['status']] += 1
+                output_url = data['output_url'] if data['status'] == 'COMPLETED' else data['status']
+                if target.get('output_url') != output_url:
+                    target['output_url'] = output_url
+                    modified = True
+            # write the fetched updates only to the files that changed
+            if modified:
+                self.write_file(path, entries[path])
+                changed += 1
+
+        print(f"Updated {changed} of {len(pending)} files with pending jobs")
+        for status, count in sorted((+statuses).items()):
+            print(f"  {status}: {count}")
+        return statuses
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Fetch the output URLs of submitted lipsync jobs")
+    parser.add_argument("paths", nargs="*", help="Output or batch results json files, directories or glob patterns, defaults to output_json_path in args.py")
+    parser.add_argument("--workers", type=int, help="Number of concurrent status requests, defaults to max_workers in args.py")
+    cli_args = parser.parse_args()
+
     fetcher = FetchOutputs()
-    fetcher.run()
-         
\ No newline at end of file
+    fetcher.run(cli_args.paths, cli_args.workers)
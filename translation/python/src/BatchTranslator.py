@@ -0,0 +1,134 @@
+import os
+import re
+import csv
+import copy
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from src.Translator import Translator
+from src.utils.Metrics import metrics
+
+
+class BatchTranslator:
+    """
+    Translates all videos of a manifest with the services of a single Translator.
+    
+    Videos are processed concurrently (manifest_workers), and every video fans out over its
+    target languages. The stages of all videos share the per stage concurrency limits of the
+    Translator (stage_limits in args.py), so e.g. the Whisper, ElevenLabs and Sync API calls
+    are each capped on their own, whatever the number of videos in flight.
+    
+    The manifest is a CSV or JSONL file with an input_vid_url and a target_language per row.
+    target_language holds one language or several, as a list in JSONL or separated by ; or |
+    in CSV. Optional voice_id and source_language columns override args.py for their video.
+    """
+
+    def __init__(self, root_dir: str, args):
+        self.translator = Translator(root_dir, args)
+        self.args = self.translator.args
+        self.results_lock = threading.Lock()
+
+    def load_manifest(self, manifest_path: str) -> List[Dict]:
+        """
+        Read the manifest into one entry per video, rows of the same video are merged.
+        
+        Returns:
+            list: Dicts with the 'input_vid_url', 'target_languages' and optional 'voice_id' and
+                  'source_language' of every video, in manifest order
+        """
+        with open(manifest_path, 'r', newline='', encoding='utf-8') as file:
+            if manifest_path.endswith('.csv'):
+                rows = list(csv.DictReader(file))
+            else:
+                rows = [json.loads(line) for line in file if line.strip()]
+        
+        videos = {}
+        for line, row in enumerate(rows, start=1):
+            url = (row.get('input_vid_url') or '').strip()
+            languages = row.get('target_language') or []
+            if isinstance(languages, str):
+                languages = re.split(r'[;|]', languages)
+            languages = [language.strip() for language in languages if language.strip()]
+            if not url or not languages:
+                print(f'Skipping manifest row {line}: input_vid_url and target_language are required')
+                continue
+            
+            video = videos.setdefault(url, {'input_vid_url': url, 'target_languages': []})
+            video['target_languages'] += [language for language in languages if language not in video['target_languages']]
+            for key in ('voice_id', 'source_language'):
+                if row.get(key):
+                    video[key] = row[key]
+        
+        return list(videos.values())
+
+    def run(self):
+        """
+        Translate every video of args.manifest_path and write the consolidated results to
+        args.results_path.
+        
+        The results file is written once all lipsync jobs are submitted and again after
+        polling, so fetch_updates.py can refresh it even if polling is interrupted.
+        """
+        with metrics.recording(self.args.metrics_report_path, self.args.metrics_port):
+            self._run()
+
+    def _run(self):
+        videos = self.load_manifest(self.args.manifest_path)
+        print(f'Translating {len(videos)} videos from {self.args.manifest_path}')
+        
+        results = [{'input_video': video['input_vid_url'], 'outputs': []} for video in videos]
+        
+        # a separate pool for the languages keeps videos waiting on their languages from starving them
+        with ThreadPoolExecutor(max_workers=max(1, self.args.max_workers)) as language_executor:
+            def process(i: int):
+                self.process_video(videos[i], results[i], language_executor)
+            
+            with ThreadPoolExecutor(max_workers=max(1, min(len(videos), self.args.manifest_workers))) as executor:
+                list(executor.map(process, range(len(videos))))
+        
+        self.write_results(results)
+        
+        # poll the lipsync jobs of all videos at once
+        print(f'Polling for lipsync job completions...')
+        self.translator.collect_outputs([entry for result in results for entry in result['outputs']])
+        self.write_results(results)
+        
+        failed = sum(1 for result in results for entry in result['outputs'] if entry.get('error'))
+        failed += sum(1 for result in results if result.get('error'))
+        print(f'Finished {len(videos)} videos, {failed} failures, results written to {self.args.results_path}')
+
+    def process_video(self, video: Dict, result: Dict, language_executor: ThreadPoolExecutor):
+        """Run the shared steps of a video, then localize it to all its target languages."""
+        # every video gets its own copy of the args, with its manifest values
+        args = copy.copy(self.args)
+        args.input_vid_url = video['input_vid_url']
+        for key in ('voice_id', 'source_language'):
+            if key in video:
+                setattr(args, key, video[key])
+        
+        try:
+            args, transcription = self.translator.prepare(args)
+        except Exception as e:
+            print(f'Preparing {video["input_vid_url"]} failed: {e}')
+            result['error'] = str(e)
+            return
+        
+        result['voice_id'] = args.voice_id
+        try:
+            futures = [
+                language_executor.submit(self.translator.localize, transcription, language, args)
+                for language in video['target_languages']
+            ]
+            result['outputs'] = [future.result() for future in futures]
+        finally:
+            os.remove(args.input_video_path)
+
+    def write_results(self, results: List[Dict]):
+        """Write the results file atomically, so an interrupted write never leaves a broken file behind."""
+        with self.results_lock:
+            tmp_path = f'{self.args.results_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(results, f, indent=4)
+            os.replace(tmp_path, self.args.results_path)
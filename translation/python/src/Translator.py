@@ -1,85 +1,109 @@
 import os
+import re
+import copy
 import pprint
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
 from src.service.LipSyncService import LipSyncProcessor
 from src.service.VoiceService import VoiceProcessor
 from src.service.TranslationService import TranslationProcessor
 from src.utils.FileProcessor import FileProcessor
+from src.utils.DiskCache import DiskCache
+from src.utils.VoiceRegistry import VoiceRegistry
+from src.utils.TranslationMemory import TranslationMemory
+from src.utils.Metrics import metrics
 
 
 class Translator:
+    STAGES = ('download', 'transcribe', 'translate', 'tts', 'upload', 'submit')
+
     def __init__(self,
                 root_dir: str,
                 args
             ):
         
         self.root_dir = root_dir
-        self.file_processor = FileProcessor(self.root_dir)
+        self.file_processor = FileProcessor(self.root_dir, getattr(args, 'upload_backend', None))
         self.args = self.file_processor.check_required_keys(args)
         self.lipsync_service = LipSyncProcessor(self.args.SYNCLABS_API_KEY) 
-        self.voice_service = VoiceProcessor(self.args.ELEVENLABS_API_KEY)
-        self.translation_service = TranslationProcessor(self.args.OPENAI_API_KEY)
+        
+        # reruns reuse previously generated speech instead of calling TTS again
+        self.tts_cache = None
+        if self.args.tts_cache_dir:
+            cache_dir = os.path.join(self.root_dir, self.args.tts_cache_dir)
+            self.tts_cache = DiskCache(cache_dir, self.args.tts_cache_max_mb * 1024 * 1024, suffix='.mp3')
+        self.voice_service = VoiceProcessor(self.args.ELEVENLABS_API_KEY, self.tts_cache)
+        self.voice_registry = VoiceRegistry(os.path.join(self.root_dir, "Data/Cache/voices.json"))
+        
+        # recurring strings reuse earlier translations instead of calling the LLM again
+        self.translation_memory = None
+        if self.args.translation_memory_dir:
+            memory_dir = os.path.join(self.root_dir, self.args.translation_memory_dir)
+            self.translation_memory = TranslationMemory(memory_dir, self.args.translation_memory_max_mb * 1024 * 1024)
+        
+        # reruns on the same audio reuse the earlier transcript instead of uploading it to Whisper again
+        self.transcript_cache = None
+        if self.args.transcription_cache_dir:
+            cache_dir = os.path.join(self.root_dir, self.args.transcription_cache_dir)
+            self.transcript_cache = DiskCache(cache_dir, self.args.transcription_cache_max_mb * 1024 * 1024, suffix='.json')
+        self.translation_service = TranslationProcessor(self.args.OPENAI_API_KEY, self.translation_memory, self.transcript_cache)
+
+        # per stage concurrency limits so a busy stage can't exceed the rate limits of its API
+        stage_limits = self.args.stage_limits or {}
+        self.stage_locks = {
+            stage: threading.BoundedSemaphore(max(1, stage_limits.get(stage, self.args.max_workers)))
+            for stage in self.STAGES
+        }
 
         print(f'Initialized the Lipsync, Translation, & ElevenLabs services.') 
     
+    def clone_voice(self, name: str, args=None) -> str:
+        """Clone the voice from a compact, bounded sample of the input video."""
+        args = args or self.args
+        sample = self.file_processor.extract_audio_sample(
+            args.input_video_path, self.args.clone_sample_seconds, self.args.clone_sample_best_energy,
+            profile=self.args.clone_profile
+        )
+        try:
+            return self.voice_service.clone_voice(name, sample)
+        finally:
+            os.remove(sample)
+
     def run(self):
         """
         Performs all the steps needed for generating translated videos like translation, voice 
         cloning, TTS, lip-syncing.
         
+        The download, audio extraction, voice cloning and transcription run once, then the
+        translate, TTS, upload and lipsync steps run concurrently for every target language.
+        In long form mode the audio chunks are transcribed and translated concurrently as well.
+        
         Raises:
             requests.exceptions.RequestException: If the API requests, file downloads, uploads fail
         """
-        output = {'input_video': self.args.input_vid_url}
-        # download the video to local filesystem
-        self.args.input_video_path = self.file_processor.download(self.args.input_vid_url)
-        # extract the audio from the input video file 
-        temp_audio = self.file_processor.extract_audio(self.args.input_video_path)
-        
-        if not self.args.voice_id:
-            # clone voice using extracted audio
-            name = 'my_voice_clone'
-            self.args.voice_id = self.voice_service.clone_voice(name, temp_audio)
-        output['voice_id'] = self.args.voice_id
-        
-        # transcribe and translate the extracted audio 
-        transcription = self.translation_service.transcribe(temp_audio, self.args.transcription_model)  
-        translation = self.translation_service.translate(transcription, self.args)
-        
-        # generate speech using the voice ID and the translated text, output is audio bytes
-        input_audio = self.voice_service.generate_speech(translation, self.args.voice_id)
-        
-        # write the output in a temp mp3 file
-        dir = f"Data/Inputs"
-        full_path = os.path.join(self.root_dir, dir)
-        os.makedirs(full_path, exist_ok=True)
-        tmp_aud = os.path.join(full_path, f'generated_speech.mp3')
-        
-        with open(tmp_aud, "wb") as audio_file:
-            audio_file.write(input_audio)
-        
-        # upload the temp file to a temp file hosting service and get the url
-        aud_url = self.file_processor.upload_file_uguu(tmp_aud)
-
-        if aud_url:
-            print(f'Uploaded generated speech to {aud_url}')
-            output['generated_audio'] = aud_url
-            self.args.aud_url = aud_url
-            # post the lipsyncing request to the API endpoint
-            response_json = self.lipsync_service.process_lip_sync(self.args)
-            print(f'Submitted lipsync job successfully, job ID: {response_json["id"]}')
-            output['lipsync_jobID'] = response_json["id"]
-        else:
-            print('Generated speech upload error')
-            raise
+        with metrics.recording(self.args.metrics_report_path, self.args.metrics_port):
+            self._run()
+
+    def _run(self):
+        args, transcription = self.prepare(self.args)
+        self.args = args
+        output = {'input_video': args.input_vid_url, 'voice_id': args.voice_id}
+        
+        languages = self.target_languages()
+        with ThreadPoolExecutor(max_workers=max(1, min(len(languages), self.args.max_workers))) as executor:
+            outputs = list(executor.map(lambda language: self.localize(transcription, language), languages))
 
         # poll for lipsync job status updates
         print(f'Polling for lipsync job completions...')
-        lipsync_results = self.lipsync_service.poll_for_status([response_json['id']])
+        self.collect_outputs(outputs)
+        output['outputs'] = outputs
         
-        for res in lipsync_results:
-            output['output_url'] = res['output_url']
+        if self.translation_memory:
+            stats = self.translation_memory.stats()
+            print(f"Translation memory: {stats['memory_hits'] + stats['disk_hits']} hits, {stats['misses']} misses")
         
         pprint.pprint(output)
 
@@ -88,7 +112,145 @@ class Translator:
             json.dump(output, f, indent=4)
         
         # cleanup temp files
-        os.remove(temp_audio)
         os.remove(self.args.input_video_path)
 
-        
\ No newline at end of file
+    def prepare(self, args) -> Tuple[object, List[str]]:
+        """
+        Run the steps shared by all target languages of a video: download, audio extraction,
+        voice cloning and transcription.
+        
+        Args:
+            args: Args instance with the input_vid_url of the video
+            
+        Returns:
+            tuple: Copy of args with the input_video_path and voice_id of the video, and its transcript chunks
+        """
+        args = copy.copy(args)
+        with self.stage_locks['download']:
+            # download the video to local filesystem
+            args.input_video_path = self.file_processor.download(args.input_vid_url)
+            # extract the audio from the input video file, encoded compactly for transcription
+            temp_audio = self.file_processor.extract_audio(args.input_video_path, args.transcription_profile)
+        
+        try:
+            if not args.voice_id:
+                # clone voice from a sample of the input video, the same video reuses the voice cloned by an earlier run
+                name = 'my_voice_clone'
+                fingerprint = VoiceRegistry.fingerprint(args.input_video_path, args.clone_profile)
+                with self.stage_locks['tts']:
+                    args.voice_id = self.voice_registry.get_or_create(
+                        fingerprint,
+                        lambda: self.clone_voice(name, args),
+                        self.voice_service.voice_exists,
+                        args.input_vid_url,
+                    )
+            
+            # transcribe the extracted audio once for all target languages
+            with self.stage_locks['transcribe']:
+                transcription = self.transcribe(temp_audio)
+        finally:
+            os.remove(temp_audio)
+        
+        return args, transcription
+
+    def collect_outputs(self, outputs: List[Dict]):
+        """Poll the lipsync jobs of the output entries and fill in their output_url."""
+        job_ids = [entry['lipsync_jobID'] for entry in outputs if entry.get('lipsync_jobID')]
+        if not job_ids:
+            return
+        lipsync_results = self.lipsync_service.poll_for_status(job_ids)
+        
+        output_urls = {res['id']: res['output_url'] for res in lipsync_results}
+        for entry in outputs:
+            if entry.get('lipsync_jobID'):
+                entry['output_url'] = output_urls.get(entry['lipsync_jobID'], '')
+
+    def transcribe(self, audio_path: str) -> List[str]:
+        """
+        Transcribe the extracted audio, in long form mode as chunks split at silences that are
+        transcribed concurrently.
+        
+        Returns:
+            list: Transcript of every chunk in order, a single transcript when long_form is off
+        """
+        profile = self.args.transcription_profile
+        if not self.args.long_form:
+            return [self.translation_service.transcribe(audio_path, self.args.transcription_model, profile)]
+        
+        chunks = self.file_processor.split_audio_on_silence(audio_path, self.args.chunk_seconds, profile=profile)
+        print(f'Transcribing {len(chunks)} audio chunks...')
+        try:
+            return self.translation_service.transcribe_chunks(
+                [chunk['path'] for chunk in chunks], self.args.transcription_model, self.args.max_workers, profile
+            )
+        finally:
+            for chunk in chunks:
+                os.remove(chunk['path'])
+
+    def target_languages(self) -> List[str]:
+        """args.target_language as a list, it can hold a single language or a list of languages."""
+        if isinstance(self.args.target_language, str):
+            return [self.args.target_language]
+        return list(self.args.target_language)
+
+    def localize(self, transcription: List[str], language: str, args=None) -> Dict:
+        """
+        Translate the transcription to one language, generate the speech and submit the lipsync job.
+        
+        Args:
+            transcription (list): Transcript chunks of the input video
+            language (str): Target language
+            args (optional): Args of the video as returned by prepare(). Defaults to self.args.
+            
+        Returns:
+            dict: Output entry for the language, with an 'error' field if one of the steps failed
+        """
+        entry = {'target_language': language}
+        # every language gets its own copy of the args so concurrent languages don't share audio URLs
+        args = copy.copy(args or self.args)
+        args.target_language = language
+        try:
+            with self.stage_locks['translate']:
+                if len(transcription) == 1:
+                    translation = self.translation_service.translate(transcription[0], args, target_language=language)
+                else:
+                    # long form chunks are translated in parallel with their neighbours as context
+                    translation = self.translation_service.translate_chunks(
+                        transcription, args, target_language=language, max_workers=args.max_workers
+                    )
+            
+            # generate speech using the voice ID and the translated text, streamed into a temp mp3 file
+            dir = f"Data/Inputs"
+            full_path = os.path.join(self.root_dir, dir)
+            os.makedirs(full_path, exist_ok=True)
+            # the local video is named after a hash of its URL, so videos with the same file name don't share it
+            stem = os.path.splitext(os.path.basename(args.input_video_path))[0]
+            tmp_aud = os.path.join(full_path, f"generated_speech_{stem}_{re.sub(r'[^A-Za-z0-9]+', '_', language)}.mp3")
+            
+            with self.stage_locks['tts']:
+                self.voice_service.generate_speech_to_file(translation, args.voice_id, tmp_aud)
+            
+            # upload the temp file to a temp file hosting service and get the url
+            try:
+                with self.stage_locks['upload']:
+                    aud_url = self.file_processor.upload_file(tmp_aud)
+            finally:
+                os.remove(tmp_aud)
+
+            if not aud_url:
+                raise ValueError('Generated speech upload error')
+            
+            print(f'Uploaded generated speech for {language} to {aud_url}')
+            entry['generated_audio'] = aud_url
+            args.aud_url = aud_url
+            # post the lipsyncing request to the API endpoint
+            with self.stage_locks['submit']:
+                response_json = self.lipsync_service.process_lip_sync(args)
+            print(f'Submitted lipsync job successfully for {language}, job ID: {response_json["id"]}')
+            entry['lipsync_jobID'] = response_json["id"]
+        except Exception as e:
+            # a failing language doesn't take down the languages that are already submitted
+            print(f'Localizing to {language} failed: {e}')
+            entry['error'] = str(e)
+        
+        return entry
@@ -2,7 +2,10 @@ import json
 from sync import Sync
 from sync.common import Audio, GenerationOptions, Video
 from sync.core.api_error import ApiError
+
+from src.utils.Metrics import metrics
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 class LipSyncProcessor():
@@ -16,69 +19,124 @@ class LipSyncProcessor():
         
         self.client = Sync(api_key=lipsync_api_key,)        
 
-    def poll_for_status(self, jobs, timeout=3600, interval=10):
+    def poll_for_status(self, jobs, timeout=3600, interval=10, max_workers=8, min_interval=2, max_interval=60):
         """
         Poll the API to check the status of submitted lip sync jobs.
         
-        This method continuously checks the status of all pending jobs until they
-        complete, fail, or the timeout is reached.
+        This method keeps checking the status of all pending jobs until they complete,
+        fail, or the timeout is reached. Statuses of the jobs due for a check are fetched
+        concurrently, and every job is scheduled on its own interval: jobs still queued
+        are checked less and less often, jobs that are processing are checked more often.
         
         Args:
-            jobs (list): List of job IDs or tuples (index, job_id) to monitor
+            jobs (list): List of job IDs to monitor
             timeout (int, optional): Maximum time in seconds to wait for all jobs.
                                     Defaults to 3600 seconds (60 minutes).
-            interval (int, optional): Time in seconds between status checks.
+            interval (int, optional): Initial time in seconds between status checks of a job.
                                      Defaults to 10 seconds.
+            max_workers (int, optional): Maximum number of status requests in flight.
+                                        Defaults to 8.
+            min_interval (int, optional): Shortest time in seconds between checks of a
+                                         processing job. Defaults to 2 seconds.
+            max_interval (int, optional): Longest time in seconds between checks of a
+                                         queued job. Defaults to 60 seconds.
                                      
         Returns:
             list: Results data for all completed jobs, including their status and
-                 output information. Each result includes an 'idx' field matching 
-                 the job's original index.
+                 output information.
                  
         Raises:
             Exception: If the polling process times out before all jobs complete.
         """
         start_time = time.time()
         results = []
-        pending_jobs = set(jobs)
+        # every job is checked right away, then rescheduled on its own interval
+        next_check = {job: start_time for job in jobs}
+        job_interval = {job: interval for job in jobs}
         
-        while pending_jobs and (time.time() - start_time < timeout):
-            # Check each pending job
-            for job_id in list(pending_jobs):
-                try:
-                    response = self.client.generations.get(
-                        id=job_id,
-                    )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while next_check and (time.time() - start_time < timeout):
+                now = time.time()
+                due = [job for job, check_at in next_check.items() if check_at <= now]
+                
+                # Check the due jobs concurrently
+                statuses = executor.map(self.get_status, due)
+                for job_id, data in zip(due, statuses):
+                    if data is None:
+                        # request error, back off this job before retrying
+                        metrics.add_retry('lipsync_status')
+                        job_interval[job_id] = min(job_interval[job_id] * 2, max_interval)
+                        next_check[job_id] = time.time() + job_interval[job_id]
+                        continue
                     
-                    data = json.loads(response.json())
                     status = data.get('status')
                     
                     # If job is complete, remove from pending list
                     if status == 'COMPLETED':
-                        pending_jobs.remove(job_id)
+                        # time from the start of polling until the job finished at Sync
+                        metrics.observe('lipsync_job', time.time() - start_time)
+                        del next_check[job_id]
                         results.append(data)
                         print(f"Job {job_id} completed successfully.")
                     elif status == "FAILED":
+                        metrics.observe('lipsync_job', time.time() - start_time, error=True)
                         print(f"Lipsync process failed or timed out for {job_id} with status: {status} and error: {data.get('error','')}")
-                        pending_jobs.remove(job_id)
+                        del next_check[job_id]
                         data['output_url'] = f'Job Status {status}'
                         results.append(data) 
-                except ApiError as e:
-                    print(f"Error checking status for job {job_id}: {e.status_code} {e.body}")
-            
-            # If jobs still pending, wait before next check
-            if pending_jobs:
-                print(f"Waiting for {len(pending_jobs)} jobs to complete. Next check in {interval} seconds.")
-                time.sleep(interval)
+                    else:
+                        job_interval[job_id] = self.next_interval(status, job_interval[job_id], min_interval, max_interval)
+                        next_check[job_id] = time.time() + job_interval[job_id]
+                
+                # If jobs still pending, wait until the next job is due
+                if next_check:
+                    wait = min(next_check.values()) - time.time()
+                    wait = min(wait, timeout - (time.time() - start_time))
+                    if wait > 0:
+                        print(f"Waiting for {len(next_check)} jobs to complete. Next check in {wait:.0f} seconds.")
+                        time.sleep(wait)
         
         # Check for timed out jobs
-        if pending_jobs:
-            print(f"Polling process timed out waiting for jobs: {pending_jobs}")
-            for job_id in list(pending_jobs):
-                data = {'output_url':'POLLING TIME OUT. Check job status after some time.'}
+        if next_check:
+            print(f"Polling process timed out waiting for jobs: {set(next_check)}")
+            for job_id in list(next_check):
+                data = {'id': job_id, 'output_url':'POLLING TIME OUT. Check job status after some time.'}
                 results.append(data)              
         return results
 
+    def get_status(self, job_id):
+        """
+        Fetch the current state of a submitted lip sync job.
+        
+        Args:
+            job_id (str): Job ID to fetch the status for
+                            
+        Returns:
+            dict: json response of the job, None if the request failed
+        """
+        with metrics.span('lipsync_status') as span:
+            try:
+                response = self.client.generations.get(
+                    id=job_id,
+                )
+                return json.loads(response.json())
+            except ApiError as e:
+                print(f"Error checking status for job {job_id}: {e.status_code} {e.body}")
+                span.fail()
+        return None
+
+    @staticmethod
+    def next_interval(status, current, min_interval, max_interval):
+        """
+        Pick the time until the next status check of a job that is not done yet.
+        
+        Queued jobs back off towards max_interval, jobs that are being processed
+        are close to finishing so their interval shrinks towards min_interval.
+        """
+        if status == 'PROCESSING':
+            return max(min_interval, current / 2)
+        return min(max_interval, current * 1.5)
+
     def process_lip_sync(self, args):
         """
         Perform lip-syncing on a video using a specified audio source.
@@ -102,21 +160,22 @@ class LipSyncProcessor():
         """
         
         try:
-            response = self.client.generations.create(
-                input=[
-                    Video(
-                        url=args.input_vid_url,
-                        segments_secs=[[args.segment_start, args.segment_end]],
-                    ),
-                    Audio(
-                        url=args.aud_url,
+            with metrics.span('submit'):
+                response = self.client.generations.create(
+                    input=[
+                        Video(
+                            url=args.input_vid_url,
+                            segments_secs=[[args.segment_start, args.segment_end]],
+                        ),
+                        Audio(
+                            url=args.aud_url,
+                        ),
+                    ],
+                    model=args.lipsync_model,
+                    options=GenerationOptions(
+                        sync_mode=args.sync_mode,
                     ),
-                ],
-                model=args.lipsync_model,
-                options=GenerationOptions(
-                    sync_mode=args.sync_mode,
-                ),
-            )
+                )
             return json.loads(response.json())
         except ApiError as e:
             print(e.status_code)
@@ -1,23 +1,37 @@
 import os
+import re
+import json
 import requests
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 
+from src.utils.TranslationMemory import TranslationMemory
+from src.utils.DiskCache import DiskCache
+from src.utils.Uploader import Uploader
+from src.utils.Metrics import metrics
+
 class TranslationProcessor:
     """
     Handles transcription and translation using OpenAI API.
     This class provides methods to transcribe audio files and translate text.
     """
 
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, memory: Optional[TranslationMemory] = None,
+                 transcript_cache: Optional[DiskCache] = None):
 
         if not api_key:
             raise ValueError("OpenAI API key is required in constants.py")
         self.client = OpenAI(api_key=api_key)
+        # earlier translations of the same text are reused from this memory
+        self.memory = memory
+        # transcripts of audio that was transcribed before are reused from this cache
+        self.transcript_cache = transcript_cache
     
     def transcribe(self, 
                   audio_file_path: str, 
-                  model: str = None
+                  model: str = None,
+                  profile: str = ''
                   ) -> str:
         """
         Transcribe an audio file using OpenAI's Whisper API.
@@ -25,30 +39,113 @@ class TranslationProcessor:
         Args:
             audio_file_path (str): Path to the audio file
             model (str): Model to use for transcription. Defaults to "whisper-1".
+            profile (str, optional): Extraction profile the audio was encoded with, part of the cache key.
 
         Returns:
             Str: Transcription response text containing the transcribed text
         """
+        return self.transcribe_detailed(audio_file_path, model, profile=profile)['text']
+
+    def transcribe_detailed(self,
+                            audio_file_path: str,
+                            model: str = None,
+                            segments: bool = False,
+                            profile: str = ''
+                            ) -> Dict:
+        """
+        Transcribe an audio file using OpenAI's Whisper API, optionally with segment timestamps.
+        
+        Results are cached by the content hash of the audio, its extraction profile and the model,
+        so the same audio is only uploaded to Whisper once.
+        
+        Args:
+            audio_file_path (str): Path to the audio file
+            model (str): Model to use for transcription. Defaults to "whisper-1".
+            segments (bool): Also return the segment timestamps. Defaults to False.
+            profile (str, optional): Extraction profile the audio was encoded with, part of the cache key.
+
+        Returns:
+            Dict: 'text' with the full transcript and 'segments', a list of dicts with
+                  'start', 'end' and 'text', or None if segments were not requested
+        """
+        if not model:
+            model = "whisper-1"
+        
+        cache_key = None
+        if self.transcript_cache:
+            cache_key = DiskCache.make_key('transcription', Uploader.file_digest(audio_file_path), profile, model)
+            data = self.transcript_cache.get(cache_key)
+            if data is not None:
+                transcript = json.loads(data)
+                # a cached plain transcript can't answer a request for segments
+                if not segments or transcript.get('segments') is not None:
+                    return transcript
+        
         try:
-            if not model:
-                model = "whisper-1"
-            with open(audio_file_path, "rb") as audio_file:
-                response = self.client.audio.transcriptions.create(
-                    model=model,
-                    file=audio_file,
-                )
-                
-            return response.text
+            with metrics.span('transcribe') as span, open(audio_file_path, "rb") as audio_file:
+                span.add_bytes(os.path.getsize(audio_file_path))
+                if segments:
+                    response = self.client.audio.transcriptions.create(
+                        model=model,
+                        file=audio_file,
+                        response_format="verbose_json",
+                        timestamp_granularities=["segment"],
+                    )
+                else:
+                    response = self.client.audio.transcriptions.create(
+                        model=model,
+                        file=audio_file,
+                    )
                 
         except Exception as e:
             print(f"Transcription error: {str(e)}")
             raise
+        
+        transcript = {'text': response.text, 'segments': None}
+        if segments:
+            transcript['segments'] = [
+                {
+                    'start': self._field(segment, 'start'),
+                    'end': self._field(segment, 'end'),
+                    'text': self._field(segment, 'text'),
+                }
+                for segment in getattr(response, 'segments', None) or []
+            ]
+        
+        if cache_key:
+            self.transcript_cache.put(cache_key, json.dumps(transcript).encode('utf-8'))
+        return transcript
+
+    @staticmethod
+    def _field(item, name):
+        """Read a field of an API object that can come back as a model or a plain dict."""
+        return item[name] if isinstance(item, dict) else getattr(item, name)
+    
+    @staticmethod
+    def _system_prompt(args, target_language: str, preserve_formatting: bool = True) -> str:
+        """Translation instructions for one text, sets the default source language and GPT model on args."""
+        if not args.source_language:
+            args.source_language = "the source language"
+        if not args.gpt_model:
+            args.gpt_model = "gpt-3.5-turbo"
+        
+        formatting_instruction = "maintaining the original formatting, paragraph breaks, and punctuation" if preserve_formatting else ""
+        
+        return (
+            f"You are a professional translator from {args.source_language} to {target_language}. "
+            f"Translate the following text to {target_language}, {formatting_instruction} "
+            f"while preserving the original meaning and tone as closely as possible. "
+            f"Only return the translated text without any additional explanations."
+        )
     
     def translate(self, 
                  text: str, 
                  args,
                  preserve_formatting: bool = True,
-                 temperature: float = 0.3) -> str:
+                 temperature: float = 0.3,
+                 target_language: Optional[str] = None,
+                 context_before: str = "",
+                 context_after: str = "") -> str:
         """
         Translate text using OpenAI's GPT models.
         
@@ -59,37 +156,244 @@ class TranslationProcessor:
             model (str, optional): GPT model to use. Defaults to "gpt-3.5-turbo".
             preserve_formatting (bool, optional): Whether to preserve formatting. Defaults to True.
             temperature (float, optional): Sampling temperature. Defaults to 0.3.
+            target_language (str, optional): Target language to use instead of args.target_language.
+            context_before (str, optional): Source text preceding the text, only used as context.
+            context_after (str, optional): Source text following the text, only used as context.
             
         Returns:
             str: Translated text
         """
-        if not args.source_language:
-            args.source_language = "the source language"
-        if not args.gpt_model:
-            args.gpt_model = "gpt-3.5-turbo"
+        target_language = target_language or args.target_language
+        system_prompt = self._system_prompt(args, target_language, preserve_formatting)
         
-        formatting_instruction = "maintaining the original formatting, paragraph breaks, and punctuation" if preserve_formatting else ""
+        # neighbouring text of a chunk keeps sentences and terms consistent across chunk edges
+        content = text
+        with_context = bool(context_before or context_after)
+        if with_context:
+            system_prompt += (
+                " The text is part of a longer transcript. Only translate the text between <translate> tags, "
+                "the surrounding context is given for reference and must not be translated or returned."
+            )
+            content = (
+                f"<context_before>{context_before}</context_before>\n"
+                f"<translate>{text}</translate>\n"
+                f"<context_after>{context_after}</context_after>"
+            )
         
-        system_prompt = (
-            f"You are a professional translator from {args.source_language} to {args.target_language}. "
-            f"Translate the following text to {args.target_language}, {formatting_instruction} "
-            f"while preserving the original meaning and tone as closely as possible. "
-            f"Only return the translated text without any additional explanations."
-        )
+        memory_key = None
+        if self.memory:
+            memory_key = self.memory.key(content, args.source_language, target_language, args.gpt_model, temperature, system_prompt)
+            translation = self.memory.get(memory_key)
+            if translation is not None:
+                return translation
         
         try:
-            response = self.client.chat.completions.create(
-                model=args.gpt_model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": text}
-                ],
-                temperature=temperature
-            )
+            with metrics.span('translate'):
+                response = self.client.chat.completions.create(
+                    model=args.gpt_model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": content}
+                    ],
+                    temperature=temperature
+                )
             
-            return response.choices[0].message.content
+            translation = response.choices[0].message.content
+            if with_context:
+                translation = re.sub(r"^\s*<translate>|</translate>\s*$", "", translation).strip()
+            if memory_key:
+                self.memory.put(memory_key, translation)
+            return translation
             
         except Exception as e:
             print(f"Translation error: {str(e)}")
             raise
-        
\ No newline at end of file
+    
+    def translate_batch(self,
+                        texts: List[str],
+                        args,
+                        target_language: Optional[str] = None,
+                        token_budget: int = 2000,
+                        preserve_formatting: bool = True,
+                        temperature: float = 0.3,
+                        max_workers: int = 4
+                        ) -> List[str]:
+        """
+        Translate many short texts with a few structured requests instead of one request per text.
+        
+        Texts are packed into JSON requests of at most token_budget estimated tokens, and the JSON
+        response is split back into a translation per text by its item id. Texts that are missing
+        from a response, or all texts of a batch whose response doesn't parse, are translated one
+        by one with translate(). Known translations come from the translation memory, and the
+        batched translations are stored there under the same keys as translate() uses.
+        
+        Args:
+            texts (list): Texts to translate
+            args: Args instance with the language pair and GPT model
+            target_language (str, optional): Target language to use instead of args.target_language.
+            token_budget (int, optional): Estimated source tokens per request. Defaults to 2000.
+            preserve_formatting (bool, optional): Whether to preserve formatting. Defaults to True.
+            temperature (float, optional): Sampling temperature. Defaults to 0.3.
+            max_workers (int, optional): Number of requests sent at the same time. Defaults to 4.
+            
+        Returns:
+            list: Translation of every text, in the order of the texts
+        """
+        target_language = target_language or args.target_language
+        system_prompt = self._system_prompt(args, target_language, preserve_formatting)
+        
+        translations: Dict[str, str] = {}
+        pending = []
+        for text in dict.fromkeys(texts):
+            if not text.strip():
+                translations[text] = text
+                continue
+            if self.memory:
+                key = self.memory.key(text, args.source_language, target_language, args.gpt_model, temperature, system_prompt)
+                translation = self.memory.get(key)
+                if translation is not None:
+                    translations[text] = translation
+                    continue
+            pending.append(text)
+        
+        # pack the texts into batches by a rough estimate of 4 characters per token
+        batches, batch, batch_tokens = [], [], 0
+        for text in pending:
+            tokens = len(text) // 4 + 1
+            if batch and batch_tokens + tokens > token_budget:
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        
+        def translate_one(text: str) -> Tuple[str, str]:
+            return text, self.translate(text, args, preserve_formatting, temperature, target_language)
+        
+        def run_batch(batch: List[str]) -> Dict[str, str]:
+            if len(batch) == 1:
+                return dict([translate_one(batch[0])])
+            
+            results = self._request_batch(batch, args, target_language, system_prompt, temperature)
+            missing = [text for text in batch if text not in results]
+            if missing:
+                metrics.add_retry('translate_batch', len(missing))
+                print(f"Batch translation returned {len(batch) - len(missing)}/{len(batch)} items, translating the rest one by one")
+                results.update(translate_one(text) for text in missing)
+            return results
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(len(batches), max_workers))) as executor:
+            for results in executor.map(run_batch, batches):
+                translations.update(results)
+        
+        return [translations[text] for text in texts]
+    
+    def _request_batch(self, batch: List[str], args, target_language: str,
+                       item_prompt: str, temperature: float) -> Dict[str, str]:
+        """
+        Translate a batch of texts with a single JSON mode request.
+        
+        Returns:
+            dict: Translation by source text for the items of a valid response, empty if the
+                  request failed or its response doesn't parse
+        """
+        items = [{"id": i, "text": text} for i, text in enumerate(batch)]
+        system_prompt = (
+            f"You are a professional translator from {args.source_language} to {target_language}. "
+            f"You receive a JSON object with a list of items, each with an id and a text. "
+            f"Translate every text to {target_language} independently of the other texts, "
+            f"preserving the original meaning, tone and formatting as closely as possible. "
+            f'Return a JSON object of the form {{"translations": [{{"id": <id>, "text": <translated text>}}]}} '
+            f"with exactly one entry for every id you received and nothing else."
+        )
+        
+        try:
+            with metrics.span('translate_batch'):
+                response = self.client.chat.completions.create(
+                    model=args.gpt_model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": json.dumps({"items": items}, ensure_ascii=False)}
+                    ],
+                    temperature=temperature,
+                    response_format={"type": "json_object"}
+                )
+            entries = json.loads(response.choices[0].message.content)["translations"]
+        except Exception as e:
+            print(f"Batch translation error: {str(e)}")
+            return {}
+        
+        results = {}
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict):
+                continue
+            i, translation = entry.get("id"), entry.get("text")
+            # ids the model made up, duplicated or left empty are translated one by one instead
+            if type(i) is not int or not 0 <= i < len(batch) or batch[i] in results:
+                continue
+            if not isinstance(translation, str) or not translation.strip():
+                continue
+            results[batch[i]] = translation
+        
+        if self.memory:
+            for text, translation in results.items():
+                key = self.memory.key(text, args.source_language, target_language, args.gpt_model, temperature, item_prompt)
+                self.memory.put(key, translation)
+        return results
+
+    def transcribe_chunks(self,
+                          chunk_paths: List[str],
+                          model: str = None,
+                          max_workers: int = 4,
+                          profile: str = ''
+                          ) -> List[str]:
+        """
+        Transcribe the chunks of a long audio file concurrently.
+        
+        Args:
+            chunk_paths (list): Paths of the audio chunks, in order
+            model (str): Model to use for transcription. Defaults to "whisper-1".
+            max_workers (int, optional): Number of chunks transcribed at the same time. Defaults to 4.
+            profile (str, optional): Extraction profile the chunks were encoded with, part of the cache key.
+
+        Returns:
+            list: Transcript of every chunk, in the order of the chunks
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(len(chunk_paths), max_workers))) as executor:
+            return list(executor.map(lambda path: self.transcribe(path, model, profile), chunk_paths))
+
+    def translate_chunks(self,
+                         texts: List[str],
+                         args,
+                         target_language: Optional[str] = None,
+                         max_workers: int = 4,
+                         context_chars: int = 500
+                         ) -> str:
+        """
+        Translate the chunk transcripts of a long audio file in parallel and join them in order.
+        
+        Every chunk is translated with the transcript text right before and after it as context,
+        so sentences and terms carry over the chunk edges.
+        
+        Args:
+            texts (list): Transcript of every chunk, in order
+            args: Args instance with the language pair and GPT model
+            target_language (str, optional): Target language to use instead of args.target_language.
+            max_workers (int, optional): Number of chunks translated at the same time. Defaults to 4.
+            context_chars (int, optional): Characters before and after the chunk given as context. Defaults to 500.
+
+        Returns:
+            str: Translated text of all chunks
+        """
+        def translate_chunk(i: int) -> str:
+            if not texts[i].strip():
+                return ""
+            before = " ".join(t for t in texts[:i] if t.strip())[-context_chars:]
+            after = " ".join(t for t in texts[i + 1:] if t.strip())[:context_chars]
+            return self.translate(texts[i], args, target_language=target_language,
+                                  context_before=before, context_after=after)
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(len(texts), max_workers))) as executor:
+            translations = list(executor.map(translate_chunk, range(len(texts))))
+        return " ".join(t.strip() for t in translations if t.strip())
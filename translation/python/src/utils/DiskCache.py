@@ -0,0 +1,160 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import Optional
+
+
+class DiskCache():
+    """
+    Content-addressed on-disk cache shared between workers and processes.
+    
+    Entries are stored under the sha256 of their key parts, written atomically and
+    evicted least recently used first once the cache grows past max_bytes.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024, suffix: str = ''):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = sum(size for _, _, size in self._scan())
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Build a stable content address from any json serializable key parts."""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        """Location of the cache entry for a key, whether it exists or not."""
+        return os.path.join(self.cache_dir, key[:2], f'{key}{self.suffix}')
+
+    def get_path(self, key: str) -> Optional[str]:
+        """
+        Look up a cache entry.
+        
+        Args:
+            key (str): Key built with make_key
+            
+        Returns:
+            str: Path of the cached file, None on a cache miss
+        """
+        path = self.path_for(key)
+        try:
+            # touching the entry on a hit is what makes the eviction LRU
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached bytes for a key, None on a cache miss."""
+        path = self.get_path(key)
+        if not path:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            return None
+
+    def put(self, key: str, data: bytes) -> str:
+        """
+        Atomically store bytes under a key.
+        
+        Returns:
+            str: Path of the cached file
+        """
+        return self._store(key, lambda f: f.write(data))
+
+    def put_file(self, key: str, src_path: str) -> str:
+        """
+        Atomically copy an existing file into the cache under a key, chunk by chunk.
+        
+        Returns:
+            str: Path of the cached file
+        """
+        def copy(f):
+            with open(src_path, 'rb') as src:
+                shutil.copyfileobj(src, f)
+        return self._store(key, copy)
+
+    def _store(self, key: str, write) -> str:
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # write to a temp file in the same directory, readers only ever see complete entries
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+                size = f.tell()
+            try:
+                # re-putting a key replaces its entry, whose bytes leave the cache
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        with self._lock:
+            self._size += size - replaced
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+        return path
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is below 90% of max_bytes."""
+        with self._lock:
+            entries = sorted(self._scan())
+            size = sum(entry_size for _, _, entry_size in entries)
+            target = self.max_bytes * 0.9
+            for _, path, entry_size in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    size -= entry_size
+                except FileNotFoundError:
+                    size -= entry_size
+            self._size = size
+
+    def stats(self) -> dict:
+        """Hit/miss counters of this instance and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size_bytes': self._size,
+            }
+
+    def _scan(self):
+        """Yield (last access time, path, size) of every entry in the cache."""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield (st.st_mtime, path, st.st_size)
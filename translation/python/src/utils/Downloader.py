@@ -0,0 +1,256 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, downloads are then only safe between threads of one process
+    fcntl = None
+
+from src.utils.Metrics import metrics
+
+
+class DownloadManager():
+    """
+    Downloads files into a persistent local cache keyed by URL.
+    
+    Cached files are revalidated with conditional requests (ETag / Last-Modified) instead of
+    being downloaded again, interrupted transfers resume with HTTP Range requests, and large
+    files can be fetched as parallel ranged chunks. A URL is downloaded by one thread or
+    process at a time, so processes can share the cache directory.
+    """
+    def __init__(self, cache_dir: str, parallel_chunks: int = 4,
+                 parallel_threshold: int = 64 * 1024 * 1024, timeout: float = 60):
+        self.cache_dir = cache_dir
+        # files of at least parallel_threshold bytes are split into this many ranged requests
+        self.parallel_chunks = parallel_chunks
+        self.parallel_threshold = parallel_threshold
+        self.timeout = timeout
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max(10, parallel_chunks))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Range offsets and Content-Length count the bytes on the wire, which only match the file unencoded
+        self.session.headers['Accept-Encoding'] = 'identity'
+        
+        self._url_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def fetch(self, url: str) -> str:
+        """
+        Get a local copy of a URL, downloading it only if the cached copy is missing or stale.
+        
+        Args:
+            url (str): URL of the file
+            
+        Returns:
+            str: Path of the cached file
+            
+        Raises:
+            requests.exceptions.RequestException: If the download fails
+        """
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        ext = os.path.splitext(urlparse(url).path)[1]
+        data_path = os.path.join(self.cache_dir, f'{key}{ext}')
+        
+        with self._lock:
+            url_lock = self._url_locks.setdefault(key, threading.Lock())
+        
+        with url_lock, self._file_locked(data_path):
+            meta = self._read_json(f'{data_path}.json')
+            remote = self._head(url, meta if os.path.exists(data_path) else None)
+            
+            if remote is None:
+                print(f'Using cached download of {url}')
+                return data_path
+            
+            with metrics.span('download'):
+                self._download(url, data_path, remote)
+            self._write_json(f'{data_path}.json', {'url': url, **remote['validators']})
+            return data_path
+
+    @contextmanager
+    def _file_locked(self, data_path: str):
+        """Hold a lock on the cached file across processes, so two of them never write the same part file."""
+        if fcntl is None:
+            yield
+            return
+        with open(f'{data_path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _head(self, url: str, meta: Optional[dict]) -> Optional[dict]:
+        """
+        Ask the server about the file, returns None if the cached copy is still current.
+        """
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        
+        try:
+            response = self.session.head(url, headers=headers, allow_redirects=True, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            response = None
+        
+        if response is not None and response.status_code == 304:
+            return None
+        if response is None or response.status_code >= 400:
+            # some servers don't support HEAD, fall back to a plain download
+            return {'validators': {}, 'size': None, 'ranges': False}
+        
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        # servers that ignore conditional headers still tell us whether the file changed
+        if meta and any(validators.values()) and all(meta.get(k) == v for k, v in validators.items()):
+            return None
+        
+        size = response.headers.get('Content-Length')
+        return {
+            'validators': validators,
+            'size': int(size) if size and size.isdigit() else None,
+            'ranges': response.headers.get('Accept-Ranges', '').lower() == 'bytes',
+        }
+
+    def _download(self, url: str, data_path: str, remote: dict):
+        part_path = f'{data_path}.part'
+        part_meta_path = f'{part_path}.json'
+        validator = remote['validators'].get('etag') or remote['validators'].get('last_modified')
+        
+        use_chunks = bool(remote['ranges'] and remote['size'] and self.parallel_chunks > 1
+                          and remote['size'] >= self.parallel_threshold)
+        mode = 'chunks' if use_chunks else 'stream'
+        
+        # a partial download can only be continued if the remote file is still the same one
+        part_meta = self._read_json(part_meta_path)
+        if not (validator and remote['ranges'] and part_meta.get('validator') == validator
+                and part_meta.get('size') == remote['size'] and part_meta.get('mode') == mode
+                and os.path.exists(part_path)):
+            part_meta = {'validator': validator, 'size': remote['size'], 'mode': mode, 'done': []}
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        
+        if use_chunks:
+            self._download_chunks(url, part_path, part_meta, part_meta_path, validator)
+        else:
+            self._download_stream(url, part_path, part_meta, part_meta_path, validator)
+        
+        os.replace(part_path, data_path)
+        if os.path.exists(part_meta_path):
+            os.remove(part_meta_path)
+
+    def _download_stream(self, url, part_path, part_meta, part_meta_path, validator):
+        """Single stream download that resumes from the end of the partial file."""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {}
+        if offset and validator:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validator
+            print(f'Resuming download of {url} at byte {offset}')
+            metrics.add_retry('download')
+        
+        self._write_json(part_meta_path, part_meta)
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            # 200 instead of 206 means the server sent the whole file again
+            resumed = response.status_code == 206
+            if resumed and self._encoded(response):
+                os.remove(part_path)
+                raise requests.exceptions.ConnectionError(f'Server compressed the resumed download of {url}')
+            with open(part_path, 'ab' if resumed else 'wb') as f:
+                self._write_body(response, f)
+
+    def _download_chunks(self, url, part_path, part_meta, part_meta_path, validator):
+        """Parallel ranged download, finished chunks are recorded so a restart only fetches the rest."""
+        size = part_meta['size']
+        chunk_size = -(-size // self.parallel_chunks)
+        ranges = [(start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size)]
+        if part_meta.get('chunk_size') != chunk_size:
+            part_meta['done'] = []
+        part_meta['chunk_size'] = chunk_size
+        
+        if not os.path.exists(part_path):
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+        self._write_json(part_meta_path, part_meta)
+        
+        meta_lock = threading.Lock()
+        
+        def fetch_range(index):
+            start, end = ranges[index]
+            headers = {'Range': f'bytes={start}-{end}', 'If-Range': validator}
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise requests.exceptions.RequestException(f'Server ignored the range request for {url}')
+                if self._encoded(response):
+                    raise requests.exceptions.RequestException(f'Server compressed the range request for {url}')
+                with open(part_path, 'r+b') as f:
+                    f.seek(start)
+                    self._write_body(response, f)
+            with meta_lock:
+                part_meta['done'].append(index)
+                self._write_json(part_meta_path, part_meta)
+        
+        todo = [i for i in range(len(ranges)) if i not in part_meta['done']]
+        if part_meta['done']:
+            metrics.add_retry('download')
+        print(f'Downloading {url} in {len(todo)} parallel chunks')
+        with ThreadPoolExecutor(max_workers=self.parallel_chunks) as executor:
+            list(executor.map(fetch_range, todo))
+
+    @staticmethod
+    def _encoded(response) -> bool:
+        """Whether the server compressed the response although the session asks for identity."""
+        return response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+
+    @staticmethod
+    def _write_body(response, f):
+        """
+        Write a response body to f as it came over the wire, so it lines up with Range offsets.
+        A full response that was compressed anyway is decoded instead.
+        """
+        if DownloadManager._encoded(response):
+            chunks = response.iter_content(chunk_size=1024 * 1024)
+        else:
+            chunks = response.raw.stream(1024 * 1024, decode_content=False)
+        try:
+            for chunk in chunks:
+                f.write(chunk)
+                metrics.add_bytes('download', len(chunk))
+        except urllib3.exceptions.HTTPError as e:
+            # the raw stream raises urllib3 errors, which requests would have wrapped
+            raise requests.exceptions.ConnectionError(e)
+
+    @staticmethod
+    def _read_json(path: str) -> dict:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def _write_json(path: str, data: dict):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
@@ -1,71 +1,266 @@
 import os
+import re
+import hashlib
 import subprocess
 import csv
-import urllib.request
-import requests
+import shutil
+import shlex
+from array import array
+from urllib.parse import urlparse
+from typing import Dict, List, Optional, Tuple
+
+from src.utils.Uploader import Uploader, UploadBackend
+from src.utils.Downloader import DownloadManager
+from src.utils.Metrics import metrics
+
+
+# FFmpeg encodings of extracted audio, every consumer gets a file sized for its use
+AUDIO_PROFILES = {
+    # uncompressed audio at the source sample rate
+    'source': {'ext': 'wav', 'options': ''},
+    # speech recognition runs at 16kHz mono, lossless flac is about a tenth of a source wav
+    'transcription': {'ext': 'flac', 'options': '-ac 1 -ar 16000 -c:a flac'},
+    # smallest upload for speech recognition, opus at 24kbps
+    'transcription_opus': {'ext': 'ogg', 'options': '-ac 1 -ar 16000 -c:a libopus -b:a 24k -application voip'},
+    # voice cloning keeps the full bandwidth of the voice in a mono mp3
+    'clone': {'ext': 'mp3', 'options': '-ac 1 -ar 44100 -b:a 128k'},
+}
 
 
 class FileProcessor():
     """
     Handles video downloading, audio extraction, handling of csv files.
     """
-    def __init__(self, root_dir: str):
+    def __init__(self, root_dir: str, upload_backend: Optional[UploadBackend] = None):
         self.root_dir = root_dir
+        # uploads go to uguu unless another backend is passed in
+        self.uploader = Uploader(upload_backend)
+        self.downloader = DownloadManager(os.path.join(self.root_dir, "Data/Cache/downloads"))
     
     def download(self, url: str) -> str:
-        """Download files from URL and return the local file path."""
+        """
+        Download files from URL and return the local file path.
+        
+        The file comes from the download cache, which only transfers it again if it changed
+        on the server, so callers can delete the returned copy as before.
+        """
         
         dir = f"Data/Inputs"
         full_path = os.path.join(self.root_dir, dir)
         os.makedirs(full_path, exist_ok=True)
-        local_filename = os.path.join(dir, os.path.basename(url))
-        urllib.request.urlretrieve(url, local_filename)
+        local_filename = os.path.join(dir, self.local_name(url))
+        cached_path = self.downloader.fetch(url)
+        
+        # hard link the cached file into place, copy it where links aren't supported
+        if os.path.exists(local_filename):
+            os.remove(local_filename)
+        try:
+            os.link(cached_path, local_filename)
+        except OSError:
+            shutil.copyfile(cached_path, local_filename)
         
         return local_filename
     
-    def run_ffmpeg_command(self, command: str):
-        process = subprocess.run(
-            command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+    @staticmethod
+    def local_name(url: str) -> str:
+        """
+        File name of the local copy of a URL, prefixed with a hash of the URL.
+        
+        Videos with the same file name at different URLs get their own local copies, and so
+        do the audio and speech files named after them.
+        """
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]
+        return f"{digest}_{os.path.basename(urlparse(url).path)}"
+    
+    def run_ffmpeg_command(self, command: str) -> bytes:
+        with metrics.span('ffmpeg') as span:
+            process = subprocess.run(
+                command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            if process.returncode != 0:
+                span.fail()
         if process.returncode != 0:
             print(f"FFmpeg error: {process.stderr.decode()}")
             raise Exception("FFmpeg command failed for extracting audio")
+        return process.stdout
         
-    def extract_audio(self, video_path: str) -> str:
-        """ Extract audio from video file using FFmpeg. """
+    def audio_options(self, profile: str) -> str:
+        """FFmpeg output options of an extraction profile, encoded bitexact so the same input gives identical files."""
+        if profile not in AUDIO_PROFILES:
+            raise ValueError(f"Unknown audio profile {profile}, choose one of {', '.join(AUDIO_PROFILES)}")
+        options = AUDIO_PROFILES[profile]['options']
+        return f"{options} -map_metadata -1 -fflags +bitexact -flags:a +bitexact".strip()
+    
+    def extract_audio(self, video_path: str, profile: str = 'source') -> str:
+        """ Extract audio from video file using FFmpeg, encoded by one of the AUDIO_PROFILES. """
                 
-        # Generate audio filename
+        options = self.audio_options(profile)
+        # Generate audio filename, downloaded videos are named after a hash of their URL so it is unique per video
         dir = f"Data/Inputs"
         file_name = os.path.basename(video_path)
         stem = os.path.splitext(file_name)[0]
-        audio_filename = f"{stem}_audio.wav"
+        audio_filename = f"{stem}_{profile}.{AUDIO_PROFILES[profile]['ext']}"
         audio_path = os.path.join(dir,audio_filename)
         
         # Construct FFmpeg command
-        command = f"ffmpeg -i {video_path} -vn {audio_path}"
+        command = f"ffmpeg -y -i {shlex.quote(video_path)} -vn {options} {shlex.quote(audio_path)}"
         self.run_ffmpeg_command(command)
         
         return audio_path
 
-    def upload_file_uguu(self, file_path: str):
-        """Upload a local file to uguu and get the url"""
-    
-        try:
-            url = 'https://uguu.se/upload'
-            with open(file_path, "rb") as audio_file: 
-                data = [('files[]', audio_file)]
-                response = requests.post(url, files=data)
-            res = response.json()
-            if res['success']:
-                output = res['files'][0]['url']
-                return output
-            else:
-                print(f"Error {res['errorcode']} during upload: {res['description']}")
-               
-        except Exception as e:
-            print(f"Error during upload: {str(e)}")
-            return None
-        return None
+    def extract_audio_sample(self, source: str, duration: int = 60, best_energy: bool = False,
+                             scan_seconds: Optional[int] = None, profile: str = 'clone') -> str:
+        """
+        Extract a bounded, compact audio sample for voice cloning using FFmpeg.
+        
+        FFmpeg reads the source directly, so a URL is streamed instead of downloaded first,
+        and only the sampled part of the source is read. Time and disk usage therefore stay
+        the same whatever the length of the source video.
+        
+        Args:
+            source (str): URL or local path of the video
+            duration (int, optional): Length of the sample in seconds. Defaults to 60.
+            best_energy (bool, optional): Pick the loudest window of the first scan_seconds
+                                          instead of the first seconds. Defaults to False.
+            scan_seconds (int, optional): How much of the source to scan for the loudest
+                                          window. Defaults to 5 times the duration.
+            profile (str, optional): Encoding from AUDIO_PROFILES. Defaults to the mono mp3 'clone' profile.
+            
+        Returns:
+            str: Path of the extracted sample
+        """
+        dir = f"Data/Inputs"
+        os.makedirs(os.path.join(self.root_dir, dir), exist_ok=True)
+        stem = os.path.splitext(os.path.basename(urlparse(source).path))[0]
+        options = self.audio_options(profile)
+        audio_path = os.path.join(dir, f"{stem}_sample.{AUDIO_PROFILES[profile]['ext']}")
+        
+        start = 0
+        if best_energy:
+            start = self.loudest_window(source, duration, scan_seconds or 5 * duration)
+        
+        # bitexact output keeps the sample byte identical between runs so it can be fingerprinted
+        command = (
+            f"ffmpeg -y -ss {start} -t {duration} -i {shlex.quote(source)} -vn {options} {shlex.quote(audio_path)}"
+        )
+        self.run_ffmpeg_command(command)
+        
+        return audio_path
+
+    def loudest_window(self, source: str, duration: int, scan_seconds: int) -> int:
+        """
+        Find the start second of the loudest window of the given duration in the first
+        scan_seconds of the source, decoded by FFmpeg to low rate PCM through a pipe.
+        """
+        sample_rate = 8000
+        command = (
+            f"ffmpeg -t {scan_seconds} -i {shlex.quote(source)} -vn -ac 1 -ar {sample_rate} "
+            f"-f s16le -acodec pcm_s16le pipe:1"
+        )
+        samples = array('h')
+        samples.frombytes(self.run_ffmpeg_command(command))
+        
+        # energy of every second, then the best run of `duration` consecutive seconds
+        energy = [
+            sum(x * x for x in samples[i:i + sample_rate])
+            for i in range(0, len(samples), sample_rate)
+        ]
+        if len(energy) <= duration:
+            return 0
+        window = best = sum(energy[:duration])
+        best_start = 0
+        for i in range(1, len(energy) - duration + 1):
+            window += energy[i + duration - 1] - energy[i - 1]
+            if window > best:
+                best, best_start = window, i
+        return best_start
+
+    def split_audio_on_silence(self, audio_path: str, chunk_seconds: int = 300,
+                               min_silence: float = 0.5, noise_db: int = -35,
+                               profile: str = 'transcription') -> List[Dict]:
+        """
+        Split an audio file into chunks of about chunk_seconds, cut at silences so no word
+        is split between two chunks.
+        
+        Every chunk is encoded by the given profile, the 16kHz mono flac of the default
+        transcription profile keeps a 5 minute chunk well below the Whisper upload limit.
+        A chunk is cut at the last silence in the second half of its window, or at the
+        window end if there is no silence there.
+        
+        Args:
+            audio_path (str): Path of the audio file
+            chunk_seconds (int, optional): Maximum length of a chunk in seconds. Defaults to 300.
+            min_silence (float, optional): Minimum length of a silence in seconds. Defaults to 0.5.
+            noise_db (int, optional): Level in dB below which audio counts as silence. Defaults to -35.
+            profile (str, optional): Encoding of the chunks from AUDIO_PROFILES. Defaults to 'transcription'.
+            
+        Returns:
+            list: Chunks in order, dicts with the 'path', 'start' and 'end' seconds of every chunk
+        """
+        duration, silences = self.detect_silences(audio_path, min_silence, noise_db)
+        
+        # cut points are the middle of the silences
+        candidates = [(start + end) / 2 for start, end in silences]
+        cuts = [0.0]
+        while duration - cuts[-1] > chunk_seconds:
+            window_end = cuts[-1] + chunk_seconds
+            inside = [c for c in candidates if cuts[-1] + chunk_seconds / 2 <= c <= window_end]
+            cuts.append(inside[-1] if inside else window_end)
+        cuts.append(duration)
+        
+        options = self.audio_options(profile)
+        stem = os.path.splitext(os.path.basename(audio_path))[0]
+        chunks = []
+        for i, (start, end) in enumerate(zip(cuts, cuts[1:])):
+            chunk_path = os.path.join(os.path.dirname(audio_path), f"{stem}_chunk{i}.{AUDIO_PROFILES[profile]['ext']}")
+            command = (
+                f"ffmpeg -y -ss {start:.3f} -t {end - start:.3f} -i {shlex.quote(audio_path)} "
+                f"-vn {options} {shlex.quote(chunk_path)}"
+            )
+            self.run_ffmpeg_command(command)
+            chunks.append({'path': chunk_path, 'start': start, 'end': end})
+        
+        return chunks
+
+    def detect_silences(self, audio_path: str, min_silence: float = 0.5,
+                        noise_db: int = -35) -> Tuple[float, List[Tuple[float, float]]]:
+        """Get the duration of an audio file and its silences as (start, end) seconds, using FFmpeg silencedetect."""
+        command = (
+            f"ffmpeg -i {shlex.quote(audio_path)} -vn "
+            f"-af silencedetect=noise={noise_db}dB:d={min_silence} -f null -"
+        )
+        with metrics.span('ffmpeg') as span:
+            process = subprocess.run(
+                command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            if process.returncode != 0:
+                span.fail()
+        if process.returncode != 0:
+            print(f"FFmpeg error: {process.stderr.decode()}")
+            raise Exception("FFmpeg command failed for detecting silences")
+        log = process.stderr.decode(errors='replace')
+        
+        # silencedetect reports on stderr, the last time= progress line is the decoded duration
+        times = re.findall(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)", log)
+        if times:
+            h, m, s = times[-1]
+        else:
+            h, m, s = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", log).groups()
+        duration = int(h) * 3600 + int(m) * 60 + float(s)
+        
+        starts = [float(x) for x in re.findall(r"silence_start: (-?\d+(?:\.\d+)?)", log)]
+        ends = [float(x) for x in re.findall(r"silence_end: (\d+(?:\.\d+)?)", log)]
+        # a silence running into the end of the audio has no silence_end
+        ends += [duration] * (len(starts) - len(ends))
+        return duration, [(max(0.0, s), e) for s, e in zip(starts, ends)]
+
+    def upload_file(self, file_path: str) -> Optional[str]:
+        """Upload a local file through the upload backend and get the url, identical files are only uploaded once"""
+        return self.uploader.upload(file_path)
+
+    def upload_file_uguu(self, file_path: str) -> Optional[str]:
+        """Upload a local file and get the url, kept for backwards compatibility, see upload_file"""
+        return self.upload_file(file_path)
     
     def check_required_keys(self, args_instance):
         # Define the required keys
@@ -86,19 +281,43 @@ class FileProcessor():
             'transcription_model': 'whisper-1',
             'source_language': '',
             "output_json_path": 'output.json',
+            'max_workers': 4,
             'sync_mode': "bounce",
             'segment_start': -1,
-            'segment_end': -1
+            'segment_end': -1,
+            'tts_cache_dir': '',
+            'tts_cache_max_mb': 1024,
+            'translation_memory_dir': '',
+            'translation_memory_max_mb': 256,
+            'transcription_cache_dir': '',
+            'transcription_cache_max_mb': 256,
+            'clone_sample_seconds': 60,
+            'clone_sample_best_energy': False,
+            'transcription_profile': 'transcription',
+            'clone_profile': 'clone',
+            'long_form': False,
+            'chunk_seconds': 300,
+            'manifest_path': '',
+            'results_path': 'results.json',
+            'manifest_workers': 4,
+            'stage_limits': {},
+            'metrics_report_path': '',
+            'metrics_port': 0
         }
+        
+        # videos and languages come from the manifest in batch mode
+        if getattr(args_instance, 'manifest_path', ''):
+            required_keys.pop('input_vid_url')
+            required_keys.pop('target_language')
                 
         # Check required keys
         for key, message in required_keys.items():
-            if not hasattr(args_instance, key) or getattr(args_instance, key) == "":
+            if not hasattr(args_instance, key) or getattr(args_instance, key) in ("", [], ()):
                 raise ValueError(f'Missing field in args.py: {message}')
         
         # Update default values for conditional keys
         for key, value in conditional_keys.items():
             if not hasattr(args_instance, key) or getattr(args_instance, key) == "":
-                args_instance.key = value
+                setattr(args_instance, key, value)
         
         return args_instance
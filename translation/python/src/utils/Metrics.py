@@ -0,0 +1,219 @@
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+class Span():
+    """A timed stage call, used to add the bytes it moved and the retries it needed."""
+
+    def __init__(self, metrics: 'Metrics', stage: str):
+        self.metrics = metrics
+        self.stage = stage
+        self.failed = False
+
+    def add_bytes(self, count: int):
+        self.metrics.add_bytes(self.stage, count)
+
+    def retry(self):
+        self.metrics.add_retry(self.stage)
+
+    def fail(self):
+        """Count the call as an error without raising, for calls that report failures by their result."""
+        self.failed = True
+
+
+class Metrics():
+    """
+    Thread safe per stage instrumentation: a latency histogram, bytes moved, retries and errors.
+
+    Memory use is fixed per stage whatever the number of calls, latencies are counted in
+    histogram buckets and percentiles are estimated from them. The metrics are exported as a
+    JSON run report and in the Prometheus text format, optionally served over HTTP.
+    """
+    # upper bounds in seconds of the latency histogram buckets
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded stages, a new run starts from here."""
+        with self._lock:
+            self._stages = {}
+            self.started = time.time()
+
+    def _stage(self, stage: str) -> dict:
+        # called with the lock held
+        if stage not in self._stages:
+            self._stages[stage] = {
+                'count': 0, 'errors': 0, 'sum': 0.0, 'min': math.inf, 'max': 0.0,
+                'buckets': [0] * (len(self.BUCKETS) + 1), 'bytes': 0, 'retries': 0,
+            }
+        return self._stages[stage]
+
+    @contextmanager
+    def span(self, stage: str):
+        """
+        Time the block as a call of the stage, a block that raises is counted as an error.
+
+        Example:
+            with metrics.span('upload') as span:
+                span.add_bytes(os.path.getsize(path))
+                url = backend.upload(path)
+        """
+        start = time.perf_counter()
+        span = Span(self, stage)
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, error or span.failed)
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        """Record a call of the stage that took the given seconds."""
+        index = next((i for i, bound in enumerate(self.BUCKETS) if seconds <= bound), len(self.BUCKETS))
+        with self._lock:
+            data = self._stage(stage)
+            data['count'] += 1
+            data['errors'] += int(error)
+            data['sum'] += seconds
+            data['min'] = min(data['min'], seconds)
+            data['max'] = max(data['max'], seconds)
+            data['buckets'][index] += 1
+
+    def add_bytes(self, stage: str, count: int):
+        with self._lock:
+            self._stage(stage)['bytes'] += count
+
+    def add_retry(self, stage: str, count: int = 1):
+        with self._lock:
+            self._stage(stage)['retries'] += count
+
+    def _quantile(self, data: dict, q: float) -> float:
+        """Estimate a latency percentile by interpolating inside its histogram bucket."""
+        rank = q * data['count']
+        seen = 0
+        for i, count in enumerate(data['buckets']):
+            if count and seen + count >= rank:
+                lower = self.BUCKETS[i - 1] if i > 0 else 0.0
+                upper = self.BUCKETS[i] if i < len(self.BUCKETS) else data['max']
+                estimate = lower + (upper - lower) * (rank - seen) / count
+                return min(max(estimate, data['min']), data['max'])
+            seen += count
+        return data['max']
+
+    def report(self) -> dict:
+        """Summary of every stage: calls, errors, latency percentiles in seconds, bytes and retries."""
+        with self._lock:
+            stages = {stage: dict(data, buckets=list(data['buckets'])) for stage, data in self._stages.items()}
+            started = self.started
+
+        summary = {}
+        for stage, data in sorted(stages.items()):
+            count = data['count']
+            summary[stage] = {
+                'count': count,
+                'errors': data['errors'],
+                'total_seconds': round(data['sum'], 3),
+                'mean_seconds': round(data['sum'] / count, 3) if count else 0,
+                'p50_seconds': round(self._quantile(data, 0.5), 3) if count else 0,
+                'p90_seconds': round(self._quantile(data, 0.9), 3) if count else 0,
+                'p99_seconds': round(self._quantile(data, 0.99), 3) if count else 0,
+                'min_seconds': round(data['min'], 3) if count else 0,
+                'max_seconds': round(data['max'], 3),
+                'bytes': data['bytes'],
+                'retries': data['retries'],
+            }
+        return {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+            'duration_seconds': round(time.time() - started, 3),
+            'stages': summary,
+        }
+
+    def write_report(self, path: str, extra: Optional[Dict] = None):
+        """Write the JSON run report, with any extra fields of the run."""
+        report = self.report()
+        report.update(extra or {})
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f'Run report written to {path}')
+
+    def prometheus(self) -> str:
+        """All stages in the Prometheus text exposition format."""
+        with self._lock:
+            stages = {stage: dict(data, buckets=list(data['buckets'])) for stage, data in self._stages.items()}
+
+        lines = [
+            '# HELP pipeline_stage_seconds Latency of pipeline stage calls.',
+            '# TYPE pipeline_stage_seconds histogram',
+        ]
+        for stage, data in sorted(stages.items()):
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), data['buckets']):
+                cumulative += count
+                lines.append(f'pipeline_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'pipeline_stage_seconds_sum{{stage="{stage}"}} {data["sum"]}')
+            lines.append(f'pipeline_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+        for name, field, help_text in (
+            ('pipeline_stage_errors_total', 'errors', 'Failed pipeline stage calls.'),
+            ('pipeline_stage_bytes_total', 'bytes', 'Bytes moved by pipeline stages.'),
+            ('pipeline_stage_retries_total', 'retries', 'Retries of pipeline stage calls.'),
+        ):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            lines.extend(f'{name}{{stage="{stage}"}} {data[field]}' for stage, data in sorted(stages.items()))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """Serve the Prometheus metrics on http://host:port/metrics from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes would flood the pipeline output
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f'Serving Prometheus metrics on http://{host}:{server.server_address[1]}/metrics')
+        return server
+
+    @contextmanager
+    def recording(self, report_path: str = '', port: int = 0):
+        """
+        Record a run: the metrics are reset, served while the block runs if a port is given,
+        and the JSON run report is written when the block ends, also if it raised.
+        """
+        self.reset()
+        server = self.serve(port) if port else None
+        try:
+            yield self
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+            if report_path:
+                self.write_report(report_path)
+
+
+# default instance the services record into
+metrics = Metrics()
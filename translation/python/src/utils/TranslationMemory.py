@@ -0,0 +1,80 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from src.utils.DiskCache import DiskCache
+
+
+class TranslationMemory():
+    """
+    Persistent exact-match translation memory.
+    
+    Translations are keyed on the normalized source text, language pair, model, temperature
+    and prompt. They are stored in a size-bounded DiskCache shared between processes, with
+    an in-memory LRU in front so strings repeated within a run are served without disk access.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 256 * 1024 * 1024, max_memory_entries: int = 10000):
+        self.disk = DiskCache(cache_dir, max_bytes, suffix='.txt')
+        self.max_memory_entries = max_memory_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Unicode NFC form with runs of spaces and tabs collapsed, line breaks are kept."""
+        text = unicodedata.normalize('NFC', text)
+        lines = [re.sub(r'[ \t]+', ' ', line).strip() for line in text.strip().splitlines()]
+        return '\n'.join(lines)
+
+    def key(self, text: str, source_language: str, target_language: str,
+            model: str, temperature: float, prompt: str) -> str:
+        """Content address of a translation request."""
+        return DiskCache.make_key(self.normalize(text), source_language, target_language, model, temperature, prompt)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the stored translation for a key, None if the string wasn't translated before."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+        
+        data = self.disk.get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        translation = data.decode('utf-8')
+        self._remember(key, translation)
+        return translation
+
+    def put(self, key: str, translation: str):
+        """Store a translation."""
+        self.disk.put(key, translation.encode('utf-8'))
+        self._remember(key, translation)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and the size of the memory on disk."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'size_bytes': self.disk.stats()['size_bytes'],
+            }
+
+    def _remember(self, key: str, translation: str):
+        with self._lock:
+            self._memory[key] = translation
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
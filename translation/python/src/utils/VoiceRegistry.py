@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, the registry is then only safe between threads of one process
+    fcntl = None
+
+
+class VoiceRegistry():
+    """
+    Local registry of cloned voices keyed by a fingerprint of the reference media.
+    
+    Reuses an existing voice_id instead of cloning the same speaker again. The registry is
+    a json file guarded by a file lock so concurrent runs share it, and voices that no
+    longer exist on ElevenLabs or are older than max_age_days are dropped.
+    """
+    def __init__(self, path: str, max_age_days: Optional[float] = None, revalidate_after: float = 24 * 60 * 60):
+        self.path = path
+        self.max_age = max_age_days * 24 * 60 * 60 if max_age_days else None
+        # seconds before a registered voice is checked against ElevenLabs again
+        self.revalidate_after = revalidate_after
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+    @staticmethod
+    def fingerprint(file_path: str, profile: str = '') -> str:
+        """sha256 of the reference video or audio file, read in chunks, and the audio profile the voice is cloned from."""
+        sha = hashlib.sha256()
+        if profile:
+            sha.update(f'{profile}\0'.encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def lookup(self, fingerprint: str, validator: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """
+        Find the voice cloned from the same reference.
+        
+        Args:
+            fingerprint (str): Fingerprint of the reference file
+            validator (callable, optional): Called with a voice_id, returns False if the voice is gone
+            
+        Returns:
+            str: voice_id of the registered voice, None if there is no valid one
+        """
+        with self._locked():
+            voices = self._load()
+            voice_id = self._valid_voice(voices, fingerprint, validator)
+            self._save(voices)
+            return voice_id
+
+    def get_or_create(self, fingerprint: str, create: Callable[[], str],
+                      validator: Optional[Callable[[str], bool]] = None, source: str = '') -> str:
+        """
+        Return the registered voice for a fingerprint, cloning it with create() if there is none.
+        
+        The registry stays locked while cloning, so concurrent runs for the same speaker
+        wait for the first clone instead of cloning it again.
+        
+        Args:
+            fingerprint (str): Fingerprint of the reference file
+            create (callable): Clones the voice and returns its voice_id
+            validator (callable, optional): Called with a voice_id, returns False if the voice is gone
+            source (str, optional): Where the reference came from, stored for reference
+            
+        Returns:
+            str: voice_id of the registered or newly cloned voice
+        """
+        with self._locked():
+            voices = self._load()
+            voice_id = self._valid_voice(voices, fingerprint, validator)
+            if voice_id:
+                print(f'Reusing registered voice clone {voice_id}')
+            else:
+                voice_id = create()
+                now = time.time()
+                voices[fingerprint] = {'voice_id': voice_id, 'source': source, 'created_at': now, 'validated_at': now}
+            self._save(voices)
+            return voice_id
+
+    def _valid_voice(self, voices: dict, fingerprint: str, validator) -> Optional[str]:
+        entry = voices.get(fingerprint)
+        if not entry:
+            return None
+        
+        now = time.time()
+        if self.max_age and now - entry['created_at'] > self.max_age:
+            del voices[fingerprint]
+            return None
+        if validator and now - entry.get('validated_at', 0) > self.revalidate_after:
+            if not validator(entry['voice_id']):
+                print(f"Registered voice {entry['voice_id']} no longer exists, cloning again")
+                del voices[fingerprint]
+                return None
+            entry['validated_at'] = now
+        return entry['voice_id']
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f'{self.path}.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self, voices: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(voices, f, indent=4)
+        os.replace(tmp_path, self.path)